@@ -0,0 +1,289 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import statistics
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from metrics import ADMISSION_INFLIGHT, ADMISSION_LIMIT, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Concurrency limit bounds; the limit itself adapts between them
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "8"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "1"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "64"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10.0"))
+# Recent upstream latency above baseline * tolerance is treated as a sign of overload
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2.0"))
+ADMISSION_BACKOFF = 0.9
+# Upstream latency samples per work class: the baseline window and the recent window
+ADMISSION_RTT_WINDOW = 200
+ADMISSION_RECENT_SAMPLES = 10
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+
+
+class AdmissionRejected(Exception):
+    """The request was shed: queue full (429) or queued past its timeout (503)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Permit:
+    """One admitted request; release it exactly once when the work is done"""
+
+    def __init__(self, limiter: "AdaptiveLimiter", queue_wait: float, inflight: int, work: str):
+        self.limiter = limiter
+        self.queue_wait = queue_wait
+        self.started = time.perf_counter()
+        # Concurrency at admission time: only saturated samples may grow the limit
+        self.inflight = inflight
+        self.work = work
+        self.upstream_latency: Optional[float] = None
+        self.released = False
+
+    def observe(self, latency: float):
+        """Record the request's upstream call time, the only latency the limit reacts to"""
+        if not self.released:
+            self.upstream_latency = latency
+
+    def release(self, overloaded: bool = False):
+        if not self.released:
+            self.released = True
+            self.limiter._release(self, time.perf_counter() - self.started, overloaded)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_wait_ms": round(self.queue_wait * 1000, 3),
+            "limit": self.limiter.limit,
+            "queued": len(self.limiter._queue),
+        }
+
+
+_current: ContextVar[Optional[Permit]] = ContextVar("admission_permit", default=None)
+
+
+def observe_upstream(latency: float):
+    """Report a completed upstream call to the current request's permit
+
+    Called where the provider call finishes, so cache hits and fallbacks
+    never produce a sample and a stream is timed without the client's reads.
+    """
+    permit = _current.get()
+    if permit is not None:
+        permit.observe(latency)
+
+
+class LatencyWindow:
+    """Upstream latencies of one work class
+
+    The baseline is the median of the long window and the signal is the
+    median of the last few samples, so neither one fast outlier nor one
+    slow call moves the limit.
+    """
+
+    def __init__(self, size: int = ADMISSION_RTT_WINDOW, recent: int = ADMISSION_RECENT_SAMPLES):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.recent: Deque[float] = deque(maxlen=recent)
+
+    def add(self, latency: float):
+        self.samples.append(latency)
+        self.recent.append(latency)
+
+    @property
+    def ready(self) -> bool:
+        # Enough history that the recent window is not most of the baseline
+        return len(self.samples) >= 2 * self.recent.maxlen
+
+    def baseline(self) -> float:
+        return statistics.median(self.samples)
+
+    def current(self) -> float:
+        return statistics.median(self.recent)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self.samples),
+            "baseline_ms": round(self.baseline() * 1000, 1),
+            "recent_ms": round(self.current() * 1000, 1),
+        }
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded priority wait queue
+
+    Only upstream call latency (see ``observe_upstream``) drives the limit.
+    It is tracked per work class, because a snippet and an application
+    differ by far more than any overload signal. The limit grows by about
+    one for every ``limit`` sampled requests that finish while the limit
+    was in use. It is cut by ``ADMISSION_BACKOFF`` (at most once per
+    recent round trip) when the class's recent median rises past its
+    baseline median times ``tolerance``, or when the work reports overload.
+    Requests beyond the limit wait in priority order; a full queue is
+    rejected at once with 429 and a request that waits too long with 503,
+    both with a Retry-After estimate.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = ADMISSION_INITIAL_LIMIT,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        tolerance: float = ADMISSION_LATENCY_TOLERANCE,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.inflight = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._windows: Dict[str, LatencyWindow] = {}
+        self._last_decrease = 0.0
+        self.avg_latency: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.limit_increases = 0
+        self.limit_decreases = 0
+        self.queue_wait_total = 0.0
+        ADMISSION_LIMIT.labels().set(self.limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _retry_after(self) -> int:
+        latency = self.avg_latency or 1.0
+        return max(1, math.ceil(latency * (len(self._queue) + 1) / self.limit))
+
+    async def acquire(self, priority: str = "default", timeout: Optional[float] = None, work: str = "default") -> Permit:
+        """Wait for a slot in priority order, or raise AdmissionRejected
+
+        ``timeout`` (the caller's remaining deadline) can only shorten the
+        queue timeout. ``work`` is the request's latency class, such as its
+        prompt class. The permit becomes the current one for ``observe_upstream``.
+        """
+        if self.inflight < self.limit and not self._queue:
+            self.inflight += 1
+            return self._admit(priority, 0.0, work)
+
+        if len(self._queue) >= self.queue_size:
+            self.rejected += 1
+            ADMISSION_REJECTED.labels("429").inc()
+            raise AdmissionRejected(429, "Too many requests queued, retry later", self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (PRIORITIES.get(priority, PRIORITIES["default"]), next(self._seq), future)
+        heapq.heappush(self._queue, entry)
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                future, timeout=self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+            )
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            self.timeouts += 1
+            ADMISSION_REJECTED.labels("503").inc()
+            raise AdmissionRejected(503, "Server busy, request timed out in queue", self._retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as the client went away: pass it on
+                self.inflight -= 1
+                self._dispatch()
+            else:
+                self._discard(entry)
+            raise
+        wait = time.perf_counter() - queued_at
+        self.queue_wait_total += wait
+        return self._admit(priority, wait, work)
+
+    def _admit(self, priority: str, wait: float, work: str) -> Permit:
+        # The slot is already counted in inflight
+        self.admitted += 1
+        ADMISSION_QUEUE_WAIT.labels(priority if priority in PRIORITIES else "default").observe(wait)
+        ADMISSION_INFLIGHT.labels().set(self.inflight)
+        permit = Permit(self, wait, self.inflight, work)
+        _current.set(permit)
+        return permit
+
+    def _discard(self, entry: Tuple[int, int, asyncio.Future]):
+        try:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+        except ValueError:
+            pass
+
+    def _dispatch(self):
+        while self._queue and self.inflight < self.limit:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.inflight += 1
+            future.set_result(None)
+
+    def _release(self, permit: Permit, held: float, overloaded: bool):
+        self.inflight -= 1
+        # Slot hold time, for the Retry-After estimate only
+        self.avg_latency = held if self.avg_latency is None else 0.9 * self.avg_latency + 0.1 * held
+
+        window = None
+        if permit.upstream_latency is not None:
+            window = self._windows.setdefault(permit.work, LatencyWindow())
+            window.add(permit.upstream_latency)
+            if window.ready and window.current() > window.baseline() * self.tolerance:
+                overloaded = True
+
+        now = time.perf_counter()
+        if overloaded:
+            # Give each cut a current round trip to take effect
+            round_trip = window.current() if window is not None else self.avg_latency
+            if now - self._last_decrease > round_trip and self._limit > self.min_limit:
+                self._last_decrease = now
+                self._limit = max(self.min_limit, self._limit * ADMISSION_BACKOFF)
+                self.limit_decreases += 1
+                logger.debug(f"Admission limit decreased to {self.limit}")
+        elif window is not None and permit.inflight >= self.limit and self._limit < self.max_limit:
+            before = self.limit
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            if self.limit > before:
+                self.limit_increases += 1
+        self._dispatch()
+        ADMISSION_LIMIT.labels().set(self.limit)
+        ADMISSION_INFLIGHT.labels().set(self.inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        queued = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for priority, _, future in self._queue:
+            if not future.done():
+                queued[names[priority]] += 1
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "queued": queued,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_timeouts": self.timeouts,
+            "limit_increases": self.limit_increases,
+            "limit_decreases": self.limit_decreases,
+            "latency": {work: window.stats() for work, window in self._windows.items()},
+            "avg_queue_wait_ms": round(self.queue_wait_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+        }
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from build_analysis import BuildAnalysis, CodeBlock, CodeBuffer
+from metrics import AGENT_DURATION
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Simulated agent latency is opt-in so real agent work decides end-to-end latency
+AGENT_SIMULATED_LATENCY = os.getenv("AGENT_SIMULATED_LATENCY", "0").lower() in ("1", "true", "yes")
+AGENT_DEADLINE = float(os.getenv("AGENT_DEADLINE", "10.0"))
+
+
+async def simulated_delay(seconds: float):
+    """Sleep only when simulated agent latency is switched on"""
+    if AGENT_SIMULATED_LATENCY:
+        await asyncio.sleep(seconds)
+
+
+class AgentSpec:
+    """Declares an agent, the agents it depends on and its deadline"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[["AgentContext"], Awaitable[Dict[str, Any]]],
+        depends_on: Iterable[str] = (),
+        deadline: float = AGENT_DEADLINE,
+        streaming: bool = False,
+    ):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.deadline = deadline
+        # Streaming agents start immediately and read the code as it is generated
+        self.streaming = streaming
+
+
+class AgentContext:
+    """Inputs handed to an agent: prompt, code (whole or incremental) and upstream results"""
+
+    def __init__(
+        self,
+        prompt: str,
+        feed: "CodeFeed",
+        results: Dict[str, Dict[str, Any]],
+        batched: bool = False,
+        timestamp: Optional[str] = None,
+    ):
+        self.prompt = prompt
+        self.results = results
+        # Part of a batch request: agents may trade latency for throughput
+        self.batched = batched
+        # Taken once per request and shared by every agent result
+        self.timestamp = timestamp or datetime.now().isoformat()
+        self._feed = feed
+
+    @property
+    def code(self) -> str:
+        """Complete generated code (only valid once generation has finished)"""
+        return self._feed.text
+
+    async def wait_code(self) -> str:
+        await self._feed.finished.wait()
+        return self._feed.text
+
+    def iter_code(self) -> AsyncIterator[str]:
+        """Code deltas from the start of generation, as they arrive"""
+        return self._feed.subscribe()
+
+    def iter_blocks(self) -> AsyncIterator[CodeBlock]:
+        """Fenced code blocks in output order, each as soon as its closing fence arrives"""
+        return self._feed.subscribe_blocks()
+
+    def analysis(self) -> BuildAnalysis:
+        """Build analysis of the complete code, computed once per run"""
+        return self._feed.analysis()
+
+
+class CodeFeed:
+    """Generated code fed to agents incrementally
+
+    Deltas go into one CodeBuffer, which splits out fenced blocks as their
+    closing fences arrive, so block subscribers can start before
+    generation ends.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.buffer = CodeBuffer()
+        self.finished = asyncio.Event()
+        self._text: Optional[str] = None
+        self._analysis: Optional[BuildAnalysis] = None
+        self._changed = asyncio.Event()
+
+    def append(self, delta: str):
+        self.chunks.append(delta)
+        self.buffer.append(delta)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self, text: Optional[str] = None):
+        if text is not None and not self.chunks:
+            self.chunks.append(text)
+            self.buffer.append(text)
+        self.buffer.finish()
+        self._text = text if text is not None else self.buffer.text()
+        self.finished.set()
+        self._changed.set()
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            raise RuntimeError("Code generation has not finished yet")
+        return self._text
+
+    def analysis(self) -> BuildAnalysis:
+        if not self.finished.is_set():
+            raise RuntimeError("Code generation has not finished yet")
+        if self._analysis is None:
+            self._analysis = self.buffer.analysis()
+        return self._analysis
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.finished.is_set():
+                return
+            await self._changed.wait()
+
+    async def subscribe_blocks(self) -> AsyncIterator[CodeBlock]:
+        blocks = self.buffer.blocks
+        index = 0
+        while True:
+            while index < len(blocks):
+                yield blocks[index]
+                index += 1
+            if self.finished.is_set():
+                return
+            await self._changed.wait()
+
+
+class AgentRun:
+    """One execution of the agent DAG for a single request"""
+
+    def __init__(self, engine: "AgentEngine", prompt: str, batched: bool = False, timestamp: Optional[str] = None):
+        self.engine = engine
+        self.feed = CodeFeed()
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.context = AgentContext(prompt, self.feed, self.results, batched, timestamp)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._completed: asyncio.Queue = asyncio.Queue()
+        self._progress = asyncio.Event()
+        self._supervisor = asyncio.ensure_future(self._schedule())
+
+    def feed_code(self, delta: str):
+        self.feed.append(delta)
+
+    def finish_code(self, code: Optional[str] = None):
+        self.feed.finish(code)
+
+    def ready(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Agent results that finished since the last call, without waiting"""
+        finished = []
+        while not self._completed.empty():
+            finished.append(self._completed.get_nowait())
+        return finished
+
+    async def results_as_completed(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yield each remaining agent result as soon as it is available"""
+        try:
+            while len(self.results) < len(self.engine.specs) or not self._completed.empty():
+                yield await self._completed.get()
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """Abort every agent that has not finished yet"""
+        self._supervisor.cancel()
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def _schedule(self):
+        specs = self.engine.specs
+        # Streaming agents start right away, the rest once the code is complete
+        for spec in specs.values():
+            if spec.streaming and not spec.depends_on:
+                self._start(spec)
+        await self.feed.finished.wait()
+
+        while len(self.results) < len(specs):
+            for spec in specs.values():
+                if spec.name in self._tasks or spec.name in self.results:
+                    continue
+                if not all(dep in self.results for dep in spec.depends_on):
+                    continue
+                failed = [dep for dep in spec.depends_on if self.results[dep].get("status") != "success"]
+                if failed:
+                    self._record(spec.name, {
+                        "status": "skipped",
+                        "message": f"Skipped because {', '.join(failed)} did not succeed",
+                        "timestamp": self.context.timestamp
+                    })
+                    continue
+                self._start(spec)
+            if len(self.results) < len(specs):
+                await self._progress.wait()
+                self._progress.clear()
+
+    def _start(self, spec: AgentSpec):
+        self._tasks[spec.name] = asyncio.ensure_future(self._run_agent(spec))
+
+    async def _run_agent(self, spec: AgentSpec):
+        with tracing.span(f"agent.{spec.name}") as span:
+            started = datetime.now()
+            task = asyncio.ensure_future(spec.func(self.context))
+            try:
+                if spec.streaming:
+                    # A streaming agent's deadline starts once generation has finished
+                    finished = asyncio.ensure_future(self.feed.finished.wait())
+                    try:
+                        await asyncio.wait({task, finished}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        finished.cancel()
+                result = await asyncio.wait_for(task, timeout=spec.deadline)
+            except asyncio.TimeoutError:
+                logger.warning(f"{spec.name} exceeded its {spec.deadline}s deadline")
+                result = {
+                    "status": "timeout",
+                    "message": f"Deadline of {spec.deadline}s exceeded",
+                    "timestamp": self.context.timestamp
+                }
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"{spec.name} failed: {str(e)}")
+                result = {
+                    "status": "failed",
+                    "error": str(e),
+                    "timestamp": self.context.timestamp
+                }
+            result.setdefault("duration", (datetime.now() - started).total_seconds())
+            AGENT_DURATION.labels(spec.name, result.get("status", "unknown")).observe(result["duration"])
+            span.set_attribute("status", result.get("status", "unknown"))
+            self._record(spec.name, result)
+
+    def _record(self, name: str, result: Dict[str, Any]):
+        self.results[name] = result
+        self._completed.put_nowait((name, result))
+        self._progress.set()
+
+
+class AgentEngine:
+    """Runs agents as a dependency DAG, each as soon as its inputs are ready"""
+
+    def __init__(self, specs: Iterable[AgentSpec]):
+        self.specs: Dict[str, AgentSpec] = {spec.name: spec for spec in specs}
+        self._validate()
+
+    def _validate(self):
+        for spec in self.specs.values():
+            for dep in spec.depends_on:
+                if dep not in self.specs:
+                    raise ValueError(f"{spec.name} depends on unknown agent {dep}")
+        # Reject cycles up front so a run can never stall
+        visiting, done = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Agent dependency cycle through {name}")
+            visiting.add(name)
+            for dep in self.specs[name].depends_on:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.specs:
+            visit(name)
+
+    def start(self, prompt: str, batched: bool = False, timestamp: Optional[str] = None) -> AgentRun:
+        """Begin a run; feed it code with feed_code/finish_code"""
+        return AgentRun(self, prompt, batched, timestamp)
+
+    async def run(
+        self, prompt: str, code: str, batched: bool = False, timestamp: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Run every agent over already complete code, yielding results as they finish"""
+        agent_run = self.start(prompt, batched, timestamp)
+        agent_run.finish_code(code)
+        async for name, result in agent_run.results_as_completed():
+            yield name, result
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from sandbox import SandboxPool
+from singleflight import SingleFlight
+
+# Hard budget so benchmarking can never dominate request latency
+BENCHMARK_BUDGET_SECONDS = float(os.getenv("BENCHMARK_BUDGET_SECONDS", "1.5"))
+BENCHMARK_WARMUP = int(os.getenv("BENCHMARK_WARMUP", "1"))
+BENCHMARK_REPEATS = int(os.getenv("BENCHMARK_REPEATS", "5"))
+BENCHMARK_CACHE_SIZE = int(os.getenv("BENCHMARK_CACHE_SIZE", "256"))
+
+
+class BenchmarkHarness:
+    """Micro-benchmarks generated code in the sandbox, cached by code hash"""
+
+    def __init__(
+        self,
+        sandbox: SandboxPool,
+        budget_seconds: float = BENCHMARK_BUDGET_SECONDS,
+        warmup: int = BENCHMARK_WARMUP,
+        repeats: int = BENCHMARK_REPEATS,
+        cache_size: int = BENCHMARK_CACHE_SIZE,
+    ):
+        self.sandbox = sandbox
+        self.options = {"budget_seconds": budget_seconds, "warmup": warmup, "repeats": repeats}
+        self.cache_size = cache_size
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight = SingleFlight()
+        self.cache_hits = 0
+
+    @staticmethod
+    def code_hash(modules: List[Dict[str, str]]) -> str:
+        return hashlib.sha256(json.dumps(modules, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def run(self, modules: List[Dict[str, str]], batched: bool = False) -> Dict[str, Any]:
+        """Benchmark report for these modules; identical code is measured once"""
+        key = self.code_hash(modules)
+        cached = self._results.get(key)
+        if cached is not None:
+            self._results.move_to_end(key)
+            self.cache_hits += 1
+            return {**cached, "cached": True}
+        return await self._inflight.do(key, lambda: self._measure(key, modules, batched))
+
+    async def _measure(self, key: str, modules: List[Dict[str, str]], batched: bool = False) -> Dict[str, Any]:
+        report = await self.sandbox.run(
+            modules,
+            kind="benchmark",
+            options=self.options,
+            batched=batched,
+            # The child stops measuring at the budget; the wall limit is the backstop
+            wall_seconds=self.options["budget_seconds"] + 1.0,
+        )
+        # Only completed measurements are worth reusing
+        if report.get("status") == "completed":
+            self._results[key] = report
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return {**report, "cached": False}
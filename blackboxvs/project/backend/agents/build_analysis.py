@@ -0,0 +1,344 @@
+import ast
+import hashlib
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+# Complete markdown fence lines (```lang ...), matched over the raw UTF-8 buffer
+FENCE_LINE_RE = re.compile(rb"^```([^\n]*)\n", re.MULTILINE)
+# Language tag after the backticks, e.g. python
+LANGUAGE_RE = re.compile(r"[ \t]*([\w+#.-]*)")
+# A fence line that closes the open block: nothing after the backticks but blanks
+CLOSING_FENCE_RE = re.compile(rb"```[ \t]*\n?")
+# "# app/models.py" style header naming the file a block belongs to
+FILENAME_RE = re.compile(rb"^\s*#\s*([\w./-]+)\.py\b")
+
+PYTHON_LANGUAGES = {"python", "py", "python3"}
+STDLIB_MODULES = frozenset(sys.stdlib_module_names)
+
+# Parsed trees are shared by every agent, keyed by content hash
+PARSE_CACHE_SIZE = 256
+
+
+class CodeBlock:
+    """One fenced block from the LLM output, as a read-only view into its CodeBuffer"""
+
+    def __init__(self, index: int, language: str, data: memoryview, start_line: int):
+        self.index = index
+        self.language = language
+        self.data = data
+        # 1-based line of the block's first code line in the full output
+        self.start_line = start_line
+        match = FILENAME_RE.match(data)
+        self.module = match.group(1).decode().replace("/", ".") if match else None
+        self._source: Optional[str] = None
+
+    @property
+    def source(self) -> str:
+        """Block text, decoded on first use"""
+        if self._source is None:
+            self._source = str(self.data, "utf-8")
+        return self._source
+
+    @property
+    def is_python(self) -> bool:
+        return self.language.lower() in PYTHON_LANGUAGES
+
+    @property
+    def is_untagged(self) -> bool:
+        """No language on the fence (or no fence at all): Python only if it parses as code"""
+        return not self.language
+
+
+class ParsedBlock:
+    """A code block parsed once with ast"""
+
+    def __init__(self, block: CodeBlock, tree: Optional[ast.Module], syntax_error: Optional[Dict[str, Any]]):
+        self.block = block
+        self.tree = tree
+        self.syntax_error = syntax_error
+        self.imports: List[str] = _import_roots(tree) if tree is not None else []
+
+
+class BuildAnalysis:
+    """Import graph and syntax check over every Python block in a generation"""
+
+    def __init__(self, blocks: List[ParsedBlock]):
+        self.blocks = blocks
+        local = {b.block.module.split(".")[-1] for b in blocks if b.block.module}
+        local |= {b.block.module.split(".")[0] for b in blocks if b.block.module}
+
+        self.import_graph: Dict[str, List[str]] = {}
+        self.stdlib: Set[str] = set()
+        self.third_party: Set[str] = set()
+        self.local: Set[str] = set()
+        for parsed in blocks:
+            name = parsed.block.module or f"block_{parsed.block.index}"
+            self.import_graph[name] = parsed.imports
+            for module in parsed.imports:
+                if module in local:
+                    self.local.add(module)
+                elif module in STDLIB_MODULES:
+                    self.stdlib.add(module)
+                else:
+                    self.third_party.add(module)
+
+        self.syntax_errors = [b.syntax_error for b in blocks if b.syntax_error]
+
+    @property
+    def trees(self) -> List[ast.Module]:
+        return [b.tree for b in self.blocks if b.tree is not None]
+
+    def modules(self) -> List[Dict[str, str]]:
+        """Parsed blocks as importable modules, in output order"""
+        return [
+            {"name": b.block.module or f"generated_{b.block.index}", "source": b.block.source}
+            for b in self.blocks if b.tree is not None
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "python_blocks": len(self.blocks),
+            "dependencies": sorted(self.third_party),
+            "stdlib_modules": sorted(self.stdlib),
+            "local_modules": sorted(self.local),
+            "import_graph": self.import_graph,
+            "syntax_errors": self.syntax_errors,
+        }
+
+
+class CodeBuffer:
+    """Generated output accumulated as UTF-8, split into fenced code blocks as it streams in
+
+    Each delta is scanned once, from the last complete line, for fence
+    lines, so a block is available as soon as its closing fence arrives.
+    Blocks are memoryview slices of the one buffer. Growing the buffer
+    moves to a new, larger bytearray; slices already handed out keep
+    viewing the old one, whose bytes never change.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self._data = bytearray(capacity)
+        self.size = 0
+        self.blocks: List[CodeBlock] = []
+        self.finished = False
+        # Start of the first line not yet scanned, and its 1-based line number
+        self._scan = 0
+        self._line = 1
+        # (language, content offset, content line) of the block being read
+        self._open: Optional[Tuple[str, int, int]] = None
+        self._text: Optional[str] = None
+
+    def append(self, delta: str) -> List[CodeBlock]:
+        """Add a delta and return the blocks it completed"""
+        if self.finished:
+            raise RuntimeError("CodeBuffer is already finished")
+        encoded = delta.encode("utf-8")
+        end = self.size + len(encoded)
+        if end > len(self._data):
+            grown = bytearray(max(end, len(self._data) * 2))
+            grown[:self.size] = memoryview(self._data)[:self.size]
+            self._data = grown
+        # Same-length slice assignment: allowed while earlier slices are exported
+        self._data[self.size:end] = encoded
+        self.size = end
+        # Most token deltas complete no line and cannot finish a block
+        if b"\n" not in encoded:
+            return []
+        return self._scan_lines()
+
+    def finish(self) -> List[CodeBlock]:
+        """Mark the output complete and return the blocks that completes
+
+        A closing fence on an unterminated last line still closes its block.
+        A block with no closing fence is dropped. Output with no fenced
+        blocks at all becomes a single untagged block.
+        """
+        if self.finished:
+            return []
+        self.finished = True
+        completed = []
+        if self._open is not None and CLOSING_FENCE_RE.fullmatch(self._data, self._scan, self.size):
+            completed.append(self._close(self._scan))
+        if not self.blocks and self.text().strip():
+            completed.append(self._add("", 0, self.size, 1))
+        return completed
+
+    def view(self, start: int = 0, end: Optional[int] = None) -> memoryview:
+        """Read-only slice of the buffer, without copying"""
+        end = self.size if end is None else min(end, self.size)
+        return memoryview(self._data)[start:end].toreadonly()
+
+    def text(self) -> str:
+        """Full output, decoded once the buffer is finished"""
+        if not self.finished:
+            return str(self.view(), "utf-8")
+        if self._text is None:
+            self._text = str(self.view(), "utf-8")
+        return self._text
+
+    def analysis(self) -> "BuildAnalysis":
+        """Build analysis of the finished output, sharing analyze_code's cache"""
+        if not self.finished:
+            raise RuntimeError("CodeBuffer is not finished yet")
+        key = "analysis:" + content_hash(self.view())
+        analysis = _cache.get(key)
+        if analysis is None:
+            analysis = BuildAnalysis(python_blocks(self.blocks))
+            _cache.put(key, analysis)
+        return analysis
+
+    def _scan_lines(self) -> List[CodeBlock]:
+        completed = []
+        data = self._data
+        for match in FENCE_LINE_RE.finditer(data, self._scan, self.size):
+            line = self._line + data.count(b"\n", self._scan, match.start())
+            if self._open is None:
+                info = match.group(1).decode("utf-8", "replace")
+                self._open = (LANGUAGE_RE.match(info).group(1), match.end(), line + 1)
+            elif CLOSING_FENCE_RE.fullmatch(data, match.start(), match.end()):
+                completed.append(self._close(match.start()))
+            self._scan, self._line = match.end(), line + 1
+        # Only whole lines are scanned; a partial last line is rescanned with the next delta
+        last_newline = data.rfind(b"\n", self._scan, self.size)
+        if last_newline >= 0:
+            self._line += data.count(b"\n", self._scan, last_newline + 1)
+            self._scan = last_newline + 1
+        return completed
+
+    def _close(self, end: int) -> CodeBlock:
+        language, start, line = self._open
+        self._open = None
+        return self._add(language, start, end, line)
+
+    def _add(self, language: str, start: int, end: int, line: int) -> CodeBlock:
+        block = CodeBlock(len(self.blocks), language, self.view(start, end), line)
+        self.blocks.append(block)
+        return block
+
+
+def extract_code_blocks(text: str) -> List[CodeBlock]:
+    """Split LLM markdown output into fenced code blocks
+
+    Output without any fences is treated as a single untagged block.
+    """
+    buffer = CodeBuffer(len(text))
+    buffer.append(text)
+    buffer.finish()
+    return buffer.blocks
+
+
+def _import_roots(tree: ast.Module) -> List[str]:
+    roots = []
+    seen = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            # Relative imports point inside the generated project
+            if node.level or not node.module:
+                continue
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            root = name.split(".")[0]
+            if root not in seen:
+                seen.add(root)
+                roots.append(root)
+    return roots
+
+
+class _ParseCache:
+    """Bounded LRU of parsed blocks and analyses keyed by content hash"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+_cache = _ParseCache(PARSE_CACHE_SIZE)
+
+
+def content_hash(text: Union[str, memoryview]) -> str:
+    """SHA-256 of ``text``'s UTF-8 bytes; buffer views are hashed in place"""
+    return hashlib.sha256(text.encode("utf-8") if isinstance(text, str) else text).hexdigest()
+
+
+def parse_block(block: CodeBlock) -> ParsedBlock:
+    """Parse a block with ast, reusing the tree when identical code was seen before"""
+    key = "block:" + content_hash(block.data)
+    cached = _cache.get(key)
+    if cached is None:
+        try:
+            cached = (ast.parse(block.source), None)
+        except SyntaxError as e:
+            cached = (None, (e.lineno or 1, e.offset, e.msg))
+        _cache.put(key, cached)
+
+    tree, raw_error = cached
+    error = None
+    if raw_error is not None:
+        lineno, offset, message = raw_error
+        # Report lines relative to the full LLM output, not the block
+        error = {
+            "block": block.index,
+            "line": lineno + block.start_line - 1,
+            "column": offset,
+            "message": message,
+        }
+    return ParsedBlock(block, tree, error)
+
+
+def python_blocks(blocks: List[CodeBlock]) -> List[ParsedBlock]:
+    """Parse the Python blocks of a generation
+
+    Blocks tagged as Python are always included, so their syntax errors
+    are reported. Untagged blocks (shell commands, prose replies) are
+    included only when they parse and hold more than bare expressions.
+    """
+    parsed = []
+    for block in blocks:
+        if block.is_python:
+            parsed.append(parse_block(block))
+        elif block.is_untagged:
+            candidate = parse_block(block)
+            if candidate.tree is not None and not all(isinstance(node, ast.Expr) for node in candidate.tree.body):
+                parsed.append(candidate)
+    return parsed
+
+
+def analyze_code(text: str) -> BuildAnalysis:
+    """Build analysis for a full generation, cached by content hash"""
+    key = "analysis:" + content_hash(text)
+    analysis = _cache.get(key)
+    if analysis is None:
+        analysis = BuildAnalysis(python_blocks(extract_code_blocks(text)))
+        _cache.put(key, analysis)
+    return analysis
+
+
+def cache_stats() -> Dict[str, int]:
+    return {"hits": _cache.hits, "misses": _cache.misses}
@@ -0,0 +1,250 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Trip when at least MIN_REQUESTS calls in the rolling window fail at FAILURE_RATE or more
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS", "5"))
+CIRCUIT_BREAKER_WINDOW = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "30"))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "60"))
+CIRCUIT_BREAKER_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", "2"))
+# Shared by every worker on the host; set CIRCUIT_BREAKER_SHARED=0 for per-process state
+CIRCUIT_BREAKER_SHARED = os.getenv("CIRCUIT_BREAKER_SHARED", "1").lower() not in ("0", "false", "no")
+CIRCUIT_BREAKER_PATH = os.getenv(
+    "CIRCUIT_BREAKER_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "jhadepilot_breakers"),
+)
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+STATE_NAMES = {CLOSED: "CLOSED", OPEN: "OPEN", HALF_OPEN: "HALF_OPEN"}
+
+BUCKETS = 10
+MAX_SLOTS = 64
+# Slot: name, then state, probes in flight, probe successes, opened_at, half_opened_at
+_HEADER = struct.Struct("32s i i i 4x d d")
+_STATE = struct.Struct("i i i 4x d d")
+# Rolling window bucket: epoch, successes, failures
+_BUCKET = struct.Struct("q I I")
+SLOT_SIZE = _HEADER.size + BUCKETS * _BUCKET.size
+
+
+class _SlotTable:
+    """Fixed array of breaker slots in one mmap'd file shared by all workers
+
+    Reads and writes are plain memory accesses on the mapping, so breaker
+    decisions never make a syscall. Writers do not lock: two workers
+    updating the same counter in the same instant can lose one increment,
+    which only nudges a failure rate that is an estimate anyway.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        size = SLOT_SIZE * MAX_SLOTS
+        if path is None:
+            self.buffer = memoryview(bytearray(size))
+            return
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        self.buffer = memoryview(self._mmap)
+
+    def claim(self, name: str) -> int:
+        """Offset of the slot for ``name``, claiming a free one if needed"""
+        if self.path is None:
+            return self._claim(name)
+        # Startup only: serialize workers claiming slots at the same time
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            return self._claim(name)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _claim(self, name: str) -> int:
+        encoded = name.encode()[:32].ljust(32, b"\0")
+        free = None
+        for index in range(MAX_SLOTS):
+            offset = index * SLOT_SIZE
+            slot_name = bytes(self.buffer[offset:offset + 32])
+            if slot_name == encoded:
+                return offset
+            if free is None and slot_name == b"\0" * 32:
+                free = offset
+        if free is None:
+            raise RuntimeError(f"No free circuit breaker slot for {name}")
+        _HEADER.pack_into(self.buffer, free, encoded, CLOSED, 0, 0, 0.0, 0.0)
+        return free
+
+
+_tables: Dict[Optional[str], _SlotTable] = {}
+
+
+def _table(path: Optional[str]) -> _SlotTable:
+    table = _tables.get(path)
+    if table is None:
+        try:
+            table = _SlotTable(path)
+        except OSError as e:
+            logger.warning(f"Shared circuit breaker state unavailable ({e}), using per-process state")
+            path = None
+            table = _tables.get(None) or _SlotTable(None)
+        _tables[path] = table
+    return table
+
+
+class CircuitBreaker:
+    """Circuit breaker pattern for resilient API calls
+
+    Trips on the failure rate over a rolling time window (not a run of
+    consecutive failures), then lets only ``half_open_probes`` requests
+    through while half-open. State lives in a slot shared by every worker
+    on the host, keyed by ``name``, so all workers trip and recover
+    together. CLOCK_MONOTONIC is host-wide, so timestamps compare across
+    processes. Every decision is O(1) over a fixed number of buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+        min_requests: int = CIRCUIT_BREAKER_MIN_REQUESTS,
+        window: float = CIRCUIT_BREAKER_WINDOW,
+        timeout: float = CIRCUIT_BREAKER_OPEN_SECONDS,
+        half_open_probes: int = CIRCUIT_BREAKER_HALF_OPEN_PROBES,
+        shared: bool = CIRCUIT_BREAKER_SHARED,
+        path: str = CIRCUIT_BREAKER_PATH,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.timeout = timeout
+        self.half_open_probes = max(half_open_probes, 1)
+        self._bucket_width = window / BUCKETS
+        table = _table(path if shared else None)
+        self._buffer = table.buffer
+        self._offset = table.claim(name)
+
+    def _header(self):
+        _, state, probes, successes, opened_at, half_opened_at = _HEADER.unpack_from(self._buffer, self._offset)
+        return state, probes, successes, opened_at, half_opened_at
+
+    def _write(self, state: int, probes: int, successes: int, opened_at: float, half_opened_at: float):
+        # Skip the name, which never changes once claimed
+        _STATE.pack_into(self._buffer, self._offset + 32, state, probes, successes, opened_at, half_opened_at)
+
+    def _bucket_offset(self, index: int) -> int:
+        return self._offset + _HEADER.size + index * _BUCKET.size
+
+    def _count(self, now: float, failed: bool):
+        epoch = int(now / self._bucket_width)
+        offset = self._bucket_offset(epoch % BUCKETS)
+        bucket_epoch, successes, failures = _BUCKET.unpack_from(self._buffer, offset)
+        if bucket_epoch != epoch:
+            successes = failures = 0
+        if failed:
+            failures += 1
+        else:
+            successes += 1
+        _BUCKET.pack_into(self._buffer, offset, epoch, successes, failures)
+
+    def _window_totals(self, now: float):
+        epoch = int(now / self._bucket_width)
+        total = failed = 0
+        for index in range(BUCKETS):
+            bucket_epoch, successes, failures = _BUCKET.unpack_from(self._buffer, self._bucket_offset(index))
+            if 0 <= epoch - bucket_epoch < BUCKETS:
+                total += successes + failures
+                failed += failures
+        return total, failed
+
+    def _reset_window(self):
+        for index in range(BUCKETS):
+            _BUCKET.pack_into(self._buffer, self._bucket_offset(index), 0, 0, 0)
+
+    def _expired(self, now: float, since: float) -> bool:
+        # A timestamp ahead of the clock was written before a reboot
+        return now - since >= self.timeout or since > now
+
+    @property
+    def state(self) -> str:
+        return STATE_NAMES[self._header()[0]]
+
+    def available(self) -> bool:
+        """Whether a request could be admitted now, without taking a probe slot"""
+        state, probes, _, opened_at, half_opened_at = self._header()
+        now = time.monotonic()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return self._expired(now, opened_at)
+        return probes < self.half_open_probes or self._expired(now, half_opened_at)
+
+    def can_execute(self) -> bool:
+        """Admit a request; while half-open this takes one of the probe slots"""
+        state, probes, successes, opened_at, half_opened_at = self._header()
+        if state == CLOSED:
+            return True
+        now = time.monotonic()
+        if state == OPEN:
+            if not self._expired(now, opened_at):
+                return False
+            self._write(HALF_OPEN, 1, 0, opened_at, now)
+            return True
+        # HALF_OPEN: probes that never reported back free their slots after the timeout
+        if self._expired(now, half_opened_at):
+            self._write(HALF_OPEN, 1, 0, opened_at, now)
+            return True
+        if probes >= self.half_open_probes:
+            return False
+        self._write(HALF_OPEN, probes + 1, successes, opened_at, half_opened_at)
+        return True
+
+    def release(self):
+        """Return an unused probe slot (the admitted request was cancelled)"""
+        state, probes, successes, opened_at, half_opened_at = self._header()
+        if state == HALF_OPEN and probes > 0:
+            self._write(HALF_OPEN, probes - 1, successes, opened_at, half_opened_at)
+
+    def record_success(self):
+        state, probes, successes, opened_at, half_opened_at = self._header()
+        if state == HALF_OPEN:
+            successes += 1
+            if successes >= self.half_open_probes:
+                self._reset_window()
+                self._write(CLOSED, 0, 0, 0.0, 0.0)
+            else:
+                self._write(HALF_OPEN, probes, successes, opened_at, half_opened_at)
+            return
+        self._count(time.monotonic(), failed=False)
+
+    def record_failure(self):
+        now = time.monotonic()
+        state = self._header()[0]
+        if state == HALF_OPEN:
+            # A failed probe reopens the circuit for another full timeout
+            self._write(OPEN, 0, 0, now, 0.0)
+            return
+        if state == OPEN:
+            return
+        self._count(now, failed=True)
+        total, failed = self._window_totals(now)
+        if total >= self.min_requests and failed / total >= self.failure_rate:
+            logger.warning(f"Circuit breaker {self.name} opened ({failed}/{total} failed)")
+            self._write(OPEN, 0, 0, now, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        state, probes, _, _, _ = self._header()
+        total, failed = self._window_totals(time.monotonic())
+        return {
+            "state": STATE_NAMES[state],
+            "window_requests": total,
+            "window_failures": failed,
+            "half_open_probes": probes,
+        }
@@ -0,0 +1,136 @@
+import json
+import keyword
+import logging
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from tokens import classify_prompt
+
+logger = logging.getLogger(__name__)
+
+# Code served when no provider can generate: "<family>.<category>.tmpl" files,
+# where category is a prompt class and "default" is the family's catch-all
+FALLBACK_TEMPLATE_DIR = os.getenv(
+    "FALLBACK_TEMPLATE_DIR", str(Path(__file__).resolve().parent / "fallback_templates")
+)
+
+# ${name} or ${name|filter}
+FIELD_RE = re.compile(r"\$\{(\w+)(?:\|(\w+))?\}")
+WORD_RE = re.compile(r"[A-Za-z0-9]+")
+NEEDS_ESCAPE_RE = re.compile(r'[\x00-\x1f"\\]')
+
+
+def _comment(text: str) -> str:
+    # A line break would end the comment and leave the rest as code; source cannot hold NUL
+    return " ".join(text.splitlines()).replace("\x00", "")
+
+
+def _docstring(text: str) -> str:
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\x00", "\\x00")
+
+
+def _string(text: str) -> str:
+    if NEEDS_ESCAPE_RE.search(text) is None:
+        return f'"{text}"'
+    # JSON string escapes are all valid Python escapes
+    return json.dumps(text, ensure_ascii=False)
+
+
+FILTERS: Dict[str, Callable[[str], str]] = {
+    "comment": _comment,
+    "docstring": _docstring,
+    "string": _string,
+}
+
+
+def class_name(prompt: str, suffix: str = "Solution") -> str:
+    """Python class name from the first three words of the prompt"""
+    name = "".join(word.capitalize() for word in WORD_RE.findall(prompt)[:3]) + suffix
+    return f"_{name}" if name[0].isdigit() else name
+
+
+def function_name(prompt: str) -> str:
+    """snake_case function name from the first three words of the prompt"""
+    name = "_".join(word.lower() for word in WORD_RE.findall(prompt)[:3]) or "solution"
+    if keyword.iskeyword(name):
+        # A one-word prompt such as "import" or "class" is not a valid name
+        return f"{name}_"
+    return f"_{name}" if name[0].isdigit() else name
+
+
+class FallbackCode(str):
+    """Code rendered from a fallback template rather than generated by a provider"""
+
+    __slots__ = ()
+
+
+class FallbackTemplate:
+    """A template split once into literal text and field slots, rendered with one join"""
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self._parts: List[str] = []
+        # (slot index, field, filter) for every placeholder
+        self._slots: List[Tuple[int, str, str]] = []
+        position = 0
+        for match in FIELD_RE.finditer(source):
+            field, filter_name = match.group(1), match.group(2) or ""
+            if filter_name and filter_name not in FILTERS:
+                raise ValueError(f"{name}: unknown filter {filter_name!r}")
+            self._parts.append(source[position:match.start()])
+            self._slots.append((len(self._parts), field, filter_name))
+            self._parts.append("")
+            position = match.end()
+        self._parts.append(source[position:])
+        self.fields = frozenset(field for _, field, _ in self._slots)
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = self._parts.copy()
+        # Each field is escaped once per filter however often it appears
+        rendered: Dict[Tuple[str, str], str] = {}
+        for index, field, filter_name in self._slots:
+            key = (field, filter_name)
+            value = rendered.get(key)
+            if value is None:
+                value = rendered[key] = FILTERS[filter_name](values[field]) if filter_name else values[field]
+            parts[index] = value
+        return "".join(parts)
+
+
+class FallbackTemplates:
+    """Fallback templates by family and prompt category, loaded at startup"""
+
+    def __init__(self, directory: str = FALLBACK_TEMPLATE_DIR):
+        self.directory = directory
+        self.templates: Dict[Tuple[str, str], FallbackTemplate] = {}
+        for path in sorted(Path(directory).glob("*.tmpl")):
+            family, _, category = path.stem.partition(".")
+            self.templates[(family, category or "default")] = FallbackTemplate(path.name, path.read_text())
+        logger.info(f"Loaded {len(self.templates)} fallback templates from {directory}")
+        self.renders: Counter = Counter()
+
+    def select(self, family: str, prompt: str) -> FallbackTemplate:
+        template = self.templates.get((family, classify_prompt(prompt)))
+        if template is None:
+            template = self.templates[(family, "default")]
+        return template
+
+    def render(self, family: str, prompt: str, **values: Any) -> FallbackCode:
+        """Fallback code for the prompt; ``values`` fills the template's other fields"""
+        template = self.select(family, prompt)
+        self.renders[template.name] += 1
+        values["prompt"] = prompt
+        if "class_name" in template.fields:
+            values["class_name"] = class_name(prompt)
+        if "function_name" in template.fields:
+            values["function_name"] = function_name(prompt)
+        return FallbackCode(template.render(values))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"templates": sorted(template.name for template in self.templates.values()), "renders": dict(self.renders)}
+
+
+fallback_templates = FallbackTemplates()
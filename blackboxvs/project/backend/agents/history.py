@@ -0,0 +1,434 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from fallback import FallbackCode
+from semantic_cache import SimilarCode
+from serialization import dumps_str
+
+logger = logging.getLogger(__name__)
+
+# Generation history: every finished generation, searchable, kept across restarts
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1").lower() not in ("0", "false", "no")
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "history.sqlite3")
+HISTORY_BUFFER_SIZE = int(os.getenv("HISTORY_BUFFER_SIZE", "4096"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "128"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+# Most repeated recent generations loaded into the response cache at startup
+HISTORY_WARM_ENTRIES = int(os.getenv("HISTORY_WARM_ENTRIES", "256"))
+HISTORY_RETENTION_SECONDS = float(os.getenv("HISTORY_RETENTION_SECONDS", str(30 * 86400)))
+# "key:client,..." bearer keys for /history; without any the endpoints are off
+HISTORY_API_KEYS = os.getenv("HISTORY_API_KEYS", "")
+
+SNIPPET_TOKENS = 16
+
+
+class HistoryUnavailable(Exception):
+    """History is switched off or not started, the caller is not authorized, or search lacks FTS5"""
+
+    status_code = 404
+
+    def __init__(self, detail: str, status_code: int = 404):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def search_query(text: str) -> str:
+    """FTS5 query matching every term of ``text`` literally, so user input is never parsed as syntax"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+def parse_api_keys(spec: str) -> Dict[str, str]:
+    keys = {}
+    for pair in spec.split(","):
+        key, _, client = pair.strip().partition(":")
+        if key and client:
+            keys[key] = client
+    return keys
+
+
+def history_caller(authorization: Optional[str], keys: Optional[Dict[str, str]] = None) -> str:
+    """The client whose history a request may read, from its ``Authorization: Bearer`` key
+
+    Generations are recorded under the quota client (tokens.client_id),
+    which proves no identity, so only a configured key may read them back.
+    """
+    keys = parse_api_keys(HISTORY_API_KEYS) if keys is None else keys
+    if not keys:
+        raise HistoryUnavailable("History API is disabled; set HISTORY_API_KEYS to enable it")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HistoryUnavailable("History API needs a bearer key", status_code=401)
+    client = None
+    # Compare against every key so timing does not reveal which one nearly matched
+    for key, owner in keys.items():
+        if hmac.compare_digest(key.encode(), token.strip().encode()):
+            client = owner
+    if client is None:
+        raise HistoryUnavailable("Invalid history API key", status_code=401)
+    return client
+
+
+class HistoryStore:
+    """Finished generations in SQLite (WAL), written in batches off the request path
+
+    ``record`` only appends to a bounded in-memory buffer; one background
+    task writes the buffer in a thread, one transaction per batch. Prompts
+    and code are indexed with FTS5. Pages are keyset-paginated on the row
+    id, newest first, so a page costs the same however deep it is. The
+    database is opened by ``start`` and entries older than ``retention``
+    are purged in the background.
+    """
+
+    # Small columns first: list queries never read the large ones' overflow pages
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY,
+            created_at REAL NOT NULL,
+            client TEXT,
+            fallback INTEGER NOT NULL,
+            duration_ms REAL,
+            code_chars INTEGER NOT NULL,
+            cache_key TEXT,
+            statuses TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            code TEXT NOT NULL,
+            agents TEXT NOT NULL,
+            telemetry TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS generations_client ON generations (client, id);
+        CREATE INDEX IF NOT EXISTS generations_warm ON generations (created_at) WHERE cache_key IS NOT NULL;
+    """
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+            prompt, code, content='generations', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS generations_fts_insert AFTER INSERT ON generations BEGIN
+            INSERT INTO generations_fts (rowid, prompt, code) VALUES (NEW.id, NEW.prompt, NEW.code);
+        END;
+        CREATE TRIGGER IF NOT EXISTS generations_fts_delete AFTER DELETE ON generations BEGIN
+            INSERT INTO generations_fts (generations_fts, rowid, prompt, code)
+            VALUES ('delete', OLD.id, OLD.prompt, OLD.code);
+        END;
+    """
+    SUMMARY_COLUMNS = "g.id, g.created_at, g.fallback, g.duration_ms, g.code_chars, g.statuses, g.prompt"
+
+    def __init__(
+        self,
+        path: str = HISTORY_DB_PATH,
+        enabled: bool = HISTORY_ENABLED,
+        buffer_size: int = HISTORY_BUFFER_SIZE,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL,
+        retention: float = HISTORY_RETENTION_SECONDS,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.search_enabled = False
+        self._buffer: Deque[Tuple[Any, ...]] = deque(maxlen=max(buffer_size, 1))
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # Writes and reads get their own connection so a batch never blocks a page read (WAL)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.write_errors = 0
+        self.purged = 0
+        self.warmed = 0
+
+    def _open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._writer = self._connect()
+        self._writer.executescript(self.SCHEMA)
+        try:
+            self._writer.executescript(self.FTS_SCHEMA)
+            self.search_enabled = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5, history search is disabled: {str(e)}")
+        self._reader = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(
+        self,
+        prompt: str,
+        code: str,
+        client: Optional[str] = None,
+        agents: Optional[Dict[str, Any]] = None,
+        telemetry: Optional[Dict[str, Any]] = None,
+        duration_ms: Optional[float] = None,
+        cache_key: Optional[str] = None,
+    ):
+        """Queue one finished generation; never blocks
+
+        ``cache_key`` is the response cache key the code answers, used to
+        warm the cache later. Fallback code, and code served for a similar
+        rather than identical prompt, is stored without one.
+        """
+        if not self.enabled:
+            return
+        fallback = isinstance(code, FallbackCode)
+        exact = not fallback and not isinstance(code, SimilarCode)
+        statuses = {name: result.get("status") for name, result in (agents or {}).items()}
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((
+            time.time(), client, int(fallback), duration_ms, len(code), cache_key if exact else None,
+            dumps_str(statuses), prompt, code, dumps_str(agents or {}), dumps_str(telemetry or {}),
+        ))
+        self.recorded += 1
+        if self._wake is not None and len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def start(self):
+        """Open the database (creating its directory) and start the writer (called from the app lifespan)"""
+        if not self.enabled or self._writer is not None:
+            return
+        await asyncio.to_thread(self._open)
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._purge())]
+
+    async def close(self):
+        if self._writer is None:
+            return
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        while self._buffer:
+            await asyncio.to_thread(self._write, self._drain())
+        with self._write_lock:
+            self._writer.close()
+            self._writer = None
+        with self._read_lock:
+            self._reader.close()
+            self._reader = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._buffer:
+                await asyncio.to_thread(self._write, self._drain())
+
+    async def _purge(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.purge, time.time() - self.retention)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to purge history: {str(e)}")
+            await asyncio.sleep(max(self.retention / 24, 60))
+
+    def purge(self, older_than: float, batch: int = 1000) -> int:
+        """Delete entries created before ``older_than``, oldest first, in short transactions"""
+        deleted = 0
+        while True:
+            with self._write_lock:
+                conn = self._writer
+                # Ids grow with time, so the old entries are a prefix of the id order
+                rows = conn.execute("SELECT id, created_at FROM generations ORDER BY id LIMIT ?", (batch,)).fetchall()
+                expired = [entry_id for entry_id, created_at in rows if created_at < older_than]
+                if expired:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        conn.execute("DELETE FROM generations WHERE id <= ?", (expired[-1],))
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+            deleted += len(expired)
+            if len(expired) < batch:
+                break
+        self.purged += deleted
+        return deleted
+
+    def _drain(self) -> List[Tuple[Any, ...]]:
+        count = min(len(self._buffer), self.batch_size * 4)
+        return [self._buffer.popleft() for _ in range(count)]
+
+    def _write(self, batch: List[Tuple[Any, ...]]):
+        if not batch:
+            return
+        with self._write_lock:
+            conn = self._writer
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        "INSERT INTO generations (created_at, client, fallback, duration_ms, code_chars, cache_key,"
+                        " statuses, prompt, code, agents, telemetry) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        batch,
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                self.written += len(batch)
+                self.flushes += 1
+            except sqlite3.Error as e:
+                self.write_errors += 1
+                self.dropped += len(batch)
+                logger.error(f"Failed to write history batch: {str(e)}")
+
+    def _check(self, query: Optional[str] = None):
+        if not self.enabled:
+            raise HistoryUnavailable("History is disabled")
+        if self._reader is None:
+            raise HistoryUnavailable("History is not started", status_code=503)
+        if query and not self.search_enabled:
+            raise HistoryUnavailable("History search needs SQLite with FTS5", status_code=501)
+
+    async def page(
+        self, client: Optional[str], limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None, query: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """One page of a client's generations, newest first, optionally matching a full-text ``query``
+
+        Pass the returned ``next_before`` as ``before`` for the next page.
+        """
+        # A blank query would be an empty MATCH; treat it as no query
+        match = search_query(query or "") or None
+        self._check(match)
+        limit = min(max(limit, 1), HISTORY_MAX_PAGE_SIZE)
+        rows = await asyncio.to_thread(self._page, client, limit, before, match)
+        items = [self._summary(row) for row in rows]
+        return {"items": items, "next_before": items[-1]["id"] if len(items) == limit else None}
+
+    def _page(self, client: Optional[str], limit: int, before: Optional[int], match: Optional[str]) -> List[Tuple[Any, ...]]:
+        before = before if before is not None else 1 << 62
+        with self._read_lock:
+            if match is None:
+                return self._reader.execute(
+                    f"SELECT {self.SUMMARY_COLUMNS}, NULL FROM generations g"
+                    " WHERE g.client IS ? AND g.id < ? ORDER BY g.id DESC LIMIT ?",
+                    (client, before, limit),
+                ).fetchall()
+            # FTS5 walks its own rowids in descending order and stops after LIMIT matches
+            return self._reader.execute(
+                f"SELECT {self.SUMMARY_COLUMNS},"
+                f" snippet(generations_fts, -1, '[', ']', '...', {SNIPPET_TOKENS})"
+                " FROM generations_fts JOIN generations g ON g.id = generations_fts.rowid"
+                " WHERE generations_fts MATCH ? AND generations_fts.rowid < ? AND g.client IS ?"
+                " ORDER BY generations_fts.rowid DESC LIMIT ?",
+                (match, before, client, limit),
+            ).fetchall()
+
+    @staticmethod
+    def _summary(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        entry_id, created_at, fallback, duration_ms, code_chars, statuses, prompt, snippet = row
+        summary = {
+            "id": entry_id,
+            "prompt": prompt,
+            "created_at": datetime.fromtimestamp(created_at).isoformat(),
+            "duration_ms": duration_ms,
+            "fallback": bool(fallback),
+            "code_chars": code_chars,
+            "statuses": json.loads(statuses),
+        }
+        if snippet is not None:
+            summary["snippet"] = snippet
+        return summary
+
+    async def get(self, entry_id: int, client: Optional[str]) -> Optional[Dict[str, Any]]:
+        """A client's full generation: code, agent results and telemetry"""
+        self._check()
+        row = await asyncio.to_thread(self._get, entry_id, client)
+        if row is None:
+            return None
+        entry = self._summary((*row[:7], None))
+        entry["code"] = row[7]
+        entry["agents"] = json.loads(row[8])
+        entry["telemetry"] = json.loads(row[9])
+        return entry
+
+    def _get(self, entry_id: int, client: Optional[str]) -> Optional[Tuple[Any, ...]]:
+        with self._read_lock:
+            return self._reader.execute(
+                f"SELECT {self.SUMMARY_COLUMNS}, g.code, g.agents, g.telemetry FROM generations g"
+                " WHERE g.id = ? AND g.client IS ?",
+                (entry_id, client),
+            ).fetchone()
+
+    async def warm(self, cache, limit: int = HISTORY_WARM_ENTRIES) -> int:
+        """Load the most repeated generations still within the cache TTL into ``cache``
+
+        Each entry keeps only the TTL it has left, as if it had been cached
+        when it was generated.
+        """
+        if self._reader is None or not cache.enabled or limit <= 0:
+            return 0
+        now = time.time()
+        try:
+            rows = await asyncio.to_thread(self._warm_rows, now - cache.ttl, limit)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read history for cache warming: {str(e)}")
+            return 0
+        warmed = 0
+        for cache_key, code, created_at in rows:
+            ttl = cache.ttl - (now - created_at)
+            if ttl > 0:
+                await cache.set(cache_key, code, ttl)
+                warmed += 1
+        self.warmed += warmed
+        if warmed:
+            logger.info(f"Warmed the response cache with {warmed} entries from history")
+        return warmed
+
+    def _warm_rows(self, since: float, limit: int) -> List[Tuple[str, str, float]]:
+        with self._read_lock:
+            # Rank keys on the partial index alone, then read code only for the winners
+            latest = self._reader.execute(
+                "SELECT MAX(id) FROM generations WHERE cache_key IS NOT NULL AND created_at > ?"
+                " GROUP BY cache_key ORDER BY COUNT(*) DESC, MAX(id) DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+            return [
+                self._reader.execute(
+                    "SELECT cache_key, code, created_at FROM generations WHERE id = ?", (entry_id,)
+                ).fetchone()
+                for (entry_id,) in latest
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "search": self.search_enabled,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "write_errors": self.write_errors,
+            "purged": self.purged,
+            "warmed": self.warmed,
+        }
@@ -0,0 +1,458 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from serialization import dumps_str
+
+logger = logging.getLogger(__name__)
+
+# Job mode: work survives the HTTP request, stored where every worker can claim it
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+# How long a claimed job may wait for its token quota and admission before failing
+JOB_START_TIMEOUT = float(os.getenv("JOB_START_TIMEOUT", "600"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# Reports progress from a running job: (event, data)
+Progress = Callable[[str, Dict[str, Any]], Awaitable[None]]
+Handler = Callable[[Dict[str, Any], Progress], Awaitable[Dict[str, Any]]]
+
+
+class JobLost(Exception):
+    """The job's lease expired and another worker took it over"""
+
+
+class JobStore:
+    """Jobs and their progress events in SQLite, shared by every worker process
+
+    A worker owns a running job only while its lease is fresh. Writes
+    from a worker that lost its lease are ignored, so a job reclaimed
+    after a stall is never finished twice.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            client TEXT,
+            status TEXT NOT NULL,
+            owner TEXT,
+            lease_expires REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            result TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+        CREATE TABLE IF NOT EXISTS job_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq);
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        # Connection is shared by the threadpool; sqlite3 needs explicit locking for that
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Open the database, creating its directory (JobQueue.start calls this)"""
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        self._conn = conn
+
+    def create(self, prompt: str, priority: str, client: Optional[str] = None) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, prompt, priority, client, status, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, prompt, priority, client, QUEUED, now, now),
+                )
+                self._append(job_id, QUEUED, {}, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def claim(self, owner: str, lease: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued job, or a running one whose owner's lease ran out"""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = time.time()
+                    row = conn.execute(
+                        "SELECT id, attempts FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?)"
+                        " ORDER BY created_at LIMIT 1",
+                        (QUEUED, RUNNING, now),
+                    ).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+                    job_id, attempts = row
+                    if attempts >= max_attempts:
+                        error = f"Abandoned after {attempts} attempts"
+                        conn.execute(
+                            "UPDATE jobs SET status = ?, owner = NULL, error = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, error, now, job_id),
+                        )
+                        self._append(job_id, "error", {"error": error}, now)
+                        continue
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1,"
+                        " updated_at = ? WHERE id = ?",
+                        (RUNNING, owner, now + lease, now, job_id),
+                    )
+                    self._append(job_id, RUNNING, {"attempt": attempts + 1}, now)
+                    conn.execute("COMMIT")
+                    break
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def renew(self, job_id: str, owner: str, lease: float):
+        with self._lock:
+            renewed = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + lease, job_id, owner, RUNNING),
+            ).rowcount
+        if not renewed:
+            raise JobLost(job_id)
+
+    def progress(self, job_id: str, owner: str, event: str, data: Dict[str, Any]):
+        with self._lock:
+            owned = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND owner = ? AND status = ?", (job_id, owner, RUNNING)
+            ).fetchone()
+            if owned is None:
+                raise JobLost(job_id)
+            self._append(job_id, event, data, time.time())
+
+    def finish(self, job_id: str, owner: str, result: Optional[Dict[str, Any]], error: Optional[str]):
+        now = time.time()
+        status = FAILED if error is not None else SUCCEEDED
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                finished = conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, result = ?, error = ?, updated_at = ?"
+                    " WHERE id = ? AND owner = ? AND status = ?",
+                    (status, dumps_str(result) if result is not None else None, error,
+                     now, job_id, owner, RUNNING),
+                ).rowcount
+                if finished:
+                    self._append(job_id, "error" if error is not None else "done", {"status": status, "error": error}, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if not finished:
+            raise JobLost(job_id)
+
+    def release_orphans(self, host: str) -> int:
+        """Expire leases held by dead processes on this host so they are reclaimed now"""
+        with self._lock:
+            owners = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status = ? AND owner LIKE ?", (RUNNING, f"{host}:%")
+            )]
+            released = 0
+            for owner in owners:
+                try:
+                    os.kill(int(owner.split(":")[1]), 0)
+                except ProcessLookupError:
+                    released += self._conn.execute(
+                        "UPDATE jobs SET lease_expires = 0 WHERE owner = ? AND status = ?", (owner, RUNNING)
+                    ).rowcount
+                except (ValueError, IndexError, OSError):
+                    continue
+        return released
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*FINISHED, older_than)
+                )]
+                for job_id in ids:
+                    conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(ids)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, prompt, priority, client, status, attempts, created_at, updated_at, result, error"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            agents = self._conn.execute(
+                "SELECT data FROM job_events WHERE job_id = ? AND event = 'agent' ORDER BY seq", (job_id,)
+            ).fetchall()
+        job_id, prompt, priority, client, status, attempts, created_at, updated_at, result, error = row
+        return {
+            "id": job_id,
+            "prompt": prompt,
+            "priority": priority,
+            "client": client,
+            "status": status,
+            "attempts": attempts,
+            # Latest status of each agent that has reported so far
+            "agents": {event["agent"]: event["status"] for event in map(json.loads, (data for (data,) in agents))},
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": datetime.fromtimestamp(created_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(updated_at).isoformat(),
+        }
+
+    def events(self, job_id: str, after: int = 0) -> List[Tuple[int, str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0, **dict(rows)}
+
+    def _append(self, job_id: str, event: str, data: Dict[str, Any], now: float):
+        self._conn.execute(
+            "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data, default=str), now),
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobQueue:
+    """Bounded pool of worker tasks running jobs from a JobStore
+
+    Every uvicorn worker runs its own pool against the same database.
+    A job is leased to one worker and the lease is renewed while it
+    runs; if that worker dies or stalls, the lease expires and any
+    worker reclaims the job. Waiters in this process are woken at once,
+    changes made by other processes are seen within the poll interval.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Handler,
+        workers: int = JOB_WORKERS,
+        lease: float = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retention: float = JOB_RETENTION_SECONDS,
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max(max_attempts, 1)
+        self.retention = retention
+        self.host = socket.gethostname()
+        self.owner = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._changed = asyncio.Event()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.lost = 0
+        self.reclaimed = 0
+
+    async def start(self):
+        await asyncio.to_thread(self.store.open)
+        self.owner = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        released = await asyncio.to_thread(self.store.release_orphans, self.host)
+        if released:
+            logger.info(f"Reclaiming {released} jobs left running by exited workers")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def submit(self, prompt: str, priority: str = "default", client: Optional[str] = None) -> Dict[str, Any]:
+        job = await asyncio.to_thread(self.store.create, prompt, priority, client)
+        self._wake.set()
+        return job
+
+    async def get(self, job_id: str, wait: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Job state; with ``wait``, long-poll until it finishes or the wait runs out"""
+        deadline = time.monotonic() + min(wait, JOB_MAX_WAIT)
+        while True:
+            changed = self._changed
+            job = await asyncio.to_thread(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            await self._wait(changed, min(remaining, self.poll_interval))
+
+    async def events(self, job_id: str, after: int = 0):
+        """Progress events from ``after`` on, live until the job finishes"""
+        while True:
+            changed = self._changed
+            events = await asyncio.to_thread(self.store.events, job_id, after)
+            for seq, event, data in events:
+                yield seq, event, data
+                after = seq
+                if event in ("done", "error"):
+                    job = await asyncio.to_thread(self.store.get, job_id)
+                    if job is None or job["status"] in FINISHED:
+                        return
+            await self._wait(changed, self.poll_interval)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @staticmethod
+    async def _wait(event: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _work(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.owner, self.lease, self.max_attempts)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to claim job: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                await self._wait(self._wake, self.poll_interval)
+                continue
+            # More work may be waiting for the other idle workers
+            self._wake.set()
+            self._notify()
+            if job["attempts"] > 1:
+                self.reclaimed += 1
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        self.running += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+
+        async def progress(event: str, data: Dict[str, Any]):
+            await asyncio.to_thread(self.store.progress, job_id, self.owner, event, data)
+            self._notify()
+
+        work = asyncio.ensure_future(self.handler(job, progress))
+        try:
+            # Losing the lease aborts the work: another worker owns the job now
+            await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                work.cancel()
+                raise heartbeat.exception() or JobLost(job_id)
+            try:
+                result, error = work.result(), None
+            except JobLost:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                result, error = None, str(e)
+            await asyncio.to_thread(self.store.finish, job_id, self.owner, result, error)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        except JobLost:
+            self.lost += 1
+            logger.warning(f"Lost the lease on job {job_id}; another worker has taken it over")
+        except sqlite3.Error as e:
+            # The lease runs out and the job is retried elsewhere
+            logger.error(f"Failed to store job {job_id}: {str(e)}")
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+        finally:
+            heartbeat.cancel()
+            self.running -= 1
+            self._notify()
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, job_id, self.owner, self.lease)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew lease on job {job_id}: {str(e)}")
+
+    async def _purge(self):
+        while True:
+            await asyncio.sleep(max(self.retention / 24, 60))
+            try:
+                await asyncio.to_thread(self.store.purge, time.time() - self.retention)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to purge finished jobs: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "reclaimed": self.reclaimed,
+            "lost": self.lost,
+        }
@@ -1,16 +1,37 @@
 import asyncio
 import logging
 from datetime import datetime, time, timezone
-from typing import Dict, List, Optional, Any
-import httpx
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
 import os
-from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
 from contextlib import asynccontextmanager
-import json
-import aiofiles
-from pathlib import Path
+
+from admission import AdaptiveLimiter, AdmissionRejected, Permit, observe_upstream
+from agent_engine import AgentContext, AgentEngine, AgentSpec, simulated_delay
+from benchmark import BenchmarkHarness
+from build_analysis import analyze_code, parse_block
+from fallback import fallback_templates
+from history import HISTORY_PAGE_SIZE, HistoryStore, HistoryUnavailable, history_caller
+from jobs import JOB_START_TIMEOUT, JobQueue, JobStore, Progress
+import metrics
+from metrics import GENERATION_DURATION
+from response_cache import ResponseCache, make_cache_key, normalize_prompt
+from providers import ProviderRouter, build_router
+from resilience import DeadlineMiddleware, limit_deadline, remaining
+from sandbox import SandboxPool
+from security_scan import scan_code, security_score
+from semantic_cache import SemanticCache, SimilarCode, build_semantic_cache
+from serialization import AgentEvent, FastJSONResponse, OrchestrationResult
+from singleflight import SingleFlight
+from telemetry_sink import TelemetrySink
+from tokens import PromptTooLarge, QuotaExceeded, TokenAccountant, TokenGrant, client_id
+import tracing
+from tracing import Tracer, TracingMiddleware
+from streaming import NDJSON_MEDIA_TYPE, SSE_HEADERS, SSE_MEDIA_TYPE, ndjson_line, sse_event
+from upstream import UpstreamClientPool
 
 # Configure logging for India timezone
 logging.basicConfig(
@@ -24,63 +45,17 @@ logger = logging.getLogger(__name__)
 INDIA_TIMEZONE = timezone.utc
 MUMBAI_PEAK_HOURS = (time(9, 0), time(22, 0))
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "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")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-class AgentTelemetry(BaseModel):
-    """Advanced telemetry for performance monitoring"""
-    avg_response_time: float = 0.0
-    total_requests: int = 0
-    success_rate: float = 100.0
-    peak_hour_usage: Dict[str, int] = Field(default_factory=dict)
-    error_count: int = 0
-    last_updated: datetime = Field(default_factory=datetime.now)
-
-class CircuitBreaker:
-    """Circuit breaker pattern for resilient API calls"""
-    def __init__(self, failure_threshold: int = 5, timeout: int = 60):
-        self.failure_threshold = failure_threshold
-        self.timeout = timeout
-        self.failure_count = 0
-        self.last_failure_time = None
-        self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
-    
-    def can_execute(self) -> bool:
-        if self.state == "CLOSED":
-            return True
-        elif self.state == "OPEN":
-            if datetime.now().timestamp() - self.last_failure_time > self.timeout:
-                self.state = "HALF_OPEN"
-                return True
-            return False
-        else:  # HALF_OPEN
-            return True
-    
-    def record_success(self):
-        self.failure_count = 0
-        self.state = "CLOSED"
-    
-    def record_failure(self):
-        self.failure_count += 1
-        self.last_failure_time = datetime.now().timestamp()
-        if self.failure_count >= self.failure_threshold:
-            self.state = "OPEN"
 
-class AdvancedCodeGenerator:
-    """Advanced code generation with multiple AI models and optimization"""
-    
-    def __init__(self):
-        self.circuit_breaker = CircuitBreaker()
-        self.telemetry = AgentTelemetry()
-        self.cache = {}
-        
-    async def generate_with_groq(self, prompt: str, model: str = "llama3-70b-8192") -> str:
-        """Generate code using Groq API with advanced prompting"""
-        
-        if not self.circuit_breaker.can_execute():
-            raise HTTPException(status_code=503, detail="Service temporarily unavailable")
-        
-        # Advanced system prompt for better code generation
-        system_prompt = """You are JHADEPILOT, an elite AI code architect specializing in production-ready solutions.
+# Sampling parameters sent to whichever provider the router picks
+GENERATION_PARAMS = {"max_tokens": 4000, "temperature": 0.7, "top_p": 0.9}
+
+# /generate/batch: prompts per call and how many run at once
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "256"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+# Advanced system prompt for better code generation
+SYSTEM_PROMPT = """You are JHADEPILOT, an elite AI code architect specializing in production-ready solutions.
 
 CORE PRINCIPLES:
 - Generate clean, scalable, and maintainable code
@@ -96,261 +71,370 @@ OUTPUT FORMAT:
 - Add usage examples and test cases
 - Explain key architectural decisions in comments"""
 
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
+class AdvancedCodeGenerator:
+    """Advanced code generation with multiple AI models and optimization"""
+    
+    def __init__(self, router: ProviderRouter, cache: ResponseCache, semantic: Optional[SemanticCache] = None):
+        self.router = router
+        self.cache = cache
+        self.semantic = semantic
+        self.inflight = SingleFlight()
         
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Generate production-ready code for: {prompt}"}
-            ],
-            "max_tokens": 4000,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "stream": False
-        }
+    def _build_request(self, prompt: str) -> List[Dict[str, str]]:
+        """Chat messages for a code generation prompt (provider-independent)"""
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Generate production-ready code for: {prompt}"}
+        ]
+    
+    @staticmethod
+    def _params(max_tokens: Optional[int]) -> Dict[str, Any]:
+        """Sampling parameters with this request's completion budget"""
+        return {**GENERATION_PARAMS, "max_tokens": max_tokens} if max_tokens else GENERATION_PARAMS
+    
+    def _cache_key(self, prompt: str, model: Optional[str], params: Dict[str, Any] = GENERATION_PARAMS) -> str:
+        return make_cache_key(
+            prompt, model or "auto", params["temperature"], params["max_tokens"], SYSTEM_PROMPT
+        )
+    
+    async def _cached(self, prompt: str, model: Optional[str], cache_key: str) -> Optional[str]:
+        """Exact cache hit, else the cached completion of a near-duplicate prompt"""
+        cached = await self.cache.get(cache_key)
+        if cached is not None or self.semantic is None:
+            return cached
+        with tracing.span("cache.semantic_lookup") as span:
+            similar_key = self.semantic.lookup(prompt, self._cache_key("", model))
+            span.set_attribute("hit", similar_key is not None)
+        if similar_key is None or similar_key == cache_key:
+            return None
+        cached = await self.cache.get(similar_key)
+        if cached is None:
+            # The response cache has dropped it; stop matching against it
+            self.semantic.discard(similar_key)
+            return None
+        return SimilarCode(cached)
+    
+    async def _store(self, prompt: str, model: Optional[str], cache_key: str, code: str):
+        await self.cache.set(cache_key, code)
+        if self.semantic is not None:
+            self.semantic.add(prompt, self._cache_key("", model), cache_key)
+    
+    async def generate_with_groq(
+        self, prompt: str, model: Optional[str] = None, max_tokens: Optional[int] = None, ceiling: Optional[int] = None
+    ) -> str:
+        """Generate code through the provider router (Groq first by default)
         
+        ``model`` pins a specific model; by default the router picks the
+        fastest healthy provider and model. ``max_tokens`` is the request's
+        completion budget and ``ceiling`` its class budget before the quota
+        trimmed it, which keys the cache (see tokens.TokenAccountant).
+        """
+        params = self._params(max_tokens)
+        cache_key = self._cache_key(prompt, model, self._params(ceiling or max_tokens))
+        
+        cached = await self._cached(prompt, model, cache_key)
+        if cached is not None:
+            return cached
+        
+        # Identical concurrent prompts share one upstream call
+        return await self.inflight.do(
+            cache_key, lambda: self._call_groq(prompt, model, cache_key, params)
+        )
+    
+    async def _call_groq(self, prompt: str, model: Optional[str], cache_key: str, params: Dict[str, Any]) -> str:
+        """Single routed upstream call, recording telemetry"""
         start_time = datetime.now()
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(GROQ_API_URL, json=payload, headers=headers)
-                response.raise_for_status()
-                
-                data = response.json()
-                generated_code = data["choices"][0]["message"]["content"]
-                
-                # Record success metrics
-                duration = (datetime.now() - start_time).total_seconds()
-                self.circuit_breaker.record_success()
-                self._update_telemetry(duration, success=True)
-                
-                return generated_code
-                
+            generated_code = await self.router.complete(self._build_request(prompt), params, model)
+            
+            # Record success metrics
+            duration = (datetime.now() - start_time).total_seconds()
+            self._update_telemetry(duration, success=True)
+            observe_upstream(duration)
+            await self._store(prompt, model, cache_key, generated_code)
+            
+            return generated_code
+            
         except Exception as e:
-            self.circuit_breaker.record_failure()
-            self._update_telemetry(0, success=False)
-            logger.error(f"Groq API error: {str(e)}")
+            self._update_telemetry((datetime.now() - start_time).total_seconds(), success=False)
+            logger.error(f"LLM provider error: {str(e)}")
             
             # Fallback to local generation
             return await self._fallback_generation(prompt)
     
-    async def _fallback_generation(self, prompt: str) -> str:
-        """Fallback code generation when primary service fails"""
-        logger.info("Using fallback code generation")
+    async def stream_with_groq(
+        self, prompt: str, model: Optional[str] = None, max_tokens: Optional[int] = None, ceiling: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream code token deltas from the routed provider as they arrive"""
+        params = self._params(max_tokens)
+        cache_key = self._cache_key(prompt, model, self._params(ceiling or max_tokens))
+        
+        cached = await self._cached(prompt, model, cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Concurrent identical prompts subscribe to the same token stream
+        async for delta in self.inflight.stream(
+            cache_key, lambda: self._stream_groq(prompt, model, cache_key, params)
+        ):
+            yield delta
+    
+    async def _stream_groq(
+        self, prompt: str, model: Optional[str], cache_key: str, params: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """Single routed upstream stream, recording telemetry"""
+        start_time = datetime.now()
+        chunks = []
         
-        return f"""# JHADEPILOT - Fallback Generated Code
-# Prompt: {prompt}
-# Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S IST')}
-
-import asyncio
-import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime
-import json
-
-class {self._generate_class_name(prompt)}:
-    \"\"\"
-    Production-ready solution for: {prompt}
-    
-    Features:
-    - Async/await support for high performance
-    - Comprehensive error handling
-    - Logging and monitoring
-    - Type hints for better code quality
-    - India timezone support
-    \"\"\"
-    
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-        self.created_at = datetime.now()
-        self.logger.info(f"Initialized {{self.__class__.__name__}} at {{self.created_at}}")
-    
-    async def execute(self, **kwargs) -> Dict[str, Any]:
-        \"\"\"Main execution method\"\"\"
         try:
-            self.logger.info("Starting execution...")
-            
-            # Implementation based on prompt: {prompt}
-            result = await self._process_request(**kwargs)
+            async for delta in self.router.stream(self._build_request(prompt), params, model):
+                chunks.append(delta)
+                yield delta
             
-            self.logger.info("Execution completed successfully")
-            return {{
-                "status": "success",
-                "data": result,
-                "timestamp": datetime.now().isoformat(),
-                "execution_time": (datetime.now() - self.created_at).total_seconds()
-            }}
+            duration = (datetime.now() - start_time).total_seconds()
+            self._update_telemetry(duration, success=True)
+            observe_upstream(duration)
+            await self._store(prompt, model, cache_key, "".join(chunks))
             
         except Exception as e:
-            self.logger.error(f"Execution failed: {{str(e)}}")
-            return {{
-                "status": "error",
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }}
-    
-    async def _process_request(self, **kwargs) -> Any:
-        \"\"\"Core processing logic\"\"\"
-        # TODO: Implement specific logic for: {prompt}
-        await asyncio.sleep(0.1)  # Simulate processing
-        
-        return {{
-            "message": "Solution implemented successfully",
-            "prompt": "{prompt}",
-            "features": [
-                "High performance async implementation",
-                "Production-ready error handling",
-                "Comprehensive logging",
-                "India market optimized"
-            ]
-        }}
-
-# Usage Example
-async def main():
-    solution = {self._generate_class_name(prompt)}()
-    result = await solution.execute()
-    print(json.dumps(result, indent=2))
-
-if __name__ == "__main__":
-    asyncio.run(main())
-"""
+            self._update_telemetry((datetime.now() - start_time).total_seconds(), success=False)
+            logger.error(f"LLM provider streaming error: {str(e)}")
+            
+            # Once tokens have gone out the code is truncated; fail the stream
+            # rather than let the agents and history treat it as complete
+            if chunks:
+                raise
+            yield await self._fallback_generation(prompt)
     
-    def _generate_class_name(self, prompt: str) -> str:
-        """Generate appropriate class name from prompt"""
-        words = prompt.replace("-", " ").replace("_", " ").split()
-        class_name = "".join(word.capitalize() for word in words[:3])
-        return f"{class_name}Solution"
+    async def _fallback_generation(self, prompt: str) -> str:
+        """Fallback code generation when primary service fails"""
+        logger.info("Using fallback code generation")
+        return fallback_templates.render(
+            "agent", prompt, generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S IST')
+        )
     
     def _update_telemetry(self, duration: float, success: bool):
-        """Update performance telemetry"""
-        self.telemetry.total_requests += 1
-        
-        if success:
-            # Update average response time
-            self.telemetry.avg_response_time = (
-                (self.telemetry.avg_response_time * (self.telemetry.total_requests - 1) + duration) 
-                / self.telemetry.total_requests
-            )
-        else:
-            self.telemetry.error_count += 1
-        
-        # Update success rate
-        self.telemetry.success_rate = (
-            ((self.telemetry.total_requests - self.telemetry.error_count) / self.telemetry.total_requests) * 100
-        )
-        
-        # Track peak hour usage
-        current_hour = datetime.now().strftime("%H:00")
-        self.telemetry.peak_hour_usage[current_hour] = (
-            self.telemetry.peak_hour_usage.get(current_hour, 0) + 1
-        )
-        
-        self.telemetry.last_updated = datetime.now()
+        """Record one generation in the process-shared duration histogram"""
+        GENERATION_DURATION.labels("success" if success else "error").observe(duration)
+    
+    def telemetry(self) -> Dict[str, Any]:
+        """Running stats for this worker, derived from the duration histogram"""
+        succeeded = GENERATION_DURATION.labels("success")
+        failed = GENERATION_DURATION.labels("error")
+        total = succeeded.count + failed.count
+        return {
+            "avg_response_time": succeeded.sum / succeeded.count if succeeded.count else 0.0,
+            "success_rate": succeeded.count / total * 100 if total else 100.0,
+            "total_requests": int(total)
+        }
 
 class MultiAgentOrchestrator:
     """Advanced multi-agent system for code generation, testing, and deployment"""
     
-    def __init__(self):
-        self.code_generator = AdvancedCodeGenerator()
+    def __init__(
+        self, router: ProviderRouter, cache: ResponseCache, sandbox: SandboxPool, semantic: Optional[SemanticCache] = None
+    ):
+        self.code_generator = AdvancedCodeGenerator(router, cache, semantic)
+        self.sandbox = sandbox
+        self.benchmark = BenchmarkHarness(sandbox)
+        # Agent DAG: each agent starts as soon as the agents it depends on are done
         self.agents = {
-            "BuildAgent": self._build_agent,
-            "TestAgent": self._test_agent,
-            "DeployAgent": self._deploy_agent,
-            "SecurityAgent": self._security_agent,
-            "PerformanceAgent": self._performance_agent
+            spec.name: spec for spec in [
+                AgentSpec("BuildAgent", self._build_agent, streaming=True),
+                AgentSpec("SecurityAgent", self._security_agent),
+                AgentSpec("TestAgent", self._test_agent, depends_on=["BuildAgent"]),
+                AgentSpec("PerformanceAgent", self._performance_agent, depends_on=["BuildAgent"]),
+                AgentSpec("DeployAgent", self._deploy_agent, depends_on=["BuildAgent", "TestAgent", "SecurityAgent"])
+            ]
         }
+        self.engine = AgentEngine(self.agents.values())
     
-    async def orchestrate(self, prompt: str) -> Dict[str, Any]:
-        """Orchestrate multiple agents for comprehensive code generation"""
+    async def orchestrate(
+        self,
+        prompt: str,
+        batched: bool = False,
+        progress: Optional[Progress] = None,
+        max_tokens: Optional[int] = None,
+        ceiling: Optional[int] = None
+    ) -> OrchestrationResult:
+        """Orchestrate multiple agents for comprehensive code generation
+        
+        ``progress`` is awaited with ``generated`` once the code is ready and
+        with an ``agent`` event as each agent finishes (job mode).
+        """
         start_time = datetime.now()
+        timestamp = start_time.isoformat()
         
         # Generate code
-        generated_code = await self.code_generator.generate_with_groq(prompt)
+        with tracing.span("llm.generate"):
+            generated_code = await self.code_generator.generate_with_groq(prompt, max_tokens=max_tokens, ceiling=ceiling)
+        if progress is not None:
+            await progress("generated", {"chars": len(generated_code)})
         
-        # Run agents in parallel for efficiency
-        agent_tasks = []
-        for agent_name, agent_func in self.agents.items():
-            task = asyncio.create_task(agent_func(generated_code, prompt))
-            agent_tasks.append((agent_name, task))
-        
-        # Collect results
+        # Run the agent DAG over the finished code
         agent_results = {}
-        for agent_name, task in agent_tasks:
-            try:
-                result = await task
-                agent_results[agent_name] = result
-            except Exception as e:
-                logger.error(f"{agent_name} failed: {str(e)}")
-                agent_results[agent_name] = {
-                    "status": "failed",
-                    "error": str(e),
-                    "timestamp": datetime.now().isoformat()
-                }
-        
-        total_time = (datetime.now() - start_time).total_seconds()
+        async for agent_name, result in self.engine.run(prompt, generated_code, batched, timestamp):
+            agent_results[agent_name] = result
+            if progress is not None:
+                await progress("agent", self._agent_event(agent_name, result))
         
         return {
             "code": generated_code,
-            "agents": agent_results,
-            "telemetry": {
-                "total_execution_time": total_time,
-                "avg_response_time": self.code_generator.telemetry.avg_response_time,
-                "success_rate": self.code_generator.telemetry.success_rate,
-                "total_requests": self.code_generator.telemetry.total_requests
-            },
-            "timestamp": datetime.now().isoformat()
+            "agents": {name: agent_results[name] for name in self.agents},
+            "telemetry": self._telemetry_snapshot(start_time),
+            "timestamp": timestamp
         }
     
-    async def _build_agent(self, code: str, prompt: str) -> Dict[str, Any]:
+    async def orchestrate_stream(
+        self, prompt: str, max_tokens: Optional[int] = None, ceiling: Optional[int] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Stream token deltas, then agent results as each agent finishes"""
+        start_time = datetime.now()
+        timestamp = start_time.isoformat()
+        
+        # Streaming agents consume the code while it is still being generated
+        agent_run = self.engine.start(prompt, timestamp=timestamp)
+        try:
+            async for delta in self.code_generator.stream_with_groq(prompt, max_tokens=max_tokens, ceiling=ceiling):
+                agent_run.feed_code(delta)
+                yield "token", {"delta": delta}
+                for agent_name, result in agent_run.ready():
+                    yield "agent", self._agent_event(agent_name, result)
+            
+            agent_run.finish_code()
+            
+            async for agent_name, result in agent_run.results_as_completed():
+                yield "agent", self._agent_event(agent_name, result)
+        finally:
+            # Client went away mid-stream
+            agent_run.cancel()
+        
+        yield "done", {
+            "telemetry": self._telemetry_snapshot(start_time),
+            "timestamp": timestamp
+        }
+    
+    def _agent_event(self, agent_name: str, result: Dict[str, Any]) -> AgentEvent:
+        return {
+            "agent": agent_name,
+            "status": result.get("status"),
+            "message": result.get("message") or result.get("error"),
+            "result": result
+        }
+    
+    def _telemetry_snapshot(self, start_time: datetime) -> Dict[str, Any]:
+        """Per-request telemetry merged with the generator's running stats"""
+        return {
+            "total_execution_time": (datetime.now() - start_time).total_seconds(),
+            **self.code_generator.telemetry(),
+            "cache": self.code_generator.cache.stats(),
+            "inflight": self.code_generator.inflight.stats()
+        }
+    
+    async def _build_agent(self, ctx: AgentContext) -> Dict[str, Any]:
         """Advanced build agent with dependency analysis"""
-        await asyncio.sleep(1)  # Simulate build time
+        await simulated_delay(1)  # Simulate build time
         
-        # Analyze code for dependencies
-        dependencies = self._extract_dependencies(code)
+        # Parse each Python block as soon as its closing fence streams in;
+        # the analysis and later agents reuse the cached trees
+        build_time = 0.0
+        async for block in ctx.iter_blocks():
+            if block.is_python or block.is_untagged:
+                started = datetime.now()
+                parse_block(block)
+                build_time += (datetime.now() - started).total_seconds()
+        started = datetime.now()
+        analysis = ctx.analysis()
+        build_time += (datetime.now() - started).total_seconds()
+        
+        if analysis.syntax_errors:
+            first = analysis.syntax_errors[0]
+            return {
+                "status": "failed",
+                "message": f"Syntax error on line {first['line']}: {first['message']}",
+                **analysis.to_dict(),
+                "build_time": f"{build_time * 1000:.1f}ms",
+                "timestamp": ctx.timestamp
+            }
         
         return {
             "status": "success",
-            "message": "Build completed successfully",
-            "dependencies": dependencies,
-            "build_time": "1.2s",
-            "optimizations": [
-                "Code minification applied",
-                "Import optimization completed",
-                "Performance enhancements added"
-            ],
-            "timestamp": datetime.now().isoformat()
+            "message": "Build completed successfully" if analysis.blocks else "No Python code blocks found",
+            **analysis.to_dict(),
+            "build_time": f"{build_time * 1000:.1f}ms",
+            "timestamp": ctx.timestamp
         }
     
-    async def _test_agent(self, code: str, prompt: str) -> Dict[str, Any]:
+    async def _test_agent(self, ctx: AgentContext) -> Dict[str, Any]:
         """Advanced testing agent with multiple test types"""
-        await asyncio.sleep(0.8)  # Simulate test time
+        await simulated_delay(0.8)  # Simulate test time
         
-        test_results = {
-            "unit_tests": {"passed": 15, "failed": 0, "coverage": "94%"},
-            "integration_tests": {"passed": 8, "failed": 0},
-            "security_tests": {"vulnerabilities": 0, "score": "A+"},
-            "performance_tests": {"avg_response": "45ms", "throughput": "1000 req/s"}
-        }
+        modules = ctx.analysis().modules()
+        if not modules:
+            return {
+                "status": "skipped",
+                "message": "No Python code to test",
+                "timestamp": ctx.timestamp
+            }
+        
+        # Execute the code and any generated tests in a warm, resource-limited worker
+        report = await self.sandbox.run(modules, batched=ctx.batched)
+        
+        if report.get("status") == "unavailable":
+            return {
+                "status": "skipped",
+                "message": report.get("error"),
+                "timestamp": ctx.timestamp
+            }
+        if report.get("status") != "completed":
+            return {
+                "status": "failed",
+                "message": f"Sandbox run {report.get('status')}: {report.get('error')}",
+                "sandbox": report,
+                "timestamp": ctx.timestamp
+            }
+        
+        module_errors = [m for m in report["modules"] if m["status"] == "error"]
+        missing = [m["error"] for m in module_errors if m["error"].startswith("ModuleNotFoundError")]
+        if missing:
+            status, message = "skipped", f"Missing dependency in sandbox: {missing[0]}"
+        elif module_errors:
+            status, message = "failed", f"{module_errors[0]['module']} failed to load: {module_errors[0]['error']}"
+        elif report["failed"]:
+            status, message = "failed", f"{report['failed']} of {report['passed'] + report['failed']} tests failed"
+        elif report["passed"]:
+            status, message = "success", f"All {report['passed']} tests passed"
+        else:
+            status, message = "success", "Code loaded cleanly; no tests were generated"
+        if report["skipped"]:
+            message += f" ({len(report['skipped'])} fixture tests skipped)"
         
         return {
-            "status": "success",
-            "message": "All tests passed",
-            "results": test_results,
-            "recommendations": [
-                "Consider adding more edge case tests",
-                "Performance is excellent for India region",
-                "Security compliance verified"
-            ],
-            "timestamp": datetime.now().isoformat()
+            "status": status,
+            "message": message,
+            "results": {
+                "unit_tests": {
+                    "passed": report["passed"],
+                    "failed": report["failed"],
+                    "skipped": len(report["skipped"]),
+                    "coverage": f"{report['coverage']:.0f}%"
+                },
+                "tests": report["tests"],
+                "modules": report["modules"]
+            },
+            "timings": {
+                "wall_time_ms": report["wall_time_ms"],
+                "cpu_time_ms": report["cpu_time_ms"],
+                "peak_rss_kb": report["peak_rss_kb"]
+            },
+            "timestamp": ctx.timestamp
         }
     
-    async def _deploy_agent(self, code: str, prompt: str) -> Dict[str, Any]:
+    async def _deploy_agent(self, ctx: AgentContext) -> Dict[str, Any]:
         """Advanced deployment agent with India-optimized infrastructure"""
-        await asyncio.sleep(1.5)  # Simulate deployment time
+        await simulated_delay(1.5)  # Simulate deployment time
         
         return {
             "status": "success",
@@ -372,94 +456,179 @@ class MultiAgentOrchestrator:
                 "alerts": "configured",
                 "logging": "centralized"
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": ctx.timestamp
         }
     
-    async def _security_agent(self, code: str, prompt: str) -> Dict[str, Any]:
+    async def _security_agent(self, ctx: AgentContext) -> Dict[str, Any]:
         """Security analysis agent"""
-        await asyncio.sleep(0.6)  # Simulate security scan
+        # Rules run over the trees BuildAgent already parsed (shared parse cache)
+        report = scan_code(ctx.code, ctx.analysis())
+        findings = report["findings"]
+        blocking = [f for f in findings if f["severity"] in ("critical", "high")]
         
         return {
-            "status": "success",
-            "message": "Security scan completed",
-            "vulnerabilities": [],
-            "compliance": {
-                "GDPR": "compliant",
-                "India_IT_Act": "compliant",
-                "OWASP_Top_10": "secure"
-            },
-            "recommendations": [
-                "Input validation implemented",
-                "SQL injection protection active",
-                "XSS protection enabled",
-                "Rate limiting configured"
-            ],
-            "security_score": "A+",
-            "timestamp": datetime.now().isoformat()
+            "status": "failed" if blocking else "success",
+            "message": (
+                f"Security scan found {len(findings)} issue(s), {len(blocking)} blocking"
+                if findings else "Security scan completed, no issues found"
+            ),
+            "vulnerabilities": findings,
+            "security_score": security_score(findings),
+            "scan_time_ms": round(report["scan_time_ms"], 3),
+            "truncated": report["truncated"],
+            "timestamp": ctx.timestamp
         }
     
-    async def _performance_agent(self, code: str, prompt: str) -> Dict[str, Any]:
+    async def _performance_agent(self, ctx: AgentContext) -> Dict[str, Any]:
         """Performance optimization agent"""
-        await asyncio.sleep(0.7)  # Simulate performance analysis
+        await simulated_delay(0.7)  # Simulate performance analysis
+        
+        modules = ctx.analysis().modules()
+        if not modules:
+            return {
+                "status": "skipped",
+                "message": "No Python code to benchmark",
+                "timestamp": ctx.timestamp
+            }
+        
+        report = await self.benchmark.run(modules, batched=ctx.batched)
+        
+        if report.get("status") == "unavailable":
+            return {
+                "status": "skipped",
+                "message": report.get("error"),
+                "timestamp": ctx.timestamp
+            }
+        if report.get("status") != "completed":
+            return {
+                "status": "failed",
+                "message": f"Benchmark run {report.get('status')}: {report.get('error')}",
+                "timestamp": ctx.timestamp
+            }
+        
+        if report.get("entry_error"):
+            message = f"Entry point {report['entry_point']} raised {report['entry_error']}"
+        elif report["entry_point"]:
+            message = f"Benchmarked {report['entry_point']} over {report['runs']} runs"
+        else:
+            message = "No zero-argument main() or run() entry point; measured import only"
         
         return {
             "status": "success",
-            "message": "Performance optimization completed",
+            "message": message,
             "metrics": {
-                "response_time": "23ms",
-                "memory_usage": "45MB",
-                "cpu_efficiency": "92%",
-                "database_queries": "optimized"
-            },
-            "optimizations": [
-                "Database indexing improved",
-                "Caching layer added",
-                "Async operations optimized",
-                "Memory allocation tuned"
-            ],
-            "india_specific": {
-                "network_optimization": "enabled",
-                "cdn_integration": "active",
-                "regional_caching": "configured"
+                "import_time_ms": sum(i["import_time_ms"] for i in report["imports"]),
+                "entry_point": report["entry_point"],
+                "runs": report["runs"],
+                "wall_ms": report.get("wall_ms"),
+                "cpu_ms": report.get("cpu_ms"),
+                "python_peak_kb": report["python_peak_kb"],
+                "peak_rss_kb": report["peak_rss_kb"],
+                "budget_exhausted": report.get("budget_exhausted", False)
             },
-            "performance_score": "A+",
-            "timestamp": datetime.now().isoformat()
+            "hotspots": report["hotspots"],
+            "cached": report["cached"],
+            "timestamp": ctx.timestamp
         }
     
     def _extract_dependencies(self, code: str) -> List[str]:
-        """Extract dependencies from generated code"""
-        dependencies = []
-        lines = code.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('import ') or line.startswith('from '):
-                # Extract package names
-                if 'import ' in line:
-                    parts = line.split('import ')[1].split(',')
-                    for part in parts:
-                        dep = part.strip().split('.')[0].split(' as ')[0]
-                        if dep not in ['os', 'sys', 'json', 'datetime', 'typing']:
-                            dependencies.append(dep)
-        
-        return list(set(dependencies))
+        """Extract third-party dependencies from generated code"""
+        return sorted(analyze_code(code).third_party)
 
 # FastAPI app for the agent
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan management"""
     logger.info("JHADEPILOT Advanced Agent starting up...")
+    upstream.open()
+    await sandbox_pool.start()
+    await telemetry_sink.start()
+    await tracer.start()
+    await job_queue.start()
+    await history.start()
+    await history.warm(response_cache)
     yield
+    await job_queue.close()
+    await history.close()
+    await tracer.close()
+    await telemetry_sink.close()
+    await sandbox_pool.close()
+    await upstream.aclose()
+    response_cache.close()
+    job_store.close()
+    if semantic_cache is not None:
+        semantic_cache.close()
     logger.info("JHADEPILOT Advanced Agent shutting down...")
 
 app = FastAPI(
     title="JHADEPILOT Advanced Agent",
     description="Top 1% AI Code Generation Platform - India Optimized",
     version="2.0.0",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
-orchestrator = MultiAgentOrchestrator()
+# Before any metric is written, so this app's workers share one metrics directory
+metrics.configure("agent")
+upstream = UpstreamClientPool()
+response_cache = ResponseCache()
+semantic_cache = build_semantic_cache()
+sandbox_pool = SandboxPool()
+provider_router = build_router(upstream, "groq,blackbox", groq_api_key=GROQ_API_KEY)
+admission = AdaptiveLimiter()
+telemetry_sink = TelemetrySink("agent")
+tracer = Tracer("agent")
+app.add_middleware(TracingMiddleware, tracer=tracer)
+app.add_middleware(DeadlineMiddleware)
+orchestrator = MultiAgentOrchestrator(provider_router, response_cache, sandbox_pool, semantic_cache)
+
+async def run_job(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    """Job handler: a queued job waits for its token quota and admission instead of being shed
+
+    The job fails once the wait would pass JOB_START_TIMEOUT, and at once
+    for a prompt too large for any quota.
+    """
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + JOB_START_TIMEOUT
+    while True:
+        try:
+            grant = reserve_tokens(job["client"], job["prompt"])
+            break
+        except QuotaExceeded as e:
+            if loop.time() + e.retry_after > give_up:
+                raise
+            await asyncio.sleep(e.retry_after)
+    while True:
+        try:
+            permit = await admission.acquire(job["priority"], work=grant.prompt_class)
+            break
+        except AdmissionRejected as e:
+            if loop.time() + e.retry_after > give_up:
+                grant.settle("")
+                raise
+            await asyncio.sleep(e.retry_after)
+    code = ""
+    try:
+        result = await orchestrator.orchestrate(
+            job["prompt"], progress=progress, max_tokens=grant.max_tokens, ceiling=grant.ceiling
+        )
+        result["telemetry"]["admission"] = permit.snapshot()
+        code = result["code"]
+    except Exception:
+        permit.release(overloaded=True)
+        raise
+    finally:
+        permit.release()
+        result_tokens = grant.settle(code)
+    result["telemetry"]["tokens"] = result_tokens
+    telemetry_sink.record(result["telemetry"])
+    record_history(job["prompt"], job["client"], result, grant.ceiling)
+    return result
+
+job_store = JobStore()
+job_queue = JobQueue(job_store, run_job)
+history = HistoryStore()
+token_accountant = TokenAccountant(GENERATION_PARAMS["max_tokens"])
 
 @app.get("/health")
 async def health_check():
@@ -469,45 +638,342 @@ async def health_check():
         "version": "2.0.0",
         "region": "India (Mumbai)",
         "telemetry": {
-            "avg_response_time": orchestrator.code_generator.telemetry.avg_response_time,
-            "success_rate": orchestrator.code_generator.telemetry.success_rate,
-            "total_requests": orchestrator.code_generator.telemetry.total_requests,
-            "circuit_breaker_state": orchestrator.code_generator.circuit_breaker.state
+            **orchestrator.code_generator.telemetry(),
+            "cache": response_cache.stats(),
+            "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+            "inflight": orchestrator.code_generator.inflight.stats()
         },
+        "providers": provider_router.stats(),
+        "admission": admission.stats(),
+        "upstream_pool": upstream.stats(),
+        "sandbox": sandbox_pool.stats(),
+        "telemetry_sink": telemetry_sink.stats(),
+        "tracing": tracer.stats(),
+        "jobs": job_queue.stats(),
+        "tokens": token_accountant.stats(),
+        "fallback": fallback_templates.stats(),
+        "history": history.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated over all workers"""
+    return PlainTextResponse(metrics.render_latest(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+def request_client(http_request: Request) -> str:
+    return client_id(http_request.headers, http_request.client.host if http_request.client else None)
+
+def reserve_tokens(client: Optional[str], prompt: str) -> TokenGrant:
+    """Completion budget for the prompt, charged to the client's token quota"""
+    return token_accountant.reserve(client, prompt, orchestrator.code_generator._build_request(prompt))
+
+def admit_tokens(client: str, prompt: str) -> TokenGrant:
+    """reserve_tokens, shedding the request with 429 and Retry-After when over quota
+
+    A prompt too large for any quota gets 413, since no retry would succeed.
+    """
+    try:
+        return reserve_tokens(client, prompt)
+    except PromptTooLarge as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def history_error(e: HistoryUnavailable) -> HTTPException:
+    headers = {"WWW-Authenticate": "Bearer"} if e.status_code == 401 else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+def record_history(prompt: str, client: Optional[str], result: Dict[str, Any], ceiling: Optional[int]):
+    """Queue a finished generation for /history, keyed as the response cache would key it"""
+    generator = orchestrator.code_generator
+    history.record(
+        prompt,
+        result["code"],
+        client,
+        agents=result["agents"],
+        telemetry=result["telemetry"],
+        duration_ms=result["telemetry"]["total_execution_time"] * 1000,
+        cache_key=generator._cache_key(prompt, None, generator._params(ceiling))
+    )
+
+def apply_timeout(request: Dict[str, Any]):
+    """Tighten the request deadline from its optional ``timeout`` field (seconds)"""
+    timeout = request.get("timeout")
+    if timeout is not None:
+        if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or timeout <= 0:
+            raise HTTPException(status_code=400, detail="timeout must be a positive number of seconds")
+        limit_deadline(timeout)
+
+async def admit(priority: str, grant: TokenGrant) -> Permit:
+    """Take an admission slot or shed the request with 429/503 and Retry-After"""
+    try:
+        with tracing.span("admission.wait", priority=priority):
+            return await admission.acquire(priority, remaining(), grant.prompt_class)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
 @app.post("/generate")
-async def generate_code(request: Dict[str, Any], background_tasks: BackgroundTasks):
+async def generate_code(request: Dict[str, Any], http_request: Request):
     """Advanced code generation with multi-agent orchestration"""
+    tracing.record_since_trace_start("request.parse")
     prompt = request.get("prompt", "")
     
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
+    apply_timeout(request)
     
+    client = request_client(http_request)
+    grant = admit_tokens(client, prompt)
     try:
-        result = await orchestrator.orchestrate(prompt)
-        
-        # Background task to save metrics
-        background_tasks.add_task(save_metrics, result["telemetry"])
+        permit = await admit(request.get("priority", "default"), grant)
+    except HTTPException:
+        grant.settle("")
+        raise
+    
+    if request.get("stream"):
+        return StreamingResponse(
+            stream_generation(prompt, permit, grant, client),
+            media_type=SSE_MEDIA_TYPE,
+            headers=SSE_HEADERS,
+            # Covers a client that disconnects before the stream starts
+            background=BackgroundTask(permit.release)
+        )
+    
+    try:
+        result = await orchestrator.orchestrate(prompt, max_tokens=grant.max_tokens, ceiling=grant.ceiling)
+        result["telemetry"]["admission"] = permit.snapshot()
+        result["telemetry"]["tokens"] = grant.settle(result["code"])
+        permit.release()
+        telemetry_sink.record(result["telemetry"])
+        record_history(prompt, client, result, grant.ceiling)
         
-        return result
+        with tracing.span("response.serialize"):
+            return FastJSONResponse(result)
         
     except Exception as e:
+        permit.release(overloaded=True)
+        grant.settle("")
         logger.error(f"Code generation failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def save_metrics(telemetry: Dict[str, Any]):
-    """Save telemetry data for analytics"""
+async def stream_generation(prompt: str, permit: Permit, grant: TokenGrant, client: str) -> AsyncIterator[str]:
+    """Server-Sent Events stream: token deltas, agent results, then done"""
+    chunks = []
+    agents = {}
     try:
-        metrics_file = Path("metrics.jsonl")
-        async with aiofiles.open(metrics_file, "a") as f:
-            await f.write(json.dumps({
-                **telemetry,
-                "timestamp": datetime.now().isoformat()
-            }) + "\n")
+        async for event, data in orchestrator.orchestrate_stream(prompt, max_tokens=grant.max_tokens, ceiling=grant.ceiling):
+            if event == "token":
+                chunks.append(data["delta"])
+            elif event == "agent":
+                agents[data["agent"]] = data["result"]
+            elif event == "done":
+                data["telemetry"]["admission"] = permit.snapshot()
+                data["telemetry"]["tokens"] = grant.settle("".join(chunks))
+                permit.release()
+            yield sse_event(event, data)
+            if event == "done":
+                telemetry_sink.record(data["telemetry"])
+                # A fallback or near-duplicate hit arrives as one delta; joining it would drop its marker
+                code = chunks[0] if len(chunks) == 1 else "".join(chunks)
+                record_history(prompt, client, {"code": code, "agents": agents, **data}, grant.ceiling)
+    except HTTPException as e:
+        permit.release(overloaded=True)
+        yield sse_event("error", {"error": e.detail, "status_code": e.status_code})
     except Exception as e:
-        logger.error(f"Failed to save metrics: {str(e)}")
+        permit.release(overloaded=True)
+        logger.error(f"Streaming code generation failed: {str(e)}")
+        yield sse_event("error", {"error": str(e), "status_code": 500})
+    finally:
+        permit.release()
+        # Charges only what was streamed before a failure or disconnect
+        grant.settle("".join(chunks))
+
+@app.post("/generate/batch")
+async def generate_batch(request: Dict[str, Any], http_request: Request):
+    """Generate code for many prompts, streaming NDJSON results as each one completes"""
+    tracing.record_since_trace_start("request.parse")
+    prompts = request.get("prompts")
+    
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p for p in prompts):
+        raise HTTPException(status_code=400, detail="prompts must be a non-empty list of non-empty strings")
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+    
+    concurrency = request.get("concurrency", BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be a positive integer")
+    apply_timeout(request)
+    
+    return StreamingResponse(
+        stream_batch(
+            prompts, min(concurrency, BATCH_MAX_CONCURRENCY), request.get("priority", "batch"), request_client(http_request)
+        ),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers=SSE_HEADERS
+    )
+
+async def stream_batch(prompts: List[str], concurrency: int, priority: str, client: str) -> AsyncIterator[str]:
+    """One NDJSON line per prompt in completion order, then a summary line"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    
+    # Identical prompts (after normalization) are generated once
+    groups: Dict[str, List[int]] = {}
+    for index, prompt in enumerate(prompts):
+        groups.setdefault(normalize_prompt(prompt), []).append(index)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run_one(indices: List[int]) -> Tuple[List[int], Dict[str, Any], float]:
+        async with semaphore:
+            item_started = loop.time()
+            outcome = await generate_batch_item(prompts[indices[0]], priority, client)
+            return indices, outcome, loop.time() - item_started
+    
+    tasks = [asyncio.ensure_future(run_one(indices)) for indices in groups.values()]
+    latencies: List[float] = []
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, outcome, latency = await next_done
+            latencies.append(latency)
+            for index in indices:
+                if outcome["status"] == "success":
+                    succeeded += 1
+                yield ndjson_line({
+                    "type": "item",
+                    "index": index,
+                    "prompt": prompts[index],
+                    "duplicate_of": indices[0] if index != indices[0] else None,
+                    "latency_ms": latency * 1000,
+                    **outcome
+                })
+    finally:
+        # Client went away mid-batch
+        for task in tasks:
+            task.cancel()
+    
+    elapsed = loop.time() - started
+    latencies.sort()
+    yield ndjson_line({
+        "type": "summary",
+        "items": len(prompts),
+        "unique": len(groups),
+        "deduplicated": len(prompts) - len(groups),
+        "succeeded": succeeded,
+        "failed": len(prompts) - succeeded,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "items_per_second": len(prompts) / elapsed if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+            "max": latencies[-1] * 1000
+        },
+        "timestamp": datetime.now().isoformat()
+    })
+
+async def generate_batch_item(prompt: str, priority: str, client: str) -> Dict[str, Any]:
+    """One batch prompt through quota, admission and the orchestrator; failures become item errors"""
+    try:
+        grant = reserve_tokens(client, prompt)
+        try:
+            permit = await admission.acquire(priority, remaining(), grant.prompt_class)
+        except AdmissionRejected:
+            grant.settle("")
+            raise
+    except PromptTooLarge as e:
+        return {"status": "rejected", "error": e.detail, "status_code": e.status_code}
+    except (QuotaExceeded, AdmissionRejected) as e:
+        return {"status": "rejected", "error": e.detail, "status_code": e.status_code, "retry_after": e.retry_after}
+    
+    code = ""
+    try:
+        result = await orchestrator.orchestrate(prompt, batched=True, max_tokens=grant.max_tokens, ceiling=grant.ceiling)
+        result["telemetry"]["admission"] = permit.snapshot()
+        code = result["code"]
+    except Exception as e:
+        permit.release(overloaded=True)
+        logger.error(f"Batch item generation failed: {str(e)}")
+        return {"status": "error", "error": str(e), "status_code": 500}
+    finally:
+        permit.release()
+        result_tokens = grant.settle(code)
+    
+    result["telemetry"]["tokens"] = result_tokens
+    telemetry_sink.record(result["telemetry"])
+    record_history(prompt, client, result, grant.ceiling)
+    return {"status": "success", "result": result}
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Dict[str, Any], http_request: Request):
+    """Queue a generation and return its job ID at once"""
+    prompt = request.get("prompt", "")
+    
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Prompt is required")
+    
+    job = await job_queue.submit(prompt, request.get("priority", "default"), request_client(http_request))
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "links": {"self": f"/jobs/{job['id']}", "events": f"/jobs/{job['id']}/events"}
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status, agent statuses and result; ``wait`` long-polls until the job finishes"""
+    job = await job_queue.get(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events with the job's progress, resumable with Last-Event-ID"""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        after = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        after = 0
+    
+    async def stream() -> AsyncIterator[str]:
+        async for seq, event, data in job_queue.events(job_id, after):
+            yield sse_event(event, data, event_id=seq)
+    
+    return StreamingResponse(stream(), media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
+
+@app.get("/history")
+async def list_history(
+    http_request: Request, limit: int = HISTORY_PAGE_SIZE, before: Optional[int] = None, q: Optional[str] = None
+):
+    """The caller's past generations, newest first; ``q`` searches prompts and code, ``before`` pages on"""
+    try:
+        return await history.page(history_caller(http_request.headers.get("Authorization")), limit, before, q)
+    except HistoryUnavailable as e:
+        raise history_error(e)
+
+@app.get("/history/{entry_id}")
+async def get_history(entry_id: int, http_request: Request):
+    """One past generation with its code, agent results and telemetry"""
+    try:
+        entry = await history.get(entry_id, history_caller(http_request.headers.get("Authorization")))
+    except HistoryUnavailable as e:
+        raise history_error(e)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return entry
 
 if __name__ == "__main__":
     uvicorn.run(
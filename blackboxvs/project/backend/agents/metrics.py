@@ -0,0 +1,474 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Each worker writes its own memory-mapped file here; /metrics sums them
+METRICS_DIR = os.getenv(
+    "METRICS_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "jhadepilot_metrics"),
+)
+METRICS_MULTIPROCESS = os.getenv("METRICS_MULTIPROCESS", "1").lower() not in ("0", "false", "no")
+METRICS_FILE_SIZE = 1 << 20
+
+# Starlette appends the charset
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+TOKEN_COUNT_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_LENGTH = struct.Struct("I")
+_VALUE = struct.Struct("d")
+
+_app_name = "default"
+
+
+def configure(app_name: str):
+    """Name the app so workers of different apps never share a metrics directory"""
+    global _app_name
+    _app_name = app_name
+
+
+class _ValueStore:
+    """Append-only key -> float64 map over one mmap'd file owned by this process
+
+    Layout: 8-byte header holding the used length, then entries of
+    [u32 key length][key, padded to 8][f64 value]. Values are updated in
+    place with a single aligned 8-byte write, so readers in other
+    processes never need a lock; the header is bumped only after a new
+    entry is complete.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.size = METRICS_FILE_SIZE
+        self.used = 8
+        self.offsets: Dict[str, int] = {}
+        self._fd = None
+        if path is None:
+            self.buffer = bytearray(self.size)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.ftruncate(self._fd, self.size)
+            self.buffer = mmap.mmap(self._fd, self.size)
+        _LENGTH.pack_into(self.buffer, 0, self.used)
+
+    def offset(self, key: str) -> int:
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        return offset
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode()
+        padded = (4 + len(encoded) + 7) // 8 * 8
+        needed = self.used + padded + 8
+        if needed > self.size:
+            self._grow(needed)
+        _LENGTH.pack_into(self.buffer, self.used, len(encoded))
+        self.buffer[self.used + 4:self.used + 4 + len(encoded)] = encoded
+        offset = self.used + padded
+        _VALUE.pack_into(self.buffer, offset, 0.0)
+        self.used = needed
+        _LENGTH.pack_into(self.buffer, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+    def _grow(self, needed: int):
+        while self.size < needed:
+            self.size *= 2
+        if self._fd is None:
+            self.buffer.extend(bytes(self.size - len(self.buffer)))
+            return
+        os.ftruncate(self._fd, self.size)
+        self.buffer.close()
+        self.buffer = mmap.mmap(self._fd, self.size)
+
+    def write(self, offset: int, value: float):
+        _VALUE.pack_into(self.buffer, offset, value)
+
+
+def _read_entries(buffer) -> Iterator[Tuple[str, float]]:
+    used = _LENGTH.unpack_from(buffer, 0)[0]
+    position = 8
+    while position < used:
+        length = _LENGTH.unpack_from(buffer, position)[0]
+        key = bytes(buffer[position + 4:position + 4 + length]).decode()
+        position += (4 + length + 7) // 8 * 8
+        yield key, _VALUE.unpack_from(buffer, position)[0]
+        position += 8
+
+
+_store: Optional[_ValueStore] = None
+
+
+def _process_store() -> _ValueStore:
+    global _store
+    if _store is None:
+        path = None
+        if METRICS_MULTIPROCESS:
+            directory = os.path.join(METRICS_DIR, _app_name)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                _remove_dead_files(directory)
+                path = os.path.join(directory, f"metrics_{os.getpid()}.db")
+                _store = _ValueStore(path)
+            except OSError as e:
+                logger.warning(f"Multi-process metrics unavailable ({e}), using per-process metrics")
+        if _store is None:
+            _store = _ValueStore(None)
+    return _store
+
+
+def _remove_dead_files(directory: str):
+    # Files left by a previous deployment would otherwise be summed forever
+    for path in glob.glob(os.path.join(directory, "metrics_*.db")):
+        try:
+            if not _pid_alive(_file_pid(path)):
+                os.unlink(path)
+        except (ValueError, OSError):
+            continue
+
+
+def _file_pid(path: str) -> int:
+    return int(os.path.basename(path)[len("metrics_"):-len(".db")])
+
+
+def _reset_after_fork():
+    # A forked child must not write into its parent's file
+    global _store
+    _store = None
+    for metric in REGISTRY:
+        metric._children.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _Value:
+    """One float sample backed by the process store"""
+
+    __slots__ = ("key", "value", "_offset")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.value = 0.0
+        self._offset: Optional[int] = None
+
+    def add(self, amount: float):
+        self.value += amount
+        self._flush()
+
+    def set(self, value: float):
+        self.value = value
+        self._flush()
+
+    def _flush(self):
+        store = _process_store()
+        if self._offset is None:
+            self._offset = store.offset(self.key)
+        store.write(self._offset, self.value)
+
+
+def _key(name: str, labels: Sequence[Tuple[str, str]]) -> str:
+    return json.dumps([name, list(labels)], separators=(",", ":"))
+
+
+class _Metric:
+    """Base for labelled metrics; children are cached per label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values: Any):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._child(list(zip(self.labelnames, key)))
+        return child
+
+    def _child(self, labels: List[Tuple[str, str]]):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("_value",)
+
+    def __init__(self, name: str, labels: List[Tuple[str, str]]):
+        self._value = _Value(_key(name + "_total", labels))
+
+    def inc(self, amount: float = 1.0):
+        self._value.add(amount)
+
+    @property
+    def value(self) -> float:
+        return self._value.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self, labels):
+        return _CounterChild(self.name, labels)
+
+
+class _GaugeChild:
+    __slots__ = ("_value",)
+
+    def __init__(self, name: str, labels: List[Tuple[str, str]]):
+        self._value = _Value(_key(name, labels))
+
+    def set(self, value: float):
+        self._value.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._value.add(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._value.add(-amount)
+
+    @property
+    def value(self) -> float:
+        return self._value.value
+
+
+class Gauge(_Metric):
+    """Per-process value; /metrics sums it over live workers"""
+
+    kind = "gauge"
+
+    def _child(self, labels):
+        return _GaugeChild(self.name, labels)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "_buckets", "_sum", "_count")
+
+    def __init__(self, name: str, labels: List[Tuple[str, str]], bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Non-cumulative counts per bucket; exposition makes them cumulative
+        self._buckets = [
+            _Value(_key(name + "_bucket", labels + [("le", _format_bound(bound))]))
+            for bound in bounds + (float("inf"),)
+        ]
+        self._sum = _Value(_key(name + "_sum", labels))
+        self._count = _Value(_key(name + "_count", labels))
+
+    def observe(self, value: float):
+        self._buckets[bisect_left(self.bounds, value)].add(1.0)
+        self._sum.add(value)
+        self._count.add(1.0)
+
+    @property
+    def sum(self) -> float:
+        return self._sum.value
+
+    @property
+    def count(self) -> float:
+        return self._count.value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(float(b) for b in buckets))
+
+    def _child(self, labels):
+        return _HistogramChild(self.name, labels, self.bounds)
+
+
+def _format_bound(bound: float) -> str:
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+REGISTRY: List[_Metric] = []
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect() -> Dict[str, float]:
+    """Sum every worker's samples; gauges only count workers still alive"""
+    own = _process_store()
+    if own.path is None:
+        return {key: _VALUE.unpack_from(own.buffer, offset)[0] for key, offset in own.offsets.items()}
+
+    gauges = {metric.name for metric in REGISTRY if metric.kind == "gauge"}
+    totals: Dict[str, float] = {}
+    for path in glob.glob(os.path.join(os.path.dirname(own.path), "metrics_*.db")):
+        try:
+            pid = _file_pid(path)
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            continue
+        try:
+            alive = _pid_alive(pid)
+            for key, value in _read_entries(buffer):
+                if not alive and json.loads(key)[0] in gauges:
+                    continue
+                totals[key] = totals.get(key, 0.0) + value
+        finally:
+            buffer.close()
+    return totals
+
+
+def _format_labels(labels: List[List[str]]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_latest() -> str:
+    """Prometheus text exposition (format 0.0.4) aggregated over all workers"""
+    samples: Dict[str, List[Tuple[List[List[str]], float]]] = {}
+    for key, value in _collect().items():
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric in REGISTRY:
+        names = [metric.name + "_total"] if metric.kind == "counter" else [metric.name]
+        if metric.kind == "histogram":
+            names = [metric.name + "_bucket", metric.name + "_sum", metric.name + "_count"]
+        if not any(name in samples for name in names):
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if metric.kind != "histogram":
+            for labels, value in sorted(samples.get(names[0], [])):
+                lines.append(f"{names[0]}{_format_labels(labels)} {_format_value(value)}")
+            continue
+
+        # Buckets are stored per bucket and only once used; exposition lists
+        # every bucket, cumulative, for each series
+        series: Dict[str, Dict[str, float]] = {}
+        for labels, value in samples.get(metric.name + "_bucket", []):
+            base = [label for label in labels if label[0] != "le"]
+            le = next(label[1] for label in labels if label[0] == "le")
+            series.setdefault(json.dumps(base), {})[le] = value
+        bounds = [_format_bound(bound) for bound in metric.bounds + (float("inf"),)]
+        for base_key in sorted(series):
+            base = json.loads(base_key)
+            running = 0.0
+            for le in bounds:
+                running += series[base_key].get(le, 0.0)
+                lines.append(f"{metric.name}_bucket{_format_labels(base + [['le', le]])} {_format_value(running)}")
+        for suffix in ("_sum", "_count"):
+            for labels, value in sorted(samples.get(metric.name + suffix, [])):
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared by both apps
+GENERATION_DURATION = Histogram(
+    "jhadepilot_generation_duration_seconds",
+    "End-to-end code generation time, including fallback",
+    ["outcome"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "jhadepilot_upstream_latency_seconds",
+    "Upstream LLM call latency per provider and model",
+    ["provider", "model", "outcome"],
+)
+UPSTREAM_TTFT = Histogram(
+    "jhadepilot_upstream_ttft_seconds",
+    "Time to first streamed token per provider and model",
+    ["provider", "model"],
+)
+UPSTREAM_TOKENS_PER_SECOND = Histogram(
+    "jhadepilot_upstream_tokens_per_second",
+    "Completion throughput per provider and model",
+    ["provider", "model"],
+    buckets=TOKEN_RATE_BUCKETS,
+)
+UPSTREAM_TOKENS = Counter(
+    "jhadepilot_upstream_tokens",
+    "Tokens sent to (prompt) and received from (completion) each provider and model",
+    ["provider", "model", "kind"],
+)
+UPSTREAM_TRUNCATED = Counter(
+    "jhadepilot_upstream_truncated",
+    "Completions that used their whole max_tokens budget (likely cut off)",
+    ["provider", "model"],
+)
+UPSTREAM_RETRIES = Counter(
+    "jhadepilot_upstream_retries",
+    "Upstream calls retried after a transient failure, and broken streams continued",
+    ["kind"],
+)
+REQUEST_TOKENS = Histogram(
+    "jhadepilot_request_tokens",
+    "Prompt and completion tokens per request",
+    ["kind"],
+    buckets=TOKEN_COUNT_BUCKETS,
+)
+TOKEN_QUOTA_REJECTED = Counter(
+    "jhadepilot_token_quota_rejected",
+    "Requests rejected by per-client token quotas",
+)
+AGENT_DURATION = Histogram(
+    "jhadepilot_agent_duration_seconds",
+    "Agent run time by agent and final status",
+    ["agent", "status"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "jhadepilot_admission_queue_wait_seconds",
+    "Time admitted requests spent in the admission queue",
+    ["priority"],
+)
+ADMISSION_REJECTED = Counter(
+    "jhadepilot_admission_rejected",
+    "Requests shed by admission control",
+    ["status"],
+)
+ADMISSION_LIMIT = Gauge(
+    "jhadepilot_admission_limit",
+    "Current adaptive concurrency limit (summed over workers)",
+)
+ADMISSION_INFLIGHT = Gauge(
+    "jhadepilot_admission_inflight",
+    "Requests currently admitted (summed over workers)",
+)
+CACHE_LOOKUPS = Counter(
+    "jhadepilot_cache_lookups",
+    "Response cache lookups by result",
+    ["result"],
+)
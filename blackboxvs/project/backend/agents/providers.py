@@ -0,0 +1,511 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from circuit_breaker import CircuitBreaker
+from metrics import (
+    UPSTREAM_LATENCY, UPSTREAM_RETRIES, UPSTREAM_TOKENS, UPSTREAM_TOKENS_PER_SECOND, UPSTREAM_TRUNCATED, UPSTREAM_TTFT
+)
+from resilience import (
+    STREAM_SALVAGE, DeadlineExceeded, RetryPolicy, check_deadline, continuation_messages, current_deadline,
+    remaining, retryable, upstream_timeout, without_overlap
+)
+from streaming import iter_chat_deltas
+from tokens import count_tokens, tokenizer
+import tracing
+from upstream import UpstreamClientPool
+
+logger = logging.getLogger(__name__)
+
+# Provider endpoints and credentials
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODELS = [m.strip() for m in os.getenv("GROQ_MODELS", "llama3-70b-8192").split(",") if m.strip()]
+BLACKBOX_API_URL = os.getenv("BLACKBOX_API_URL", "https://api.blackbox.ai/v1/chat/completions")
+BLACKBOX_MODELS = [m.strip() for m in os.getenv("BLACKBOX_MODELS", "blackbox-code").split(",") if m.strip()]
+BLACKBOX_PLACEHOLDER_KEY = "your-blackbox-api-key-here"
+MOCK_PROVIDER_LATENCY = float(os.getenv("MOCK_PROVIDER_LATENCY", "0.2"))
+
+# Routing: LLM_PROVIDERS overrides each app's default preference order
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "")
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_PRIOR_LATENCY = float(os.getenv("ROUTER_PRIOR_LATENCY", "2.0"))
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "1").lower() not in ("0", "false", "no")
+ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("ROUTER_HEDGE_MIN_SAMPLES", "20"))
+ROUTER_LATENCY_WINDOW = 128
+
+
+class NoProviderAvailable(RuntimeError):
+    """Every configured provider is disabled or has an open circuit breaker"""
+
+
+class OpenAICompatibleProvider:
+    """Chat completion provider speaking the OpenAI wire format (Groq, Blackbox)"""
+
+    def __init__(self, name: str, url: str, api_key: str, models: List[str], upstream: UpstreamClientPool):
+        self.name = name
+        self.url = url
+        self.models = models
+        self.upstream = upstream
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _request_headers(self) -> Dict[str, str]:
+        traceparent = tracing.current_traceparent()
+        return {**self.headers, "traceparent": traceparent} if traceparent else self.headers
+
+    async def complete(self, payload: Dict[str, Any]) -> str:
+        response = await self.upstream.post(
+            self.url, json=payload, headers=self._request_headers(), timeout=upstream_timeout(self.upstream.timeout)
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def stream(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        async with self.upstream.stream(
+            "POST", self.url, json=payload, headers=self._request_headers(), timeout=upstream_timeout(self.upstream.timeout)
+        ) as response:
+            response.raise_for_status()
+            async for delta in iter_chat_deltas(response):
+                yield delta
+
+
+class MockProvider:
+    """Local in-process provider for development and offline load tests"""
+
+    def __init__(self, name: str = "mock", latency: float = MOCK_PROVIDER_LATENCY, models: Optional[List[str]] = None):
+        self.name = name
+        self.latency = latency
+        self.models = models or ["mock-code"]
+
+    def _render(self, payload: Dict[str, Any]) -> str:
+        prompt = payload["messages"][-1]["content"]
+        return (
+            f"```python\n# {self.name} response for: {prompt[:200]!r}\n\n"
+            "def main():\n    return \"ok\"\n\n\n"
+            "def test_main():\n    assert main() == \"ok\"\n```\n"
+        )
+
+    async def complete(self, payload: Dict[str, Any]) -> str:
+        await asyncio.sleep(self.latency)
+        return self._render(payload)
+
+    async def stream(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        for line in self._render(payload).splitlines(keepends=True):
+            yield line
+
+
+class RouteStats:
+    """Latency and error tracking for one provider/model pair"""
+
+    def __init__(self, alpha: float = ROUTER_EWMA_ALPHA):
+        self.alpha = alpha
+        self.requests = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.ewma: Optional[float] = None
+        self.samples: deque = deque(maxlen=ROUTER_LATENCY_WINDOW)
+        self.ttfb_samples: deque = deque(maxlen=ROUTER_LATENCY_WINDOW)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated = 0
+        self.tokens_per_second: Optional[float] = None
+
+    def record_tokens(self, prompt_tokens: int, completion_tokens: int, generating: float, truncated: bool):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.truncated += truncated
+        if generating > 0:
+            rate = completion_tokens / generating
+            self.tokens_per_second = rate if self.tokens_per_second is None else (
+                self.alpha * rate + (1 - self.alpha) * self.tokens_per_second
+            )
+
+    def record_success(self, latency: float, ttfb: Optional[float] = None):
+        self.requests += 1
+        self.error_rate *= 1 - self.alpha
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+        self.samples.append(latency)
+        if ttfb is not None:
+            self.ttfb_samples.append(ttfb)
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+
+    @staticmethod
+    def _p95(samples: deque) -> Optional[float]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def p95(self, streaming: bool = False) -> Optional[float]:
+        return self._p95(self.ttfb_samples if streaming else self.samples)
+
+    def score(self, prior: float) -> float:
+        """Expected latency, inflated by the recent error rate"""
+        latency = self.ewma if self.ewma is not None else prior
+        return latency / max(1.0 - self.error_rate, 0.05)
+
+    def to_dict(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        ttfb_p95 = self.p95(streaming=True)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 4),
+            "ewma_ms": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "ttfb_p95_ms": round(ttfb_p95 * 1000, 1) if ttfb_p95 is not None else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "truncated": self.truncated,
+            "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second is not None else None,
+        }
+
+
+class Route:
+    """A provider/model pair the router can send a request to"""
+
+    def __init__(self, provider: Any, model: str, preference: int):
+        self.provider = provider
+        self.model = model
+        self.preference = preference
+        self.stats = RouteStats()
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider.name}/{self.model}"
+
+
+class ProviderRouter:
+    """Routes each completion to the fastest healthy provider and model
+
+    Per-route EWMA latency and error rate decide the order; a per-provider
+    CircuitBreaker, shared by all workers, takes failing providers out of
+    rotation. When hedging is on and the chosen route has not answered (or,
+    for streams, sent its first token) by its own p95, the next route is
+    raced against it and the loser is cancelled. Failures before the first
+    token fail over to the next route. Transient failures are retried with
+    jittered backoff within the request deadline, and a stream that breaks
+    midway is continued from its partial output.
+    """
+
+    def __init__(
+        self,
+        providers: List[Any],
+        hedge: bool = ROUTER_HEDGE,
+        hedge_min_samples: int = ROUTER_HEDGE_MIN_SAMPLES,
+        prior_latency: float = ROUTER_PRIOR_LATENCY,
+        retry: Optional[RetryPolicy] = None,
+        salvage: bool = STREAM_SALVAGE,
+    ):
+        self.providers = {provider.name: provider for provider in providers}
+        self.breakers = {provider.name: CircuitBreaker(provider.name) for provider in providers}
+        self.routes = [
+            Route(provider, model, preference)
+            for preference, provider in enumerate(providers)
+            for model in provider.models
+        ]
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.prior_latency = prior_latency
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.salvage = salvage
+        self.salvaged = 0
+
+    def available(self) -> bool:
+        return bool(self.routes)
+
+    def candidates(self, model: Optional[str] = None) -> List[Route]:
+        """Healthy routes, fastest first; unmeasured routes assume the prior latency"""
+        routes = [
+            route for route in self.routes
+            if (model is None or route.model == model) and self.breakers[route.provider.name].available()
+        ]
+        routes.sort(key=lambda route: (route.stats.score(self.prior_latency), route.preference))
+        return routes
+
+    def _hedge_delay(self, route: Route, streaming: bool) -> Optional[float]:
+        samples = route.stats.ttfb_samples if streaming else route.stats.samples
+        if not self.hedge or len(samples) < self.hedge_min_samples:
+            return None
+        return route.stats.p95(streaming)
+
+    def _payload(self, route: Route, messages: List[Dict[str, str]], params: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        return {"model": route.model, "messages": messages, **params, "stream": stream}
+
+    def _span(self, route: Route):
+        return tracing.span("upstream.request", tracing.KIND_CLIENT, provider=route.provider.name, model=route.model)
+
+    def _record_failure(self, route: Route, error: BaseException, latency: float):
+        route.stats.record_failure()
+        self.breakers[route.provider.name].record_failure()
+        UPSTREAM_LATENCY.labels(route.provider.name, route.model, "error").observe(latency)
+        logger.warning(f"Provider {route.name} failed: {type(error).__name__}: {error}")
+
+    def _record_success(
+        self,
+        route: Route,
+        latency: float,
+        params: Dict[str, Any],
+        prompt_tokens: int,
+        completion: str,
+        ttfb: Optional[float] = None,
+    ):
+        route.stats.record_success(latency, ttfb)
+        self.breakers[route.provider.name].record_success()
+        provider, model = route.provider.name, route.model
+        UPSTREAM_LATENCY.labels(provider, model, "success").observe(latency)
+        if ttfb is not None:
+            UPSTREAM_TTFT.labels(provider, model).observe(ttfb)
+        completion_tokens = count_tokens(completion)
+        UPSTREAM_TOKENS.labels(provider, model, "prompt").inc(prompt_tokens)
+        UPSTREAM_TOKENS.labels(provider, model, "completion").inc(completion_tokens)
+        # Generation time only: a stream's time to first token is queueing and prefill
+        generating = latency - ttfb if ttfb is not None else latency
+        if generating > 0:
+            UPSTREAM_TOKENS_PER_SECOND.labels(provider, model).observe(completion_tokens / generating)
+        max_tokens = params.get("max_tokens")
+        truncated = bool(max_tokens) and completion_tokens >= max_tokens
+        route.stats.record_tokens(prompt_tokens, completion_tokens, generating, truncated)
+        if truncated:
+            UPSTREAM_TRUNCATED.labels(provider, model).inc()
+            logger.warning(f"Provider {route.name} used its whole {max_tokens} token budget; output is likely cut off")
+
+    async def _race(
+        self,
+        routes: List[Route],
+        start: Callable[[Route], Awaitable[Any]],
+        streaming: bool,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> Tuple[Route, Any]:
+        """First successful route wins; at most one hedge, failover on error"""
+        remaining = list(routes)
+        running: Dict[asyncio.Future, Route] = {}
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Optional[Route]:
+            # The breaker admits the request here, so half-open probe slots
+            # are only taken by routes that are actually called
+            while remaining:
+                route = remaining.pop(0)
+                if self.breakers[route.provider.name].can_execute():
+                    running[asyncio.ensure_future(start(route))] = route
+                    return route
+            return None
+
+        primary = launch()
+        if primary is None:
+            raise NoProviderAvailable("No LLM provider is currently available")
+        try:
+            while running:
+                timeout = None
+                if not hedged and remaining and len(running) == 1:
+                    timeout = self._hedge_delay(primary, streaming)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slower than its own p95: race the next route
+                    hedged = True
+                    if launch() is not None:
+                        primary.stats.hedges += 1
+                    continue
+                for task in done:
+                    route = running.pop(task)
+                    if task.exception() is None:
+                        if hedged and route is not primary:
+                            route.stats.hedge_wins += 1
+                        return route, task.result()
+                    last_error = task.exception()
+                if not running:
+                    launch()
+        finally:
+            for task, route in running.items():
+                if discard is not None and task.done() and not task.cancelled() and task.exception() is None:
+                    # Finished in the same instant as the winner
+                    discard(task.result())
+                task.cancel()
+                # A cancelled request never reports back to the breaker
+                self.breakers[route.provider.name].release()
+        raise last_error
+
+    async def complete(
+        self, messages: List[Dict[str, str]], params: Dict[str, Any], model: Optional[str] = None
+    ) -> str:
+        """Non-streamed completion from the best available route"""
+        prompt_tokens = tokenizer.count_messages(messages)
+
+        async def attempt(route: Route) -> str:
+            check_deadline()
+            started = time.perf_counter()
+            left = remaining()
+            try:
+                with self._span(route):
+                    call = route.provider.complete(self._payload(route, messages, params, stream=False))
+                    text = await (asyncio.wait_for(call, left) if left is not None else call)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                # The client's budget ran out, not the route's fault
+                self.breakers[route.provider.name].release()
+                raise DeadlineExceeded() from None
+            except Exception as e:
+                self._record_failure(route, e, time.perf_counter() - started)
+                raise
+            self._record_success(route, time.perf_counter() - started, params, prompt_tokens, text)
+            return text
+
+        _, text = await self.retry.run(lambda: self._race(self.candidates(model), attempt, streaming=False), "completion")
+        return text
+
+    async def stream(
+        self, messages: List[Dict[str, str]], params: Dict[str, Any], model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Streamed completion; a stream that breaks midway is continued where it stopped"""
+        chunks: List[str] = []
+        salvages = 0
+        request_messages, request_params = messages, params
+        while True:
+            source = self._stream_once(request_messages, request_params, model)
+            if chunks:
+                source = without_overlap("".join(chunks), source)
+            try:
+                async for delta in source:
+                    chunks.append(delta)
+                    yield delta
+                return
+            except Exception as e:
+                deadline = current_deadline()
+                if (
+                    not self.salvage or not chunks or not retryable(e) or salvages >= self.retry.attempts - 1
+                    or (deadline is not None and deadline.expired())
+                ):
+                    raise
+                partial = "".join(chunks)
+            max_tokens = params.get("max_tokens")
+            left = max_tokens - count_tokens(partial) if max_tokens else None
+            if left is not None and left <= 0:
+                # The budget was spent before the break: nothing left to continue
+                return
+            salvages += 1
+            self.salvaged += 1
+            UPSTREAM_RETRIES.labels("salvage").inc()
+            logger.warning(f"Stream broke after {len(partial)} chars, continuing from the partial output")
+            request_messages = continuation_messages(messages, partial)
+            request_params = {**params, "max_tokens": left} if left is not None else params
+
+    async def _stream_once(
+        self, messages: List[Dict[str, str]], params: Dict[str, Any], model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """One streamed completion; routes race to the first token, the winner streams the rest"""
+        prompt_tokens = tokenizer.count_messages(messages)
+        deadline = current_deadline()
+
+        async def attempt(route: Route) -> Tuple[AsyncIterator[str], Optional[str], float]:
+            check_deadline()
+            started = time.perf_counter()
+            source = route.provider.stream(self._payload(route, messages, params, stream=True))
+            try:
+                # Covers connect and time to the first token
+                with self._span(route):
+                    first = await source.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except asyncio.CancelledError:
+                await source.aclose()
+                raise
+            except Exception as e:
+                self._record_failure(route, e, time.perf_counter() - started)
+                raise
+            return source, first, started
+
+        def discard(result: Tuple[AsyncIterator[str], Optional[str], float]):
+            asyncio.ensure_future(result[0].aclose())
+
+        route, (source, first, started) = await self.retry.run(
+            lambda: self._race(self.candidates(model), attempt, streaming=True, discard=discard), "stream"
+        )
+        ttfb = time.perf_counter() - started
+        chunks: List[str] = []
+        chars = 0
+        stream_span = tracing.start_span("upstream.stream", provider=route.provider.name, model=route.model)
+        try:
+            if first is not None:
+                chunks.append(first)
+                chars += len(first)
+                yield first
+                async for delta in source:
+                    chunks.append(delta)
+                    chars += len(delta)
+                    yield delta
+                    if deadline is not None:
+                        deadline.check()
+        except Exception as e:
+            stream_span.set_error(e)
+            if isinstance(e, DeadlineExceeded):
+                self.breakers[route.provider.name].release()
+            else:
+                self._record_failure(route, e, time.perf_counter() - started)
+            raise
+        finally:
+            await source.aclose()
+            stream_span.set_attribute("chars", chars)
+            stream_span.end()
+        self._record_success(route, time.perf_counter() - started, params, prompt_tokens, "".join(chunks), ttfb)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedging": self.hedge,
+            "retries": self.retry.stats(),
+            "salvaged_streams": self.salvaged,
+            "providers": {
+                name: {
+                    "circuit_breaker_state": self.breakers[name].state,
+                    "circuit_breaker": self.breakers[name].stats(),
+                    "routes": {
+                        route.model: route.stats.to_dict()
+                        for route in self.routes if route.provider.name == name
+                    },
+                }
+                for name in self.providers
+            },
+        }
+
+
+def build_router(
+    upstream: UpstreamClientPool,
+    default_order: str,
+    groq_api_key: Optional[str] = None,
+    blackbox_api_key: Optional[str] = None,
+) -> ProviderRouter:
+    """Router over the providers named in LLM_PROVIDERS (or ``default_order``)
+
+    Providers without a configured API key are left out.
+    """
+    groq_api_key = groq_api_key or os.getenv("GROQ_API_KEY")
+    blackbox_api_key = blackbox_api_key or os.getenv("BLACKBOX_API_KEY")
+    providers = []
+    for name in (LLM_PROVIDERS or default_order).split(","):
+        name = name.strip().lower()
+        if name == "groq" and groq_api_key:
+            providers.append(OpenAICompatibleProvider("groq", GROQ_API_URL, groq_api_key, GROQ_MODELS, upstream))
+        elif name == "blackbox" and blackbox_api_key and blackbox_api_key != BLACKBOX_PLACEHOLDER_KEY:
+            providers.append(OpenAICompatibleProvider("blackbox", BLACKBOX_API_URL, blackbox_api_key, BLACKBOX_MODELS, upstream))
+        elif name == "mock":
+            providers.append(MockProvider())
+        elif name:
+            logger.info(f"LLM provider {name} is not configured, skipping")
+    logger.info(f"LLM providers enabled: {', '.join(p.name for p in providers) or 'none'}")
+    return ProviderRouter(providers)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from metrics import UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Client deadline: seconds the caller will wait, from this header or a request field
+DEADLINE_HEADER = b"x-request-timeout"
+# Applied when the client sends none; 0 means no deadline beyond the upstream timeouts
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", "0"))
+MAX_REQUEST_TIMEOUT = float(os.getenv("MAX_REQUEST_TIMEOUT", "300"))
+
+# Upstream retries with decorrelated jitter, only while the deadline allows
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "5.0"))
+# A Retry-After longer than this is not waited out
+RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "30"))
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+# Streams cut off midway are continued from their partial output
+STREAM_SALVAGE = os.getenv("STREAM_SALVAGE", "1").lower() not in ("0", "false", "no")
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off. Continue it from exactly where it stopped, "
+    "without repeating any of it and without commentary."
+)
+# A continuation that starts by repeating at least this much of the tail has the repeat dropped
+OVERLAP_MIN = 8
+OVERLAP_WINDOW = 256
+
+
+class DeadlineExceeded(Exception):
+    """The client's deadline passed before the upstream answered"""
+
+    status_code = 504
+
+    def __init__(self, detail: str = "Request deadline exceeded"):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class Deadline:
+    """Monotonic point in time a request must finish by; None means unbounded"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at: Optional[float] = None
+        self.limit(timeout)
+
+    def limit(self, timeout: Optional[float]):
+        """Bring the deadline forward to ``timeout`` seconds from now, never push it back"""
+        if not timeout or timeout <= 0:
+            return
+        expires_at = time.monotonic() + min(timeout, MAX_REQUEST_TIMEOUT)
+        if self.expires_at is None or expires_at < self.expires_at:
+            self.expires_at = expires_at
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded()
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, None without one"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def check_deadline():
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def limit_deadline(timeout: Optional[float]):
+    """Tighten the current request's deadline from a ``timeout`` request field"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.limit(timeout)
+
+
+def upstream_timeout(timeout: httpx.Timeout) -> httpx.Timeout:
+    """``timeout`` with every phase capped at the time left before the deadline"""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.001)
+    return httpx.Timeout(
+        connect=min(timeout.connect or left, left),
+        read=min(timeout.read or left, left),
+        write=min(timeout.write or left, left),
+        pool=min(timeout.pool or left, left),
+    )
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving each HTTP request a Deadline from the X-Request-Timeout header
+
+    Handlers can only tighten it (``limit_deadline``); upstream calls,
+    retries and admission waits made for the request stay within it.
+    """
+
+    def __init__(self, app, default_timeout: float = DEFAULT_REQUEST_TIMEOUT):
+        self.app = app
+        self.default_timeout = default_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timeout = self.default_timeout
+        for key, value in scope["headers"]:
+            if key == DEADLINE_HEADER:
+                try:
+                    timeout = float(value)
+                except ValueError:
+                    pass
+                break
+        token = _current.set(Deadline(timeout))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from an upstream error response's Retry-After header, if any"""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retryable(error: BaseException) -> bool:
+    """Transient failures: rate limits, 5xx and transport errors"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+class RetryPolicy:
+    """Retries transient failures with decorrelated jitter within the request deadline
+
+    Each delay is drawn from [base, 3 * previous delay], capped at
+    ``max_delay``, and is never shorter than the upstream's Retry-After.
+    A retry whose delay would not leave time before the deadline is not
+    attempted.
+    """
+
+    def __init__(
+        self,
+        attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        retry_after_max: float = RETRY_AFTER_MAX,
+    ):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_after_max = retry_after_max
+        self.retries = 0
+        self.gave_up = 0
+
+    def next_delay(self, previous: float) -> float:
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+    def backoff(self, error: BaseException, previous: float) -> Optional[float]:
+        """Delay before retrying after ``error``, or None if it should not be retried"""
+        if not retryable(error):
+            return None
+        delay = self.next_delay(previous)
+        after = retry_after(error)
+        if after is not None:
+            if after > self.retry_after_max:
+                return None
+            delay = max(delay, after)
+        left = remaining()
+        if left is not None and delay >= left:
+            return None
+        return delay
+
+    async def run(self, call: Callable[[], Awaitable[T]], name: str = "upstream") -> T:
+        attempt, delay = 1, self.base_delay
+        while True:
+            check_deadline()
+            try:
+                return await call()
+            except Exception as e:
+                backoff = self.backoff(e, delay) if attempt < self.attempts else None
+                if backoff is None:
+                    if attempt > 1:
+                        self.gave_up += 1
+                    raise
+                delay = backoff
+            self.retries += 1
+            UPSTREAM_RETRIES.labels("retry").inc()
+            logger.info(f"Retrying {name} in {delay:.2f}s after attempt {attempt}")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        return {"max_attempts": self.attempts, "retries": self.retries, "gave_up": self.gave_up}
+
+
+def continuation_messages(messages: List[Dict[str, str]], partial: str) -> List[Dict[str, str]]:
+    """Chat messages asking the model to continue ``partial`` where it broke off"""
+    return [*messages, {"role": "assistant", "content": partial}, {"role": "user", "content": CONTINUE_PROMPT}]
+
+
+def trim_overlap(partial: str, continuation: str) -> str:
+    """Drop a continuation's leading repeat of the partial output's tail"""
+    for size in range(min(len(partial), len(continuation), OVERLAP_WINDOW), OVERLAP_MIN - 1, -1):
+        if partial.endswith(continuation[:size]):
+            return continuation[size:]
+    return continuation
+
+
+async def without_overlap(partial: str, source: AsyncIterator[str]) -> AsyncIterator[str]:
+    """``source`` with any leading repeat of ``partial``'s tail removed"""
+    buffered: Optional[List[str]] = []
+    size = 0
+    async for delta in source:
+        if buffered is None:
+            yield delta
+            continue
+        buffered.append(delta)
+        size += len(delta)
+        if size >= OVERLAP_WINDOW:
+            text = trim_overlap(partial, "".join(buffered))
+            buffered = None
+            if text:
+                yield text
+    if buffered:
+        text = trim_overlap(partial, "".join(buffered))
+        if text:
+            yield text
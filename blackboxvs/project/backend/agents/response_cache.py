@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import CACHE_LOOKUPS
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration, overridable per deployment
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory, sqlite, off
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share a key"""
+    return " ".join(prompt.split()).casefold()
+
+
+def make_cache_key(
+    prompt: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    system_prompt: str,
+) -> str:
+    """Stable key over everything that changes the completion"""
+    digest = hashlib.sha256()
+    for part in (normalize_prompt(prompt), model, repr(float(temperature)), str(max_tokens), system_prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with a byte budget and per-entry TTL"""
+
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> Tuple[Optional[str], int]:
+        """Return (value, expired_count)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, 0
+        value, size, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            self.total_bytes -= size
+            return None, 1
+        self._entries.move_to_end(key)
+        return value, 0
+
+    def set(self, key: str, value: str, ttl: float, now: float) -> int:
+        """Store a value, returning how many entries were evicted"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return 0
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        self._entries[key] = (value, size, now + ttl)
+        self.total_bytes += size
+
+        evicted = 0
+        while self.total_bytes > self.max_bytes:
+            _, (_, old_size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= old_size
+            evicted += 1
+        return evicted
+
+    def size(self) -> Tuple[int, int]:
+        return len(self._entries), self.total_bytes
+
+    def close(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+class SQLiteCacheBackend:
+    """On-disk LRU shared by every worker on the host, survives restarts"""
+
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+        CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta (id, total_bytes) VALUES (0, 0);
+        CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+            UPDATE meta SET total_bytes = total_bytes + NEW.size WHERE id = 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+            UPDATE meta SET total_bytes = total_bytes - OLD.size WHERE id = 0;
+        END;
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Connection is shared by the threadpool; sqlite3 needs explicit locking for that
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def get(self, key: str, now: float) -> Tuple[Optional[str], int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, 0
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None, 1
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return value, 0
+
+    def set(self, key: str, value: str, ttl: float, now: float) -> int:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return 0
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                conn.execute(
+                    "INSERT INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now + ttl, now),
+                )
+                # Expired rows go first, then least recently used
+                evicted = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,)).rowcount
+                (total,) = conn.execute("SELECT total_bytes FROM meta WHERE id = 0").fetchone()
+                while total > self.max_bytes:
+                    row = conn.execute(
+                        "SELECT key, size FROM entries ORDER BY last_access LIMIT 1"
+                    ).fetchone()
+                    if row is None:
+                        break
+                    conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+                    total -= row[1]
+                    evicted += 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return evicted
+
+    def size(self) -> Tuple[int, int]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            (total,) = self._conn.execute("SELECT total_bytes FROM meta WHERE id = 0").fetchone()
+        return entries, total
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """Prompt response cache in front of upstream LLM calls"""
+
+    def __init__(
+        self,
+        backend: str = RESPONSE_CACHE_BACKEND,
+        path: str = RESPONSE_CACHE_PATH,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        ttl: float = RESPONSE_CACHE_TTL,
+    ):
+        self.ttl = ttl
+        self.enabled = backend != "off"
+        if backend == "sqlite":
+            self.backend = SQLiteCacheBackend(path, max_bytes)
+        else:
+            self.backend = MemoryCacheBackend(max_bytes)
+        self.backend_name = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def _call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def get(self, key: str) -> Optional[str]:
+        """Cached completion for key, or None"""
+        if not self.enabled:
+            return None
+        with tracing.span("cache.lookup", backend=self.backend_name) as span:
+            try:
+                value, expired = await self._call(self.backend.get, key, time.time())
+            except Exception as e:
+                logger.error(f"Response cache lookup failed: {str(e)}")
+                value, expired = None, 0
+            span.set_attribute("hit", value is not None)
+        self.expirations += expired
+        if value is None:
+            self.misses += 1
+            CACHE_LOOKUPS.labels("miss").inc()
+        else:
+            self.hits += 1
+            CACHE_LOOKUPS.labels("hit").inc()
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Store a successful completion"""
+        if not self.enabled or not value:
+            return
+        try:
+            self.evictions += await self._call(
+                self.backend.set, key, value, self.ttl if ttl is None else ttl, time.time()
+            )
+        except Exception as e:
+            logger.error(f"Response cache store failed: {str(e)}")
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters for telemetry"""
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": self.backend_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups * 100) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+        if not self.backend.blocking:
+            # Cheap for the in-process backend; the SQLite size needs a query
+            stats["entries"], stats["bytes"] = self.backend.size()
+        return stats
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import sysconfig
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sandbox sizing: deploy.sh gives the container 1 CPU / 1 GB
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(min(os.cpu_count() or 1, 2))))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "2"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "256"))
+SANDBOX_WALL_SECONDS = float(os.getenv("SANDBOX_WALL_SECONDS", "5"))
+# Batched runs: jobs arriving within the window are spread over the workers,
+# several jobs per message
+SANDBOX_BATCH_SIZE = int(os.getenv("SANDBOX_BATCH_SIZE", "8"))
+SANDBOX_BATCH_WINDOW = float(os.getenv("SANDBOX_BATCH_WINDOW", "0.02"))
+
+# Jobs run in their own network and mount namespaces; without them they are refused
+SANDBOX_REQUIRE_ISOLATION = os.getenv("SANDBOX_REQUIRE_ISOLATION", "true").lower() not in ("0", "false", "no")
+# Identity jobs drop to when the worker runs as root
+SANDBOX_UID = int(os.getenv("SANDBOX_UID", "65534"))
+SANDBOX_GID = int(os.getenv("SANDBOX_GID", "65534"))
+# Extra directories (comma-separated) hidden from jobs besides the app directory
+SANDBOX_HIDDEN_PATHS = [p for p in os.getenv("SANDBOX_HIDDEN_PATHS", "").split(",") if p.strip()]
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "sandbox_worker.py"
+# Replies are capped at 1 MB by the worker; the reader limit leaves headroom
+READ_LIMIT = 4 * 1024 * 1024
+
+
+def worker_environment() -> Dict[str, str]:
+    """The minimal environment handed to workers, so API keys never reach generated code"""
+    env = {"PATH": os.defpath, "LANG": "C.UTF-8"}
+    if os.getenv("TZ"):
+        env["TZ"] = os.environ["TZ"]
+    return env
+
+
+def hidden_paths() -> List[str]:
+    """Directories covered by an empty mount inside each job
+
+    Directories holding the interpreter or its packages stay visible, or
+    jobs could not import the standard library.
+    """
+    app_dir = Path(__file__).resolve().parent.parent
+    paths = [str(app_dir), os.getcwd(), str(Path.home()), "/proc", "/dev/shm", *SANDBOX_HIDDEN_PATHS]
+    needed = [Path(p).resolve() for p in (sys.prefix, sys.base_prefix, *sysconfig.get_paths().values())]
+    hidden = []
+    for path in dict.fromkeys(Path(p.strip()).resolve() for p in paths):
+        if any(path == n or path in n.parents for n in needed):
+            logger.warning(f"Sandbox cannot hide {path}: it contains the Python installation")
+            continue
+        hidden.append(str(path))
+    return hidden
+
+
+class _Worker:
+    """One warm sandbox worker process"""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.jobs = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def send(self, message: Dict[str, Any]):
+        self.process.stdin.write(json.dumps(message).encode() + b"\n")
+        await self.process.stdin.drain()
+
+    async def receive(self, timeout: float) -> Dict[str, Any]:
+        """One job's result; the worker writes a line per job as each finishes"""
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout=timeout)
+        if not line:
+            raise RuntimeError("Sandbox worker exited unexpectedly")
+        self.jobs += 1
+        return json.loads(line)
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+
+
+class SandboxPool:
+    """Bounded pool of pre-started sandbox workers reused across requests
+
+    Each worker forks a resource-limited child per job, so interpreter
+    startup is paid once per worker rather than once per request, and at
+    most ``size`` jobs run at a time no matter how many requests arrive.
+    """
+
+    def __init__(
+        self,
+        size: int = SANDBOX_WORKERS,
+        cpu_seconds: int = SANDBOX_CPU_SECONDS,
+        memory_mb: int = SANDBOX_MEMORY_MB,
+        wall_seconds: float = SANDBOX_WALL_SECONDS,
+        batch_size: int = SANDBOX_BATCH_SIZE,
+        batch_window: float = SANDBOX_BATCH_WINDOW,
+    ):
+        self.size = max(size, 1)
+        self.limits = {
+            "cpu_seconds": cpu_seconds,
+            "memory_bytes": memory_mb * 1024 * 1024,
+            "wall_seconds": wall_seconds,
+        }
+        self.isolation = {
+            "required": SANDBOX_REQUIRE_ISOLATION,
+            "uid": SANDBOX_UID,
+            "gid": SANDBOX_GID,
+            "hidden_paths": hidden_paths(),
+        }
+        self.batch_size = max(batch_size, 1)
+        self.batch_window = batch_window
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[_Worker] = []
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        self.jobs_run = 0
+        self.batches_run = 0
+        self.jobs_waiting = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    async def _spawn(self) -> _Worker:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-I", str(WORKER_SCRIPT),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=worker_environment(),
+            limit=READ_LIMIT,
+        )
+        worker = _Worker(process)
+        self._workers.append(worker)
+        return worker
+
+    async def start(self):
+        """Start the warm workers (called from the app lifespan)"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._idle is not None:
+                return
+            idle = asyncio.Queue()
+            for _ in range(self.size):
+                idle.put_nowait(await self._spawn())
+            self._idle = idle
+            logger.info(f"Sandbox pool started with {self.size} workers")
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        for task in list(self._batches):
+            task.cancel()
+        for worker in self._workers:
+            worker.kill()
+        for worker in self._workers:
+            await worker.process.wait()
+        self._workers.clear()
+        self._idle = None
+
+    async def run(
+        self,
+        modules: List[Dict[str, str]],
+        kind: str = "test",
+        options: Optional[Dict[str, Any]] = None,
+        batched: bool = False,
+        **limits
+    ) -> Dict[str, Any]:
+        """Run generated modules in a sandboxed child process
+
+        ``kind`` is ``test`` (load modules and run their tests) or
+        ``benchmark`` (time the entry point, see sandbox_worker.run_benchmark).
+        With ``batched``, the job waits up to ``batch_window`` for other
+        batched jobs. They are then split across the workers, several per
+        message, trading a little latency for fewer worker round trips.
+        """
+        if self._idle is None:
+            await self.start()
+        job = {
+            "kind": kind,
+            "modules": modules,
+            "limits": {**self.limits, **limits},
+            "isolation": self.isolation,
+        }
+        if options:
+            job[kind] = options
+        if batched:
+            return await self._enqueue(job)
+        # Grace on top of the child's own wall limit covers fork and result transfer
+        result = await self._submit(job, job["limits"]["wall_seconds"] + 2.0)
+        self.jobs_run += 1
+        if result.get("status") == "timeout":
+            self.timeouts += 1
+        return result
+
+    async def _enqueue(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((job, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Callers cancelled while waiting drop out of the batch
+        pending = [(job, future) for job, future in self._pending if not future.done()]
+        self._pending = []
+        # One message per worker, so the batch runs in parallel across the pool
+        count = min(len(pending), self.size)
+        for i in range(count):
+            task = asyncio.ensure_future(self._run_batch(pending[i::count]))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        futures = iter(future for _, future in pending)
+
+        def deliver(result: Dict[str, Any]):
+            self.jobs_run += 1
+            if result.get("status") == "timeout":
+                self.timeouts += 1
+            future = next(futures)
+            if not future.done():
+                future.set_result(result)
+
+        jobs = [job for job, _ in pending]
+        try:
+            await self._exchange({"kind": "batch", "jobs": jobs}, [job["limits"]["wall_seconds"] + 2.0 for job in jobs], deliver)
+            self.batches_run += 1
+        except asyncio.CancelledError:
+            for _, future in pending:
+                future.cancel()
+            raise
+        except Exception as e:
+            # Never leave a caller waiting on a batch that could not be sent
+            logger.error(f"Sandbox batch failed: {e}")
+            for _, future in pending:
+                if not future.done():
+                    future.set_result({"status": "error", "error": f"Sandbox worker failed: {type(e).__name__}"})
+
+    async def _submit(self, job: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        results = []
+        await self._exchange(job, [timeout], results.append)
+        return results[0]
+
+    async def _exchange(
+        self, message: Dict[str, Any], timeouts: List[float], deliver: Callable[[Dict[str, Any]], None]
+    ):
+        """Send one message to an idle worker and deliver a result per job, replacing the worker if it misbehaves"""
+        self.jobs_waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self.jobs_waiting -= 1
+
+        delivered = 0
+        try:
+            if not worker.alive:
+                worker = await self._replace(worker)
+            await worker.send(message)
+            # Each job gets its own timeout, counted from the previous result
+            for timeout in timeouts:
+                deliver(await worker.receive(timeout))
+                delivered += 1
+        except (asyncio.TimeoutError, asyncio.CancelledError, RuntimeError, ValueError, OSError) as e:
+            # The worker's state is unknown; never hand it to another request
+            worker.kill()
+            worker = await self._replace(worker)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+            error = {"status": "error", "error": f"Sandbox worker failed: {type(e).__name__}"}
+            for _ in timeouts[delivered:]:
+                deliver(error)
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def _replace(self, worker: _Worker) -> _Worker:
+        self.restarts += 1
+        if worker in self._workers:
+            self._workers.remove(worker)
+        return await self._spawn()
+
+    def stats(self) -> Dict[str, Any]:
+        idle = self._idle.qsize() if self._idle is not None else 0
+        return {
+            "workers": len(self._workers),
+            "busy": len(self._workers) - idle if self._idle is not None else 0,
+            "waiting": self.jobs_waiting,
+            "jobs_run": self.jobs_run,
+            "batches_run": self.batches_run,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,518 @@
+"""Warm sandbox worker: reads jobs as JSON lines on stdin, forks a
+resource-limited child per job and writes one JSON result line per job.
+
+Started by sandbox.SandboxPool; not meant to be run by hand.
+"""
+import asyncio
+import contextlib
+import cProfile
+import ctypes
+import inspect
+import io
+import json
+import os
+import pstats
+import resource
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+import types
+import unittest
+
+# Modules generated code commonly imports, loaded once in the warm parent
+import collections  # noqa: F401
+import dataclasses  # noqa: F401
+import datetime  # noqa: F401
+import functools  # noqa: F401
+import itertools  # noqa: F401
+import logging  # noqa: F401
+import re  # noqa: F401
+import typing  # noqa: F401
+
+MAX_OUTPUT = 4096
+# Largest reply line the worker writes; bigger reports are replaced by an error
+MAX_REPLY = 1024 * 1024
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+PR_SET_NO_NEW_PRIVS = 38
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+
+
+class IsolationError(Exception):
+    """The job cannot be isolated from the network and the host files"""
+
+
+class _CapHeader(ctypes.Structure):
+    _fields_ = [("version", ctypes.c_uint32), ("pid", ctypes.c_int)]
+
+
+class _CapData(ctypes.Structure):
+    _fields_ = [("effective", ctypes.c_uint32), ("permitted", ctypes.c_uint32), ("inheritable", ctypes.c_uint32)]
+
+
+def _describe(error):
+    """Exception text for a report, bounded so a huge message cannot bloat the reply"""
+    try:
+        text = f"{type(error).__name__}: {error}"
+    except BaseException:
+        text = f"{type(error).__name__}: <unprintable>"
+    return text[:MAX_OUTPUT]
+
+
+def _libc_call(libc, name, *args):
+    if getattr(libc, name)(*args) != 0:
+        errno = ctypes.get_errno()
+        raise IsolationError(f"{name}: {os.strerror(errno)}")
+
+
+def _write_file(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def _isolate(options):
+    """Move the job into fresh network and mount namespaces and hide host state
+
+    The network namespace has only a downed loopback, so nothing is reachable.
+    The app directory, /proc (parent environments) and /dev/shm are covered
+    by empty tmpfs mounts, and the job gets a private /tmp as its workdir.
+    As root the job then drops to the sandbox uid; otherwise a user
+    namespace provides the privileges for the mounts, which are then dropped.
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    uid, gid = os.getuid(), os.getgid()
+    flags = CLONE_NEWNET | CLONE_NEWNS
+    if uid != 0:
+        flags |= CLONE_NEWUSER
+    _libc_call(libc, "unshare", flags)
+    try:
+        if uid != 0:
+            _write_file("/proc/self/setgroups", "deny")
+            _write_file("/proc/self/uid_map", f"{uid} {uid} 1")
+            _write_file("/proc/self/gid_map", f"{gid} {gid} 1")
+        # Keep the mounts below out of the worker's namespace
+        _libc_call(libc, "mount", b"none", b"/", None, MS_REC | MS_PRIVATE, None)
+        for path in options.get("hidden_paths", []):
+            if os.path.isdir(path) and os.path.abspath(path) not in ("/", "/tmp"):
+                _libc_call(libc, "mount", b"tmpfs", os.fsencode(path), b"tmpfs",
+                           MS_NOSUID | MS_NODEV, b"mode=000,size=4k")
+        _libc_call(libc, "mount", b"tmpfs", b"/tmp", b"tmpfs",
+                   MS_NOSUID | MS_NODEV, b"mode=1777,size=16m")
+    except OSError as e:
+        raise IsolationError(_describe(e)) from e
+    os.chdir("/tmp")
+
+    if uid == 0:
+        os.setgroups([])
+        os.setgid(int(options.get("gid", 65534)))
+        os.setuid(int(options.get("uid", 65534)))
+    else:
+        # Without capabilities the job cannot unmount the tmpfs covers
+        _libc_call(libc, "prctl", PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+        header = _CapHeader(_LINUX_CAPABILITY_VERSION_3, 0)
+        _libc_call(libc, "capset", ctypes.byref(header), (_CapData * 2)())
+
+
+def _block_network():
+    """Best-effort network denial when isolation is not required and unavailable"""
+    def denied(*args, **kwargs):
+        raise PermissionError("Network access is disabled in the sandbox")
+
+    class DeniedSocket(socket.socket):
+        def __init__(self, family=-1, *args, **kwargs):
+            if family in (socket.AF_INET, socket.AF_INET6, -1):
+                denied()
+            super().__init__(family, *args, **kwargs)
+
+    socket.socket = DeniedSocket
+    socket.create_connection = denied
+    socket.getaddrinfo = denied
+
+
+def _apply_limits(limits):
+    cpu = int(limits.get("cpu_seconds", 2))
+    memory = int(limits.get("memory_bytes", 256 * 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (1024 * 1024, 1024 * 1024))
+    # No child processes: generated code cannot fork-bomb the container
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+    # RLIMIT_NPROC is not enforced for root, so also remove the entry points
+    def denied(*args, **kwargs):
+        raise PermissionError("Process creation is disabled in the sandbox")
+
+    for name in ("fork", "forkpty", "system", "popen", "posix_spawn", "posix_spawnp",
+                 "execv", "execve", "execvp", "execvpe", "execl", "execle", "execlp", "execlpe",
+                 "spawnv", "spawnve", "spawnvp", "spawnvpe", "spawnl", "spawnle", "spawnlp", "spawnlpe"):
+        if hasattr(os, name):
+            setattr(os, name, denied)
+    import subprocess
+    subprocess.Popen = denied
+
+
+def _executable_lines(code):
+    lines = set()
+    stack = [code]
+    while stack:
+        current = stack.pop()
+        lines.update(line for _, _, line in current.co_lines() if line is not None)
+        stack.extend(const for const in current.co_consts if isinstance(const, types.CodeType))
+    return lines
+
+
+class _LineCoverage:
+    """Minimal line coverage over the generated modules only"""
+
+    def __init__(self, filenames):
+        self.filenames = filenames
+        self.executed = {name: set() for name in filenames}
+
+    def _trace(self, frame, event, arg):
+        executed = self.executed.get(frame.f_code.co_filename)
+        if executed is None:
+            return None
+        if event == "line":
+            executed.add(frame.f_lineno)
+        return self._trace
+
+    def __enter__(self):
+        sys.settrace(self._trace)
+        return self
+
+    def __exit__(self, *exc):
+        sys.settrace(None)
+
+
+def _takes_arguments(func):
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    return any(
+        p.default is p.empty and p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)
+        for p in parameters
+    )
+
+
+def _collect_tests(module):
+    """Runnable tests plus the names of pytest-style tests that need fixtures"""
+    tests, skipped = [], []
+    for name, obj in list(vars(module).items()):
+        if name.startswith("test") and inspect.isfunction(obj) and obj.__module__ == module.__name__:
+            # Fixtures such as tmp_path have no runner here to supply them
+            if _takes_arguments(obj):
+                skipped.append(f"{module.__name__}.{name}")
+            else:
+                tests.append((f"{module.__name__}.{name}", obj))
+        elif inspect.isclass(obj) and issubclass(obj, unittest.TestCase) and obj.__module__ == module.__name__:
+            for case in unittest.defaultTestLoader.loadTestsFromTestCase(obj):
+                tests.append((case.id(), case))
+    return tests, skipped
+
+
+def _run_test(test):
+    if isinstance(test, unittest.TestCase):
+        result = unittest.TestResult()
+        test.run(result)
+        problems = result.errors + result.failures
+        if problems:
+            return False, problems[0][1].strip().splitlines()[-1][:MAX_OUTPUT]
+        return True, None
+    outcome = test()
+    if inspect.isawaitable(outcome):
+        asyncio.run(outcome)
+    return True, None
+
+
+def run_job(job):
+    """Execute generated modules and their tests (runs inside the forked child)"""
+    modules = job["modules"]
+    filenames = {f"<generated:{m['name']}>": m for m in modules}
+    compiled = []
+    for filename, module in filenames.items():
+        compiled.append((module, filename, compile(module["source"], filename, "exec")))
+
+    coverage = _LineCoverage(list(filenames))
+    report = {"modules": [], "tests": [], "passed": 0, "failed": 0, "skipped": []}
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout), coverage:
+        loaded = []
+        for module, filename, code in compiled:
+            mod = types.ModuleType(module["name"])
+            mod.__file__ = filename
+            sys.modules[module["name"]] = mod
+            started = time.perf_counter()
+            try:
+                exec(code, mod.__dict__)
+                status, error = "loaded", None
+            except BaseException as e:
+                status, error = "error", _describe(e)
+            report["modules"].append({
+                "module": module["name"],
+                "status": status,
+                "error": error,
+                "import_time_ms": (time.perf_counter() - started) * 1000,
+            })
+            if status == "loaded":
+                loaded.append(mod)
+
+        for mod in loaded:
+            tests, skipped = _collect_tests(mod)
+            report["skipped"].extend(skipped)
+            for name, test in tests:
+                started = time.perf_counter()
+                try:
+                    ok, error = _run_test(test)
+                except BaseException as e:
+                    ok, error = False, _describe(e)
+                report["tests"].append({
+                    "test": name,
+                    "passed": ok,
+                    "error": error,
+                    "duration_ms": (time.perf_counter() - started) * 1000,
+                })
+                report["passed" if ok else "failed"] += 1
+
+    executable = set()
+    executed = 0
+    for (module, filename, code) in compiled:
+        lines = _executable_lines(code)
+        executable.update((filename, line) for line in lines)
+        executed += len(coverage.executed[filename] & lines)
+    report["coverage"] = (executed / len(executable) * 100) if executable else 0.0
+    report["output"] = stdout.getvalue()[:MAX_OUTPUT]
+    return report
+
+
+ENTRY_POINTS = ("main", "run")
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def _call_entry(entry):
+    outcome = entry()
+    if inspect.isawaitable(outcome):
+        asyncio.run(outcome)
+
+
+def run_benchmark(job):
+    """Measure import time, memory, entry-point timings and hotspots (runs inside the forked child)"""
+    options = job.get("benchmark", {})
+    budget = float(options.get("budget_seconds", 1.5))
+    warmup = int(options.get("warmup", 1))
+    repeats = int(options.get("repeats", 5))
+    deadline = time.perf_counter() + budget
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = {"imports": [], "entry_point": None, "runs": 0, "hotspots": []}
+    stdout = io.StringIO()
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+        entry = None
+        tracemalloc.start()
+        for module in job["modules"]:
+            code = compile(module["source"], f"<generated:{module['name']}>", "exec")
+            mod = types.ModuleType(module["name"])
+            sys.modules[module["name"]] = mod
+            started = time.perf_counter()
+            try:
+                exec(code, mod.__dict__)
+                error = None
+            except BaseException as e:
+                error = _describe(e)
+            report["imports"].append({
+                "module": module["name"],
+                "import_time_ms": (time.perf_counter() - started) * 1000,
+                "error": error,
+            })
+            if error is None and entry is None:
+                for name in ENTRY_POINTS:
+                    candidate = mod.__dict__.get(name)
+                    if inspect.isfunction(candidate) and not inspect.signature(candidate).parameters:
+                        entry, report["entry_point"] = candidate, f"{module['name']}.{name}"
+                        break
+        _, import_peak = tracemalloc.get_traced_memory()
+
+        if entry is not None and time.perf_counter() < deadline:
+            # One traced run for the allocation peak, kept out of the timings
+            tracemalloc.reset_peak()
+            try:
+                _call_entry(entry)
+            except BaseException as e:
+                report["entry_error"] = _describe(e)
+            _, run_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            wall, cpu = [], []
+            if "entry_error" not in report:
+                for i in range(warmup + repeats):
+                    if time.perf_counter() >= deadline:
+                        report["budget_exhausted"] = True
+                        break
+                    wall_start, cpu_start = time.perf_counter(), time.process_time()
+                    _call_entry(entry)
+                    if i >= warmup:
+                        wall.append((time.perf_counter() - wall_start) * 1000)
+                        cpu.append((time.process_time() - cpu_start) * 1000)
+
+                if time.perf_counter() < deadline:
+                    profiler = cProfile.Profile()
+                    profiler.runcall(_call_entry, entry)
+                    stats = pstats.Stats(profiler)
+                    hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+                    report["hotspots"] = [
+                        {
+                            "function": func,
+                            "location": f"{filename}:{line}",
+                            "calls": calls,
+                            "self_ms": tottime * 1000,
+                            "cumulative_ms": cumtime * 1000,
+                        }
+                        for (filename, line, func), (calls, _, tottime, cumtime, _) in hot[:5]
+                    ]
+
+            report["runs"] = len(wall)
+            if wall:
+                report["wall_ms"] = {"median": _percentile(wall, 0.5), "p95": _percentile(wall, 0.95)}
+                report["cpu_ms"] = {"median": _percentile(cpu, 0.5), "p95": _percentile(cpu, 0.95)}
+        else:
+            _, run_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    report["python_peak_kb"] = max(import_peak, run_peak) / 1024
+    report["rss_growth_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    return report
+
+
+def _run_forked(job):
+    """Fork a child for one job, enforce its wall-time limit and collect its report"""
+    limits = job.get("limits", {})
+    wall = float(limits.get("wall_seconds", 5))
+    workdir = tempfile.mkdtemp(prefix="jhadepilot-sandbox-")
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        # Keep the job away from the worker's protocol pipes
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            isolation = job.get("isolation", {})
+            try:
+                _isolate(isolation)
+                isolated = True
+            except IsolationError:
+                # Fail closed unless the operator accepted rlimits-only runs
+                if isolation.get("required", True):
+                    raise
+                os.chdir(workdir)
+                _block_network()
+                isolated = False
+            _apply_limits(limits)
+            runner = run_benchmark if job.get("kind") == "benchmark" else run_job
+            payload = {"status": "completed", "isolated": isolated, **runner(job)}
+        except IsolationError as e:
+            payload = {"status": "unavailable", "error": f"Sandbox isolation unavailable ({e})"}
+        except BaseException as e:
+            payload = {"status": "error", "error": _describe(e), "trace": traceback.format_exc()[-MAX_OUTPUT:]}
+        try:
+            data = json.dumps(payload, default=str).encode()
+        except BaseException:
+            data = json.dumps({"status": "error", "error": "Unserializable result"}).encode()
+        with os.fdopen(write_fd, "wb") as pipe:
+            pipe.write(data)
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    deadline = started + wall
+    timed_out = False
+    with os.fdopen(read_fd, "rb") as pipe:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([pipe], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(pipe.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    _, status, usage = os.wait4(pid, 0)
+    elapsed = time.perf_counter() - started
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if timed_out:
+        result = {"status": "timeout", "error": f"Wall time limit of {wall}s exceeded"}
+    elif os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        reason = "CPU time limit exceeded" if sig == signal.SIGXCPU else f"Killed by signal {sig}"
+        result = {"status": "killed", "error": reason}
+    else:
+        try:
+            result = json.loads(b"".join(chunks) or b"{}")
+        except ValueError:
+            result = {"status": "error", "error": "Malformed sandbox result"}
+        if not result:
+            result = {"status": "error", "error": "Sandbox exited without a result (memory limit?)"}
+
+    result["wall_time_ms"] = elapsed * 1000
+    result["cpu_time_ms"] = (usage.ru_utime + usage.ru_stime) * 1000
+    result["peak_rss_kb"] = usage.ru_maxrss
+    return result
+
+
+def _reply(result):
+    reply = json.dumps(result, default=str)
+    if len(reply) > MAX_REPLY:
+        reply = json.dumps({"status": "error", "error": f"Sandbox result exceeded {MAX_REPLY} bytes"})
+    sys.stdout.write(reply + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            # A batch holds several jobs; each gets its own child and its own reply line
+            jobs = job.get("jobs", []) if job.get("kind") == "batch" else [job]
+        except Exception as e:
+            _reply({"status": "error", "error": _describe(e)})
+            continue
+        for item in jobs:
+            try:
+                result = _run_forked(item)
+            except Exception as e:
+                result = {"status": "error", "error": _describe(e)}
+            _reply(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import ast
+import os
+import re
+import time
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional
+
+from build_analysis import BuildAnalysis
+
+# Per-request scan budget; remaining rules are skipped once it is spent
+SECURITY_SCAN_BUDGET_MS = float(os.getenv("SECURITY_SCAN_BUDGET_MS", "20"))
+
+# Secret patterns compiled once into a single alternation with named groups
+_SECRET_PATTERNS = {
+    "aws_access_key": r"\b(?:AKIA|ASIA)[0-9A-Z]{16}\b",
+    "groq_api_key": r"\bgsk_[A-Za-z0-9]{20,}\b",
+    "openai_api_key": r"\bsk-(?:proj-)?[A-Za-z0-9_-]{20,}\b",
+    "github_token": r"\bgh[pousr]_[A-Za-z0-9]{36,}\b",
+    "slack_token": r"\bxox[abprs]-[A-Za-z0-9-]{10,}\b",
+    "private_key": r"-----BEGIN (?:RSA |EC |DSA |OPENSSH )?PRIVATE KEY-----",
+    "hardcoded_password": r"(?i:\b(?:password|passwd|secret|api_key|apikey|token)\s*=\s*['\"](?P<assigned>[^'\"\s]{8,})['\"])",
+}
+SECRET_RE = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in _SECRET_PATTERNS.items()))
+# Literal anchors every secret pattern contains; only lines holding one get the full scan
+SECRET_ANCHORS_RE = re.compile(r"AKIA|ASIA|gsk_|sk-|gh[pousr]_|xox|-----BEGIN|(?i:pass|secret|api_?key|token)")
+# Assigned values that mark where a secret goes rather than holding one,
+# e.g. "your-api-key-here", "<token>", "${DB_PASSWORD}", "changeme", "xxxxxxxx"
+PLACEHOLDER_RE = re.compile(
+    r"(?i:your[-_ ]|example|placeholder|dummy|change[-_]?me|replace[-_]?(?:me|with)|<[^>]*>|\$\{|\{\{|x{6,}|\*{4,})|^(.)\1*$"
+)
+
+# Lines mentioning none of these cannot trigger an AST rule; the tree walk
+# only descends into statements spanning at least one matching line
+RISKY_TOKENS_RE = re.compile(
+    r"\b(?:import|eval|exec|execute|shell|system|popen|loads?|verify|"
+    r"md5|sha1|__import__|mktemp|assert|except)\b"
+)
+
+SEVERITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+# Call rules keyed by fully qualified name: (rule id, severity, message)
+DANGEROUS_CALLS = {
+    "eval": ("dangerous-eval", "high", "eval() executes arbitrary code"),
+    "exec": ("dangerous-exec", "high", "exec() executes arbitrary code"),
+    "__import__": ("dynamic-import", "medium", "__import__() with dynamic input can load arbitrary modules"),
+    "os.system": ("os-system", "high", "os.system() runs a shell command"),
+    "os.popen": ("os-popen", "high", "os.popen() runs a shell command"),
+    "pickle.loads": ("pickle-loads", "high", "pickle.loads() on untrusted data allows code execution"),
+    "pickle.load": ("pickle-loads", "high", "pickle.load() on untrusted data allows code execution"),
+    "cPickle.loads": ("pickle-loads", "high", "pickle.loads() on untrusted data allows code execution"),
+    "marshal.loads": ("marshal-loads", "high", "marshal.loads() on untrusted data is unsafe"),
+    "yaml.load": ("yaml-load", "medium", "yaml.load() without SafeLoader can construct arbitrary objects"),
+    "hashlib.md5": ("weak-hash", "low", "MD5 is not collision resistant"),
+    "hashlib.sha1": ("weak-hash", "low", "SHA-1 is not collision resistant"),
+    "tempfile.mktemp": ("insecure-tempfile", "medium", "tempfile.mktemp() is race-prone; use mkstemp()"),
+}
+SUBPROCESS_CALLS = {
+    "subprocess.run", "subprocess.call", "subprocess.check_call",
+    "subprocess.check_output", "subprocess.Popen", "subprocess.getoutput", "subprocess.getstatusoutput",
+}
+# Modules whose aliases can reach a call rule without naming a risky token
+WATCHED_MODULES = {name.split(".")[0] for name in (*DANGEROUS_CALLS, *SUBPROCESS_CALLS)} | {"requests", "httpx"}
+
+
+# Nodes visited between budget checks inside one tree walk
+BUDGET_CHECK_INTERVAL = 512
+
+
+class _SecurityVisitor:
+    """Every AST rule applied in a single walk of the shared tree
+
+    Dispatch is by node type, so each node costs one dict lookup no matter
+    how many rules exist.
+    """
+
+    def __init__(self, block_index: int, line_offset: int):
+        self.block_index = block_index
+        self.line_offset = line_offset
+        self.aliases: Dict[str, str] = {}
+        self.source = ""
+        self.risky_lines: List[int] = []
+        self.nodes_visited = 0
+        self.findings: List[Dict[str, Any]] = []
+        self._handlers = {
+            ast.Import: self._import,
+            ast.ImportFrom: self._import_from,
+            ast.Call: self._call,
+            ast.Assert: self._assert,
+            ast.ExceptHandler: self._except_handler,
+        }
+
+    def run(self, tree: ast.Module, source: str, risky_lines: List[int], deadline: float) -> bool:
+        """Walk the tree; returns False if the deadline hit before the end
+
+        ``risky_lines`` are sorted block-relative line numbers that matched
+        RISKY_TOKENS_RE; subtrees spanning none of them are skipped. Lines
+        using an alias of a watched module or call are added as imports bind
+        it, since ``L(x)`` after ``from pickle import loads as L`` names no
+        risky token.
+        """
+        handlers = self._handlers
+        self.source = source
+        self.risky_lines = risky_lines
+        # Module-level imports bind first, so functions defined above them are kept too
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                handlers[type(node)](node)
+        # Depth-first in source order so imports bind aliases before later calls
+        stack = list(reversed(tree.body))
+        count = 0
+        while stack:
+            node = stack.pop()
+            start = getattr(node, "lineno", None)
+            if start is not None:
+                risky_lines = self.risky_lines
+                i = bisect_left(risky_lines, start)
+                if i == len(risky_lines) or risky_lines[i] > (node.end_lineno or start):
+                    continue
+            handler = handlers.get(type(node))
+            if handler is not None:
+                handler(node)
+            stack.extend(reversed(list(ast.iter_child_nodes(node))))
+            count += 1
+            if count % BUDGET_CHECK_INTERVAL == 0 and time.perf_counter() > deadline:
+                self.nodes_visited = count
+                return False
+        self.nodes_visited = count
+        return True
+
+    def _add(self, node: ast.AST, rule: str, severity: str, message: str):
+        self.findings.append({
+            "rule": rule,
+            "severity": severity,
+            "message": message,
+            "block": self.block_index,
+            "line": getattr(node, "lineno", 1) + self.line_offset,
+        })
+
+    def _qualified_name(self, node: ast.AST) -> Optional[str]:
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+        parts.append(self.aliases.get(node.id, node.id))
+        return ".".join(reversed(parts))
+
+    def _bind(self, name: str, target: str):
+        if self.aliases.get(name) == target:
+            return
+        self.aliases[name] = target
+        if target.split(".")[0] in WATCHED_MODULES and not RISKY_TOKENS_RE.fullmatch(name):
+            lines, line, position = self.risky_lines, 1, 0
+            # Leading with the literal name lets the search skip ahead; the boundary comes after
+            escaped = re.escape(name)
+            for m in re.finditer(rf"{escaped}(?<!\w{escaped})(?!\w)", self.source):
+                line += self.source.count("\n", position, m.start())
+                position = m.start()
+                i = bisect_left(lines, line)
+                if i == len(lines) or lines[i] != line:
+                    insort(lines, line)
+
+    def _import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.asname:
+                self._bind(alias.asname, alias.name)
+
+    def _import_from(self, node: ast.ImportFrom):
+        if node.module:
+            for alias in node.names:
+                self._bind(alias.asname or alias.name, f"{node.module}.{alias.name}")
+
+    def _call(self, node: ast.Call):
+        name = self._qualified_name(node.func)
+        if name is None:
+            return
+
+        rule = DANGEROUS_CALLS.get(name)
+        if rule is not None and not (name == "yaml.load" and any(
+            kw.arg == "Loader" and "Safe" in (self._qualified_name(kw.value) or "")
+            for kw in node.keywords
+        )):
+            self._add(node, *rule)
+
+        if name in SUBPROCESS_CALLS:
+            for kw in node.keywords:
+                if kw.arg == "shell" and isinstance(kw.value, ast.Constant) and kw.value.value:
+                    self._add(node, "subprocess-shell", "high", f"{name}() with shell=True allows shell injection")
+
+        if name.startswith(("requests.", "httpx.")):
+            for kw in node.keywords:
+                if kw.arg == "verify" and isinstance(kw.value, ast.Constant) and kw.value.value is False:
+                    self._add(node, "tls-verify-disabled", "medium", f"{name}() disables TLS certificate verification")
+
+        if name.endswith(".execute") and node.args:
+            query = node.args[0]
+            if isinstance(query, ast.JoinedStr) or (
+                isinstance(query, ast.BinOp) and isinstance(query.op, (ast.Add, ast.Mod))
+            ):
+                self._add(node, "sql-injection", "high", "SQL built with string formatting; use query parameters")
+
+    def _assert(self, node: ast.Assert):
+        # Asserts vanish under python -O; flag only ones guarding auth-like checks
+        names = {n.id.lower() for n in ast.walk(node.test) if isinstance(n, ast.Name)}
+        names |= {n.attr.lower() for n in ast.walk(node.test) if isinstance(n, ast.Attribute)}
+        if any(word in name for name in names for word in ("auth", "permission", "admin")):
+            self._add(node, "assert-auth", "medium", "Authorization check via assert is removed under -O")
+
+    def _except_handler(self, node: ast.ExceptHandler):
+        if node.type is None and len(node.body) == 1 and isinstance(node.body[0], ast.Pass):
+            self._add(node, "bare-except-pass", "low", "Bare except: pass silently swallows errors")
+
+
+def scan_secrets(text: str) -> List[Dict[str, Any]]:
+    """Scan the raw output for credentials, line by line around anchor hits"""
+    findings = []
+    line, line_start, scanned_until = 1, 0, -1
+    for anchor in SECRET_ANCHORS_RE.finditer(text):
+        if anchor.start() < scanned_until:
+            continue
+        line += text.count("\n", line_start, anchor.start())
+        line_start = text.rfind("\n", 0, anchor.start()) + 1
+        line_end = text.find("\n", anchor.start())
+        scanned_until = line_end = len(text) if line_end == -1 else line_end
+        # pos/endpos keep the search on this line without slicing the text
+        for match in SECRET_RE.finditer(text, line_start, line_end):
+            if match.lastgroup == "hardcoded_password" and PLACEHOLDER_RE.search(match.group("assigned")):
+                continue
+            findings.append({
+                "rule": f"secret-{match.lastgroup}",
+                "severity": "critical" if match.lastgroup != "hardcoded_password" else "high",
+                "message": f"Possible {match.lastgroup.replace('_', ' ')} committed in code",
+                "line": line,
+            })
+    return findings
+
+
+def scan_code(text: str, analysis: BuildAnalysis, budget_ms: float = SECURITY_SCAN_BUDGET_MS) -> Dict[str, Any]:
+    """Secrets regex plus single-pass AST rules over the already parsed blocks
+
+    Stops early once ``budget_ms`` is spent and marks the report truncated.
+    """
+    started = time.perf_counter()
+    deadline = started + budget_ms / 1000
+    findings = scan_secrets(text)
+    scanned_blocks = 0
+    truncated = False
+
+    for parsed in analysis.blocks:
+        source = parsed.block.source
+        risky_lines = sorted({source.count("\n", 0, m.start()) + 1 for m in RISKY_TOKENS_RE.finditer(source)})
+        if parsed.tree is not None and risky_lines:
+            visitor = _SecurityVisitor(parsed.block.index, parsed.block.start_line - 1)
+            completed = visitor.run(parsed.tree, source, risky_lines, deadline)
+            findings.extend(visitor.findings)
+            if not completed:
+                truncated = True
+                break
+        scanned_blocks += 1
+
+    findings.sort(key=lambda f: (SEVERITY_ORDER[f["severity"]], f["line"]))
+    return {
+        "findings": findings,
+        "scanned_blocks": scanned_blocks,
+        "truncated": truncated,
+        "scan_time_ms": (time.perf_counter() - started) * 1000,
+    }
+
+
+def security_score(findings: List[Dict[str, Any]]) -> str:
+    """Letter grade from the worst finding severities"""
+    severities = {f["severity"] for f in findings}
+    if "critical" in severities:
+        return "F"
+    high = sum(1 for f in findings if f["severity"] == "high")
+    if high > 1:
+        return "D"
+    if high == 1:
+        return "C"
+    if "medium" in severities:
+        return "B"
+    if "low" in severities:
+        return "A"
+    return "A+"
@@ -0,0 +1,414 @@
+import fcntl
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+from response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate prompt lookup in front of the exact-match response cache (opt-in)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "100000"))
+# Directory for the memory-mapped index; empty keeps it in memory only
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache")
+SEMANTIC_CACHE_PROBES = int(os.getenv("SEMANTIC_CACHE_PROBES", "8"))
+SEMANTIC_CACHE_MAX_CANDIDATES = int(os.getenv("SEMANTIC_CACHE_MAX_CANDIDATES", "1024"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", os.getenv("RESPONSE_CACHE_TTL", "3600")))
+EMBEDDING_DIM = 256
+INDEX_LISTS = 1024
+# Centroids are sampled from the data once this many prompts are indexed
+TRAIN_AFTER = INDEX_LISTS * 4
+TRAIN_ITERATIONS = 3
+
+TOKEN_RE = re.compile(r"[a-z0-9#+]+")
+# Words that say how to ask rather than what to build; "or", "not", "without" and the
+# like change what is asked for, so they are not here
+STOP_WORDS = frozenset(
+    "a an the in of for to with and on using use that which me my i we please can you "
+    "build create make write generate implement develop code program simple basic".split()
+)
+# Negation and direction words stay attached to the word they modify, so
+# "celsius to fahrenheit" and "fahrenheit to celsius" keep different terms
+MODIFIERS = frozenset("not no non without except to from into than vs versus".split())
+# Common spellings folded together before hashing
+ALIASES = {
+    "application": "app", "apps": "app", "website": "site", "webpage": "page",
+    "db": "database", "js": "javascript", "ts": "typescript", "py": "python",
+    "func": "function", "fn": "function",
+}
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+
+class SimilarCode(str):
+    """Cached code served for a near-duplicate prompt rather than this one
+
+    It is never stored under the new prompt's exact cache key.
+    """
+
+    __slots__ = ()
+
+
+def _fold(word: str) -> str:
+    word = ALIASES.get(word, word)
+    # Crude suffix stripping: "sorts", "sorting", "sorted" -> "sort"
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def content_words(text: str) -> List[str]:
+    """The prompt's folded words that are not stop words, in order
+
+    A modifier is prefixed to the next content word ("without:auth").
+    """
+    words: List[str] = []
+    pending: List[str] = []
+    for word in TOKEN_RE.findall(normalize_prompt(text)):
+        if word in MODIFIERS:
+            pending.append(word)
+        elif word not in STOP_WORDS:
+            words.append(":".join(pending + [_fold(word)]))
+            pending = []
+    return words + pending
+
+
+def terms_signature(text: str) -> int:
+    """Hash of the content word multiset; word order outside a modifier does not matter"""
+    return zlib.crc32(" ".join(sorted(content_words(text))).encode())
+
+
+class HashedNgramEmbedder:
+    """Signed feature hashing of words and character trigrams, L2-normalized
+
+    Needs no model or vocabulary; shared trigrams keep inflections close
+    ("app" / "application").
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        import numpy as np
+
+        self.np = np
+        self.dim = dim
+
+    def embed(self, text: str):
+        np = self.np
+        hashes: List[int] = []
+        weights: List[float] = []
+        for word in content_words(text):
+            hashes.append(zlib.crc32(word.encode()))
+            weights.append(WORD_WEIGHT)
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                hashes.append(zlib.crc32(padded[i:i + 3].encode(), 0x9E3779B9))
+                weights.append(TRIGRAM_WEIGHT)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not hashes:
+            return vector
+        h = np.array(hashes, dtype=np.uint32)
+        signed = np.where(h & 0x80000000, -1.0, 1.0) * np.array(weights)
+        vector += np.bincount(h % self.dim, weights=signed, minlength=self.dim).astype(np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """IVF index from prompt embeddings to exact response cache keys
+
+    Vectors are int8 with a per-row scale in one structured NumPy array,
+    memory-mapped from ``SEMANTIC_CACHE_PATH`` so the index survives
+    restarts. Centroids trained once on the first prompts partition it
+    into ``INDEX_LISTS`` inverted lists, and a lookup scores at most
+    ``max_candidates`` entries from the ``probes`` nearest lists, which
+    keeps it well under a millisecond at 100k entries.
+    Capacity is fixed; when full, the least recently used entry is
+    replaced. Values are not stored here: a hit is an exact cache key,
+    so a response the response cache has evicted is a miss. Only one
+    worker owns the mapped file; the others load a private copy.
+
+    The embedding cannot tell antonyms apart ("ascending" / "descending"
+    score 0.87), so a hit also needs the same multiset of content words
+    (``terms_signature``), with negation and direction words bound to
+    the word they modify. A hit therefore absorbs rewording in stop
+    words, case, aliases, inflections and word order, and nothing more;
+    the threshold is a second check on top.
+    """
+
+    def __init__(
+        self,
+        path: str = SEMANTIC_CACHE_PATH,
+        capacity: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        probes: int = SEMANTIC_CACHE_PROBES,
+        max_candidates: int = SEMANTIC_CACHE_MAX_CANDIDATES,
+        ttl: float = SEMANTIC_CACHE_TTL,
+    ):
+        import numpy as np
+
+        self.np = np
+        self.threshold = threshold
+        self.probes = min(max(probes, 1), INDEX_LISTS)
+        self.max_candidates = max_candidates
+        self.ttl = ttl
+        self.capacity = max(capacity, 1)
+        self.embedder = HashedNgramEmbedder()
+        self.dtype = np.dtype([
+            ("vector", np.int8, (EMBEDDING_DIM,)),
+            ("scale", np.float32),
+            ("key", "S64"),
+            ("namespace", np.uint32),
+            ("terms", np.uint32),
+            ("list", np.int32),
+            ("expires_at", np.float64),
+            ("last_used", np.float64),
+        ])
+        self.owner = False
+        self._lock_fd: Optional[int] = None
+        self._centroids_file = os.path.join(path, "centroids.npy") if path else None
+        self.records = self._open(path)
+        self.centroids, self.trained = self._load_centroids()
+        self._vectors = self.records["vector"]
+        self._scales = self.records["scale"]
+        self._rebuild()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _open(self, path: str):
+        np = self.np
+        if not path:
+            return self._empty()
+        file = os.path.join(path, "index.npy")
+        try:
+            os.makedirs(path, exist_ok=True)
+            self._lock_fd = os.open(os.path.join(path, "index.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.owner = True
+        except BlockingIOError:
+            # Another worker owns the file: start from its last saved state
+            try:
+                return np.array(np.load(file, mmap_mode="r"))
+            except (OSError, ValueError):
+                return self._empty()
+        except OSError as e:
+            logger.warning(f"Semantic cache persistence unavailable ({e}), keeping it in memory")
+            return self._empty()
+        try:
+            records = np.lib.format.open_memmap(file, mode="r+")
+            if records.dtype == self.dtype and records.shape == (self.capacity,):
+                return records
+            logger.info("Semantic cache index layout changed, rebuilding")
+        except (OSError, ValueError):
+            pass
+        # Old centroids belong to the discarded index
+        try:
+            os.unlink(self._centroids_file)
+        except OSError:
+            pass
+        records = np.lib.format.open_memmap(file, mode="w+", dtype=self.dtype, shape=(self.capacity,))
+        records["list"] = -1
+        return records
+
+    def _load_centroids(self):
+        np = self.np
+        if self._centroids_file is not None:
+            try:
+                centroids = np.load(self._centroids_file)
+                if centroids.shape == (INDEX_LISTS, EMBEDDING_DIM):
+                    return centroids.astype(np.float32), True
+            except (OSError, ValueError):
+                pass
+        # Seeded random directions until there is data to sample from
+        centroids = np.random.default_rng(0).standard_normal((INDEX_LISTS, EMBEDDING_DIM)).astype(np.float32)
+        return centroids / np.linalg.norm(centroids, axis=1, keepdims=True), False
+
+    def _train(self):
+        """Spherical k-means seeded from stored vectors, then reassign every entry
+
+        Runs once, on the first ``TRAIN_AFTER`` entries; random centroids
+        leave most lists empty and a few huge, which defeats the probe.
+        """
+        np = self.np
+        used = np.flatnonzero(self.records["list"] >= 0)
+        vectors = self._vectors[used].astype(np.float32) * self._scales[used][:, None]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), INDEX_LISTS, replace=False)]
+        for _ in range(TRAIN_ITERATIONS):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Lists that attracted nothing keep their seed
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids.astype(np.float32)
+        self.trained = True
+        self.records["list"][used] = np.argmax(vectors @ self.centroids.T, axis=1)
+        if self.owner:
+            np.save(self._centroids_file, self.centroids)
+        self._rebuild()
+        logger.info(f"Semantic cache index trained on {len(used)} prompts")
+
+    def _empty(self):
+        records = self.np.zeros(self.capacity, dtype=self.dtype)
+        records["list"] = -1
+        return records
+
+    def _rebuild(self):
+        """Inverted lists, free slots and the key map from the stored records"""
+        np = self.np
+        lists = self.records["list"]
+        self._members = [np.empty(16, dtype=np.int32) for _ in range(INDEX_LISTS)]
+        self._sizes = np.zeros(INDEX_LISTS, dtype=np.int64)
+        self._position = np.zeros(self.capacity, dtype=np.int64)
+        used = np.flatnonzero(lists >= 0)
+        for slot in used:
+            self._append(int(lists[slot]), int(slot))
+        self._free = np.flatnonzero(lists < 0)[::-1].tolist()
+        keys = self.records["key"]
+        self._slots: Dict[bytes, int] = {bytes(keys[slot]): int(slot) for slot in used}
+
+    def _append(self, list_id: int, slot: int):
+        members = self._members[list_id]
+        size = self._sizes[list_id]
+        if size == len(members):
+            members = self._members[list_id] = self.np.concatenate([members, self.np.empty(len(members), dtype=self.np.int32)])
+        members[size] = slot
+        self._position[slot] = size
+        self._sizes[list_id] = size + 1
+
+    def _remove(self, slot: int):
+        record = self.records[slot]
+        list_id = int(record["list"])
+        if list_id < 0:
+            return
+        members = self._members[list_id]
+        last = self._sizes[list_id] - 1
+        position = self._position[slot]
+        moved = members[last]
+        members[position] = moved
+        self._position[moved] = position
+        self._sizes[list_id] = last
+        self._slots.pop(bytes(record["key"]), None)
+        record["list"] = -1
+        self._free.append(slot)
+
+    @staticmethod
+    def namespace(name: str) -> int:
+        """Entries only match within one model/parameter namespace"""
+        return zlib.crc32(name.encode())
+
+    def lookup(self, prompt: str, namespace: str, now: Optional[float] = None) -> Optional[str]:
+        """Cache key of the most similar stored prompt above the threshold"""
+        np = self.np
+        now = time.time() if now is None else now
+        query = self.embedder.embed(prompt)
+        nearest = self.centroids @ query
+        probes = np.argpartition(-nearest, self.probes - 1)[:self.probes]
+        # Nearest lists first, stopping at the candidate budget
+        members = []
+        budget = self.max_candidates
+        for p in probes[np.argsort(-nearest[probes])]:
+            size = int(self._sizes[p])
+            if size:
+                members.append(self._members[p][:min(size, budget)])
+                budget -= size
+                if budget <= 0:
+                    break
+        if not members:
+            self.misses += 1
+            return None
+        slots = np.concatenate(members)
+        scores = (self._vectors[slots].astype(np.float32) @ query) * self._scales[slots]
+        # Namespace and expiry only matter for the few candidates above the threshold
+        above = np.flatnonzero(scores >= self.threshold)
+        records = self.records
+        wanted = self.namespace(namespace)
+        terms = terms_signature(prompt)
+        for index in above[np.argsort(-scores[above])]:
+            slot = int(slots[index])
+            if (records["namespace"][slot] == wanted and records["terms"][slot] == terms
+                    and records["expires_at"][slot] > now):
+                records["last_used"][slot] = now
+                self.hits += 1
+                return records["key"][slot].decode()
+        self.misses += 1
+        return None
+
+    def add(self, prompt: str, namespace: str, key: str, now: Optional[float] = None):
+        """Index a prompt whose completion is stored under ``key``"""
+        np = self.np
+        now = time.time() if now is None else now
+        encoded = key.encode()
+        slot = self._slots.get(encoded)
+        if slot is not None:
+            self.records["expires_at"][slot] = now + self.ttl
+            self.records["last_used"][slot] = now
+            return
+        vector = self.embedder.embed(prompt)
+        peak = float(np.abs(vector).max())
+        if peak == 0.0:
+            return
+        if not self._free:
+            # Full: replace the least recently used entry
+            self._remove(int(np.argmin(self.records["last_used"])))
+            self.evictions += 1
+        slot = self._free.pop()
+        list_id = int(np.argmax(self.centroids @ vector))
+        record = self.records[slot]
+        record["vector"] = np.round(vector * (127.0 / peak)).astype(np.int8)
+        record["scale"] = peak / 127.0
+        record["key"] = encoded
+        record["namespace"] = self.namespace(namespace)
+        record["terms"] = terms_signature(prompt)
+        record["expires_at"] = now + self.ttl
+        record["last_used"] = now
+        record["list"] = list_id
+        self._append(list_id, slot)
+        self._slots[encoded] = slot
+        if not self.trained and len(self._slots) >= TRAIN_AFTER:
+            self._train()
+
+    def discard(self, key: str):
+        """Forget an entry whose response is gone from the response cache"""
+        slot = self._slots.get(key.encode())
+        if slot is not None:
+            self._remove(slot)
+
+    def close(self):
+        if self.owner:
+            self.records.flush()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._slots),
+            "capacity": self.capacity,
+            "trained": self.trained,
+            "persistent": self.owner,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+def build_semantic_cache(enabled: bool = SEMANTIC_CACHE) -> Optional[SemanticCache]:
+    """Semantic cache when switched on and NumPy is installed, else None"""
+    if not enabled:
+        return None
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        logger.warning("numpy not installed, semantic cache disabled")
+        return None
+    return SemanticCache()
@@ -0,0 +1,79 @@
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from starlette.responses import JSONResponse
+from typing_extensions import TypedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("orjson not installed, responses are serialized with the json module")
+
+
+# Response schemas: plain dicts typed for the checker, never validated or copied at runtime
+
+class AgentStatusPayload(TypedDict):
+    agent: str
+    status: str
+    message: Optional[str]
+
+
+class GenerateResult(TypedDict):
+    """Backend /generate body"""
+    code: str
+    statuses: List[AgentStatusPayload]
+    timestamp: str
+    tokens: Dict[str, Any]
+
+
+class AgentEvent(AgentStatusPayload):
+    result: Dict[str, Any]
+
+
+class OrchestrationResult(TypedDict):
+    """Agent service /generate body"""
+    code: str
+    agents: Dict[str, Dict[str, Any]]
+    telemetry: Dict[str, Any]
+    timestamp: str
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(value: Any) -> bytes:
+        """UTF-8 JSON; strings such as generated code are encoded straight into the output"""
+        return orjson.dumps(value, default=_default, option=_OPTIONS)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+    def dumps(value: Any) -> bytes:
+        """UTF-8 JSON; strings such as generated code are encoded straight into the output"""
+        return _encoder.encode(value).encode("utf-8")
+
+
+def dumps_str(value: Any) -> str:
+    """``dumps`` for text protocols (SSE frames, NDJSON lines)"""
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that encodes plain dicts directly, skipping jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,45 @@
+import json
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+
+from serialization import dumps_str
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Headers that stop proxies (nginx, ngrok) from buffering the event stream (SSE or NDJSON)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def iter_chat_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """Yield content deltas from an OpenAI-compatible streamed chat completion"""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if not data:
+            continue
+        chunk = json.loads(data)
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Format a single Server-Sent Event frame; ``event_id`` lets a client resume with Last-Event-ID"""
+    frame = f"event: {event}\ndata: {dumps_str(data)}\n\n"
+    return f"id: {event_id}\n{frame}" if event_id is not None else frame
+
+
+def ndjson_line(data: Any) -> str:
+    """Format one newline-delimited JSON record"""
+    return dumps_str(data) + "\n"
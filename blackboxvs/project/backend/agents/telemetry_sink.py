@@ -0,0 +1,268 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-request telemetry log; each worker appends to its own segment files
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "telemetry")
+TELEMETRY_FORMAT = os.getenv("TELEMETRY_FORMAT", "jsonl")  # jsonl, packed
+TELEMETRY_BUFFER_SIZE = int(os.getenv("TELEMETRY_BUFFER_SIZE", "4096"))
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "256"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "5.0"))
+TELEMETRY_SEGMENT_BYTES = int(os.getenv("TELEMETRY_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+TELEMETRY_COMPRESS = os.getenv("TELEMETRY_COMPRESS", "1").lower() not in ("0", "false", "no")
+
+# Columns of the packed format: dotted paths into the telemetry dict, one float64 each
+PACKED_FIELDS = (
+    "recorded_at",
+    "total_execution_time",
+    "avg_response_time",
+    "success_rate",
+    "total_requests",
+    "cache.hit_rate",
+    "inflight.coalesced",
+    "admission.queue_wait_ms",
+    "admission.limit",
+    "admission.queued",
+)
+PACKED_MAGIC = b"JPTM"
+_PACKED_HEADER = struct.Struct("<4sI")
+
+EXTENSIONS = {"jsonl": ".jsonl", "packed": ".bin"}
+
+
+def _lookup(record: Dict[str, Any], path: str) -> float:
+    value: Any = record
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return math.nan
+        value = value.get(part)
+    return float(value) if isinstance(value, (int, float)) else math.nan
+
+
+class _JsonlEncoder:
+    header = b""
+
+    @staticmethod
+    def encode(batch: List[Tuple[float, Dict[str, Any]]]) -> bytes:
+        return "".join(
+            json.dumps({**telemetry, "timestamp": datetime.fromtimestamp(recorded_at).isoformat()}, default=str) + "\n"
+            for recorded_at, telemetry in batch
+        ).encode()
+
+
+class _PackedEncoder:
+    """Fixed-width float64 rows after a header naming the columns"""
+
+    def __init__(self, fields: Tuple[str, ...] = PACKED_FIELDS):
+        self.fields = fields
+        self.row = struct.Struct("<" + "d" * len(fields))
+        names = json.dumps(list(fields)).encode()
+        self.header = _PACKED_HEADER.pack(PACKED_MAGIC, len(names)) + names
+
+    def encode(self, batch: List[Tuple[float, Dict[str, Any]]]) -> bytes:
+        buffer = bytearray(self.row.size * len(batch))
+        for index, (recorded_at, telemetry) in enumerate(batch):
+            values = [recorded_at] + [_lookup(telemetry, field) for field in self.fields[1:]]
+            self.row.pack_into(buffer, index * self.row.size, *values)
+        return bytes(buffer)
+
+
+class TelemetrySink:
+    """Buffered per-process writer for per-request telemetry
+
+    ``record`` only appends to a bounded in-memory ring buffer: when the
+    writer falls behind, the oldest samples are dropped and counted, and
+    requests never wait on disk. One background task drains the buffer
+    when a batch is full or the flush interval passes, and writes the
+    batch in a thread with a single append to the open segment. Full
+    segments are rotated and gzip-compressed.
+    """
+
+    def __init__(
+        self,
+        app_name: str,
+        directory: str = TELEMETRY_DIR,
+        output_format: str = TELEMETRY_FORMAT,
+        buffer_size: int = TELEMETRY_BUFFER_SIZE,
+        batch_size: int = TELEMETRY_BATCH_SIZE,
+        flush_interval: float = TELEMETRY_FLUSH_INTERVAL,
+        segment_bytes: int = TELEMETRY_SEGMENT_BYTES,
+        compress: bool = TELEMETRY_COMPRESS,
+    ):
+        if output_format not in EXTENSIONS:
+            raise ValueError(f"Unknown telemetry format {output_format!r}")
+        self.app_name = app_name
+        self.directory = directory
+        self.format = output_format
+        self.encoder = _PackedEncoder() if output_format == "packed" else _JsonlEncoder()
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self._buffer: Deque[Tuple[float, Dict[str, Any]]] = deque(maxlen=max(buffer_size, 1))
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._segment: Optional[str] = None
+        # A write cancelled at shutdown keeps running in its thread
+        self._io_lock = threading.Lock()
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    def record(self, telemetry: Dict[str, Any]):
+        """Queue one request's telemetry; never blocks"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((time.time(), telemetry))
+        self.recorded += 1
+        if self._wake is not None and len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            await asyncio.to_thread(self._compress_orphans)
+        except OSError as e:
+            logger.error(f"Telemetry directory unavailable: {str(e)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Everything still buffered, then the open segment
+        while self._buffer:
+            await asyncio.to_thread(self._write, self._drain())
+        await asyncio.to_thread(self._close_segment, False)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._buffer:
+                await asyncio.to_thread(self._write, self._drain())
+
+    def _drain(self) -> List[Tuple[float, Dict[str, Any]]]:
+        count = min(len(self._buffer), self.batch_size * 4)
+        return [self._buffer.popleft() for _ in range(count)]
+
+    def _write(self, batch: List[Tuple[float, Dict[str, Any]]]):
+        if not batch:
+            return
+        with self._io_lock:
+            self._write_locked(batch)
+
+    def _write_locked(self, batch: List[Tuple[float, Dict[str, Any]]]):
+        try:
+            data = self.encoder.encode(batch)
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            self.written += len(batch)
+            self.flushes += 1
+            if self._file.tell() >= self.segment_bytes:
+                self._close_segment_locked(True)
+        except (OSError, ValueError, TypeError) as e:
+            self.write_errors += 1
+            self.dropped += len(batch)
+            logger.error(f"Failed to write telemetry batch: {str(e)}")
+
+    def _open_segment(self):
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{self.app_name}-{os.getpid()}-{stamp}{EXTENSIONS[self.format]}"
+        self._segment = os.path.join(self.directory, name)
+        self._file = open(self._segment, "ab")
+        self._file.write(self.encoder.header)
+
+    def _close_segment(self, rotated: bool):
+        with self._io_lock:
+            self._close_segment_locked(rotated)
+
+    def _close_segment_locked(self, rotated: bool):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if rotated:
+            self.rotations += 1
+        if self.compress:
+            _compress(self._segment)
+
+    def _compress_orphans(self):
+        # Segments left open by workers that exited without closing them
+        for path in glob.glob(os.path.join(self.directory, f"{self.app_name}-*")):
+            if path.endswith(".gz") or not self.compress:
+                continue
+            try:
+                pid = int(os.path.basename(path).split("-")[-2])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                _compress(path)
+            except (ValueError, IndexError, OSError):
+                continue
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+        }
+
+
+def _compress(path: str):
+    try:
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.unlink(path)
+    except OSError as e:
+        logger.error(f"Failed to compress telemetry segment {path}: {str(e)}")
+
+
+def read_segment(path: str) -> Iterator[Dict[str, Any]]:
+    """Records of one segment in either format, compressed or not (offline analysis)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(PACKED_MAGIC):
+        for line in data.splitlines():
+            if line:
+                yield json.loads(line)
+        return
+    _, length = _PACKED_HEADER.unpack_from(data, 0)
+    start = _PACKED_HEADER.size + length
+    fields = json.loads(data[_PACKED_HEADER.size:start])
+    row = struct.Struct("<" + "d" * len(fields))
+    usable = start + (len(data) - start) // row.size * row.size
+    for values in row.iter_unpack(data[start:usable]):
+        yield dict(zip(fields, values))
@@ -0,0 +1,335 @@
+import base64
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from metrics import REQUEST_TOKENS, TOKEN_QUOTA_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Local BPE vocabulary in tiktoken format ("<base64 token> <rank>" per line);
+# without one, counts come from a calibrated per-piece approximation
+TOKENIZER_VOCAB = os.getenv("TOKENIZER_VOCAB", "")
+TOKENIZER_CACHE_SIZE = int(os.getenv("TOKENIZER_CACHE_SIZE", "65536"))
+
+# Completion budget: per prompt class, bounded by the model's context window
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "8192"))
+MIN_COMPLETION_TOKENS = int(os.getenv("MIN_COMPLETION_TOKENS", "256"))
+PROMPT_CLASS_TOKENS = {
+    "snippet": int(os.getenv("SNIPPET_MAX_TOKENS", "1024")),
+    "module": int(os.getenv("MODULE_MAX_TOKENS", "2048")),
+    "application": int(os.getenv("APPLICATION_MAX_TOKENS", "4000")),
+}
+
+# Per-client token bucket (per worker process); rate 0 turns quotas off
+TOKEN_QUOTA_PER_MINUTE = float(os.getenv("TOKEN_QUOTA_PER_MINUTE", "60000"))
+TOKEN_QUOTA_BURST = float(os.getenv("TOKEN_QUOTA_BURST", "120000"))
+TOKEN_QUOTA_CLIENTS = int(os.getenv("TOKEN_QUOTA_CLIENTS", "10000"))
+CLIENT_ID_HEADER = "x-client-id"
+# Peers (e.g. a reverse proxy) whose X-Client-ID header is honoured; everyone else is keyed by address
+TOKEN_QUOTA_TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.getenv("TOKEN_QUOTA_TRUSTED_PROXIES", "").split(",") if address.strip()
+)
+
+# cl100k-style pre-tokenization: contractions, words with one leading
+# non-letter, digit groups of up to three, punctuation runs, whitespace
+PRETOKENIZE_RE = re.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|(?:[^\r\n\w]|_)?[^\W\d_]+|\d{1,3}| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+# Tokens every chat message adds on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SNIPPET_RE = re.compile(r"\b(function|regex|snippet|one[- ]liner|helper|method|query|script|fix|convert)\b", re.I)
+APPLICATION_RE = re.compile(
+    r"\b(app|application|platform|system|service|api|backend|frontend|website|dashboard|bot|full[- ]stack|microservices?)\b",
+    re.I,
+)
+
+
+def _approximate_piece(piece: str) -> int:
+    if piece.isspace():
+        return 1
+    if not piece.isascii():
+        # Multi-byte scripts take roughly one token per character
+        return max(1, len(piece.encode("utf-8")) // 3)
+    word = piece.lstrip(" \t")
+    if word[:1].isalpha() or word[1:2].isalpha():
+        # Common words and identifiers are whole tokens up to about six letters
+        return max(1, math.ceil(len(word) / 6))
+    if word.isdigit():
+        return 1
+    return max(1, math.ceil(len(word) / 2))
+
+
+class Tokenizer:
+    """Counts tokens locally: byte-pair merges over a vocabulary, or an approximation
+
+    Pieces repeat heavily in code, so each piece's count is cached.
+    """
+
+    def __init__(self, vocab_path: str = TOKENIZER_VOCAB, cache_size: int = TOKENIZER_CACHE_SIZE):
+        self.ranks: Optional[Dict[bytes, int]] = None
+        if vocab_path:
+            try:
+                self.ranks = self._load(vocab_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Tokenizer vocabulary {vocab_path} unusable, approximating counts: {str(e)}")
+        self.mode = "bpe" if self.ranks else "approximate"
+        self._piece_tokens = lru_cache(maxsize=cache_size)(
+            self._bpe_piece if self.ranks else _approximate_piece
+        )
+
+    @staticmethod
+    def _load(path: str) -> Dict[bytes, int]:
+        ranks = {}
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    token, rank = line.split()
+                    ranks[base64.b64decode(token)] = int(rank)
+        if not ranks:
+            raise ValueError("empty vocabulary")
+        return ranks
+
+    def _bpe_piece(self, piece: str) -> int:
+        data = piece.encode("utf-8")
+        if data in self.ranks:
+            return 1
+        parts = [data[i:i + 1] for i in range(len(data))]
+        # Merge the lowest-ranked adjacent pair until no pair is in the vocabulary
+        while len(parts) > 1:
+            best, best_rank = -1, None
+            for i in range(len(parts) - 1):
+                rank = self.ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = i, rank
+            if best < 0:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        return len(parts)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        piece_tokens = self._piece_tokens
+        return sum(piece_tokens(piece) for piece in PRETOKENIZE_RE.findall(text))
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def stats(self) -> Dict[str, Any]:
+        info = self._piece_tokens.cache_info()
+        return {"mode": self.mode, "cached_pieces": info.currsize, "cache_hits": info.hits, "cache_misses": info.misses}
+
+
+tokenizer = Tokenizer()
+
+
+@lru_cache(maxsize=128)
+def count_tokens(text: str) -> int:
+    """Token count of a completion; the router and the app count the same text, so it is memoized"""
+    return tokenizer.count(text)
+
+
+@lru_cache(maxsize=1024)
+def classify_prompt(prompt: str) -> str:
+    """Prompt class deciding the completion budget: snippet, module or application"""
+    if APPLICATION_RE.search(prompt):
+        return "application"
+    if SNIPPET_RE.search(prompt) or len(prompt) < 40:
+        return "snippet"
+    return "module"
+
+
+class QuotaExceeded(Exception):
+    """The client has used up its token rate; retry once the bucket refills"""
+
+    status_code = 429
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class PromptTooLarge(Exception):
+    """The prompt plus the minimum completion exceeds the model context or a full bucket, so no wait helps"""
+
+    status_code = 413
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class TokenBuckets:
+    """Per-client token buckets refilled continuously at ``rate`` tokens per second"""
+
+    def __init__(
+        self,
+        per_minute: float = TOKEN_QUOTA_PER_MINUTE,
+        burst: float = TOKEN_QUOTA_BURST,
+        max_clients: int = TOKEN_QUOTA_CLIENTS,
+    ):
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _bucket(self, client: str) -> List[float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = [self.burst, now]
+            # Forgetting the least recently seen client hands it a full bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def reserve(self, client: str, wanted: int, minimum: int) -> int:
+        """Take up to ``wanted`` tokens, at least ``minimum``, or raise QuotaExceeded"""
+        bucket = self._bucket(client)
+        if bucket[0] < minimum:
+            self.rejected += 1
+            retry_after = max(1, math.ceil((minimum - bucket[0]) / self.rate))
+            raise QuotaExceeded(f"Token quota exceeded for client {client}", retry_after)
+        granted = int(min(wanted, bucket[0]))
+        bucket[0] -= granted
+        return granted
+
+    def refund(self, client: str, tokens: int):
+        """Return unused tokens; a negative refund charges a completion that overran"""
+        if tokens and client in self._buckets:
+            bucket = self._buckets[client]
+            bucket[0] = min(self.burst, bucket[0] + tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "per_minute": self.rate * 60,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+class TokenGrant:
+    """Tokens reserved for one request: the prompt plus its ``max_tokens`` completion budget"""
+
+    def __init__(self, accountant: "TokenAccountant", client: Optional[str], prompt_class: str, prompt_tokens: int, max_tokens: int, ceiling: int):
+        self.accountant = accountant
+        self.client = client
+        self.prompt_class = prompt_class
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        # The class budget before the quota trimmed it; cache keys use this
+        self.ceiling = ceiling
+        self.completion_tokens: Optional[int] = None
+
+    def settle(self, completion: str) -> Dict[str, Any]:
+        """Charge the completion actually returned and refund the rest of the budget"""
+        if self.completion_tokens is None:
+            self.completion_tokens = count_tokens(completion)
+            self.accountant._settle(self)
+        return self.usage()
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            "prompt_class": self.prompt_class,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "max_tokens": self.max_tokens,
+        }
+
+
+class TokenAccountant:
+    """Sizes each request's ``max_tokens`` and charges it against the client's quota"""
+
+    def __init__(
+        self,
+        default_max_tokens: int,
+        buckets: Optional[TokenBuckets] = None,
+        context_tokens: int = MODEL_CONTEXT_TOKENS,
+        min_completion: int = MIN_COMPLETION_TOKENS,
+        class_tokens: Optional[Dict[str, int]] = None,
+    ):
+        self.buckets = buckets if buckets is not None else TokenBuckets()
+        self.context_tokens = context_tokens
+        self.min_completion = min_completion
+        # An app's own default stays the ceiling for every class
+        self.class_tokens = {
+            name: min(tokens, default_max_tokens) for name, tokens in (class_tokens or PROMPT_CLASS_TOKENS).items()
+        }
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def reserve(self, client: Optional[str], prompt: str, messages: List[Dict[str, str]]) -> TokenGrant:
+        """Budget for the request that will send ``messages``
+
+        Raises QuotaExceeded if the client cannot afford the prompt plus the
+        minimum completion, and PromptTooLarge if it never could or the
+        model context cannot hold them; ``client`` None skips the quota.
+        """
+        prompt_class = classify_prompt(prompt)
+        prompt_tokens = tokenizer.count_messages(messages)
+        if prompt_tokens + self.min_completion > self.context_tokens:
+            raise PromptTooLarge(
+                f"Prompt of {prompt_tokens} tokens leaves no room for a completion in the {self.context_tokens}-token context"
+            )
+        room = self.context_tokens - prompt_tokens
+        max_tokens = ceiling = max(min(self.class_tokens[prompt_class], room), self.min_completion)
+        if client is not None and self.buckets.enabled:
+            if prompt_tokens + self.min_completion > self.buckets.burst:
+                raise PromptTooLarge(
+                    f"Prompt of {prompt_tokens} tokens does not fit the token quota of {int(self.buckets.burst)}"
+                )
+            try:
+                granted = self.buckets.reserve(client, prompt_tokens + max_tokens, prompt_tokens + self.min_completion)
+            except QuotaExceeded:
+                TOKEN_QUOTA_REJECTED.labels().inc()
+                raise
+            max_tokens = granted - prompt_tokens
+        return TokenGrant(self, client, prompt_class, prompt_tokens, max_tokens, ceiling)
+
+    def _settle(self, grant: TokenGrant):
+        self.prompt_tokens += grant.prompt_tokens
+        self.completion_tokens += grant.completion_tokens
+        REQUEST_TOKENS.labels("prompt").observe(grant.prompt_tokens)
+        REQUEST_TOKENS.labels("completion").observe(grant.completion_tokens)
+        if grant.client is not None and self.buckets.enabled:
+            self.buckets.refund(grant.client, grant.max_tokens - grant.completion_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokenizer": tokenizer.stats(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "quota": self.buckets.stats(),
+        }
+
+
+def client_id(headers: Any, host: Optional[str], trusted_proxies: frozenset = TOKEN_QUOTA_TRUSTED_PROXIES) -> str:
+    """Quota key: the client address, or the X-Client-ID header a trusted proxy set
+
+    The header is unauthenticated; honoured from anyone, a new value per
+    request would get a full bucket every time.
+    """
+    if host in trusted_proxies:
+        client = headers.get(CLIENT_ID_HEADER)
+        if client:
+            return client
+    return host or "anonymous"
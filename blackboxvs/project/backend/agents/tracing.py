@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from telemetry_sink import TelemetrySink
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests traced when the caller did not decide; a sampled
+# or unsampled incoming traceparent always wins
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.01"))
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")  # file, otlp, none
+TRACING_DIR = os.getenv("TRACING_DIR", "traces")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_BUFFER_SIZE = int(os.getenv("TRACING_BUFFER_SIZE", "8192"))
+TRACING_BATCH_SIZE = 512
+TRACING_FLUSH_INTERVAL = 5.0
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header"""
+    if not header:
+        return None
+    match = TRACEPARENT_RE.match(header.strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class _NoopSpan:
+    """Stands in for spans of unsampled traces; every call is a no-op"""
+
+    sampled = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes: Any):
+        pass
+
+    def set_error(self, error: BaseException):
+        pass
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = (
+        "tracer", "trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+        "start_ns", "end_ns", "attributes", "events", "error", "_token",
+    )
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        trace_id: str,
+        parent_id: Optional[str],
+        name: str,
+        kind: int = KIND_INTERNAL,
+        sampled: bool = True,
+        start_ns: Optional[int] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.events: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: Any):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            if self.sampled:
+                self.tracer._export(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, asyncio.CancelledError):
+            self.set_error(exc)
+        _current.reset(self._token)
+        self.end()
+        return False
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON span encoding"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [
+                {"timeUnixNano": str(at), "name": name, "attributes": _otlp_attributes(attributes)}
+                for at, name, attributes in self.events
+            ]
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def current_span():
+    """The active span, or the no-op span outside a sampled trace"""
+    return _current.get() or NOOP_SPAN
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent header to propagate to downstream calls, if inside a trace"""
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+def span(name: str, kind: int = KIND_INTERNAL, **attributes: Any):
+    """Child of the active span, used as a context manager; no-op when unsampled"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return NOOP_SPAN
+    return Span(parent.tracer, parent.trace_id, parent.span_id, name, kind, attributes=attributes)
+
+
+def start_span(name: str, start_ns: Optional[int] = None, kind: int = KIND_INTERNAL, **attributes: Any):
+    """Child of the active span that is not made active; call ``end()`` on it"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return NOOP_SPAN
+    return Span(parent.tracer, parent.trace_id, parent.span_id, name, kind, start_ns=start_ns, attributes=attributes)
+
+
+def record_since_trace_start(name: str):
+    """Span from the start of the current request until now (e.g. body parsing)"""
+    parent = _current.get()
+    if parent is not None and parent.sampled:
+        start_span(name, start_ns=parent.start_ns).end()
+
+
+class _OtlpExporter:
+    """Buffers spans and POSTs them in OTLP/HTTP JSON batches; drops on overflow"""
+
+    def __init__(self, service_name: str, endpoint: str, buffer_size: int):
+        self.service_name = service_name
+        self.endpoint = endpoint
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=max(buffer_size, 1))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.exported = 0
+        self.dropped = 0
+
+    def record(self, span: Dict[str, Any]):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(span)
+        if self._wake is not None and len(self._buffer) >= TRACING_BATCH_SIZE:
+            self._wake.set()
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=5.0)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._client is not None:
+            while self._buffer:
+                await self._flush()
+            await self._client.aclose()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=TRACING_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._buffer:
+                await self._flush()
+
+    async def _flush(self):
+        batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), TRACING_BATCH_SIZE))]
+        if not batch:
+            return
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "jhadepilot"}, "spans": batch}],
+            }]
+        }
+        try:
+            response = await self._client.post(self.endpoint, json=body)
+            response.raise_for_status()
+            self.exported += len(batch)
+        except httpx.HTTPError as e:
+            self.dropped += len(batch)
+            logger.warning(f"Span export failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"buffered": len(self._buffer), "exported": self.exported, "dropped": self.dropped}
+
+
+class Tracer:
+    """Starts one trace per request and exports finished sampled spans
+
+    Sampling is decided once per trace, at the root: an incoming
+    traceparent's sampled flag is honoured, otherwise ``sample_rate``
+    applies. Spans of unsampled traces are a shared no-op object, so
+    tracing costs one context variable lookup per instrumented stage.
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        sample_rate: float = TRACING_SAMPLE_RATE,
+        exporter: str = TRACING_EXPORTER,
+    ):
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.exporter_name = exporter
+        self._exporter: Any = None
+        if exporter == "file":
+            self._exporter = TelemetrySink(service_name, directory=TRACING_DIR, output_format="jsonl", buffer_size=TRACING_BUFFER_SIZE)
+        elif exporter == "otlp":
+            self._exporter = _OtlpExporter(service_name, TRACING_OTLP_ENDPOINT, TRACING_BUFFER_SIZE)
+        elif exporter != "none":
+            logger.warning(f"Unknown tracing exporter {exporter}, tracing disabled")
+        self.traces = 0
+        self.sampled = 0
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Span:
+        """Root server span for a request, continuing the caller's trace if given"""
+        self.traces += 1
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = _new_id(128), None
+            sampled = random.random() < self.sample_rate
+        sampled = sampled and self._exporter is not None
+        self.sampled += sampled
+        return Span(self, trace_id, parent_id, name, KIND_SERVER, sampled, attributes=attributes)
+
+    def _export(self, span: Span):
+        if self.exporter_name == "file":
+            self._exporter.record({"service": self.service_name, **span.to_otlp()})
+        else:
+            self._exporter.record(span.to_otlp())
+
+    async def start(self):
+        if self._exporter is not None:
+            await self._exporter.start()
+
+    async def close(self):
+        if self._exporter is not None:
+            await self._exporter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exporter": self.exporter_name if self._exporter is not None else "none",
+            "sample_rate": self.sample_rate,
+            "traces": self.traces,
+            "sampled": self.sampled,
+            "export": self._exporter.stats() if self._exporter is not None else None,
+        }
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the root span of every HTTP request
+
+    The span stays open until the last body chunk is sent, so streamed
+    responses are timed to the end. The response carries a
+    ``traceparent`` header for correlation.
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        root = self.tracer.start_trace(
+            f"{scope['method']} {scope['path']}", traceparent,
+            **{"http.method": scope["method"], "http.target": scope["path"]}
+        )
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", root.traceparent.encode("latin-1"))
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                root.end()
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, traced_send)
+        except Exception as e:
+            root.set_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            root.end()
@@ -0,0 +1,151 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Pool tuning, overridable per deployment
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5.0"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30.0"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5.0"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1").lower() not in ("0", "false", "no")
+
+# httpcore trace stages recorded as spans of a sampled request
+TRACED_STAGES = {
+    "connection.connect_tcp": "upstream.connect",
+    "connection.start_tls": "upstream.tls",
+    "http11.receive_response_headers": "upstream.ttfb",
+    "http2.receive_response_headers": "upstream.ttfb",
+}
+
+
+class UpstreamClientPool:
+    """Process-wide pooled HTTP/2 client for upstream LLM providers"""
+
+    def __init__(
+        self,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive: int = UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry: float = UPSTREAM_KEEPALIVE_EXPIRY,
+        connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout: float = UPSTREAM_READ_TIMEOUT,
+        pool_timeout: float = UPSTREAM_POOL_TIMEOUT,
+        http2: bool = UPSTREAM_HTTP2,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            read_timeout, connect=connect_timeout, pool=pool_timeout
+        )
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests_sent = 0
+        self.connections_opened = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared client, created on first use if the lifespan has not opened it"""
+        if self._client is None or self._client.is_closed:
+            self.open()
+        return self._client
+
+    def open(self):
+        """Create the underlying client (called from the app lifespan)"""
+        if self._client is not None and not self._client.is_closed:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 not installed, upstream pool falling back to HTTP/1.1")
+                http2 = False
+        self._client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=http2,
+        )
+        logger.info(
+            f"Upstream pool opened (http2={http2}, "
+            f"max_connections={self.limits.max_connections}, "
+            f"max_keepalive={self.limits.max_keepalive_connections})"
+        )
+
+    async def aclose(self):
+        """Close pooled connections on shutdown"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def _trace_callback(self):
+        """Connection trace hook; inside a sampled trace it also records stage spans"""
+        if not tracing.current_span().sampled:
+            return self._trace
+        spans = {}
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            await self._trace(event_name, info)
+            stage, _, phase = event_name.rpartition(".")
+            name = TRACED_STAGES.get(stage)
+            if name is None:
+                return
+            if phase == "started":
+                spans[name] = tracing.start_span(name)
+            elif name in spans:
+                span = spans.pop(name)
+                if phase == "failed":
+                    span.set_error(info.get("exception") or RuntimeError(event_name))
+                span.end()
+
+        return trace
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """POST through the shared pool, counting new vs reused connections"""
+        self.requests_sent += 1
+        extensions = kwargs.pop("extensions", None) or {}
+        extensions.setdefault("trace", self._trace_callback())
+        return await self.client.post(url, extensions=extensions, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Open a streamed request through the shared pool"""
+        self.requests_sent += 1
+        extensions = kwargs.pop("extensions", None) or {}
+        extensions.setdefault("trace", self._trace_callback())
+        async with self.client.stream(method, url, extensions=extensions, **kwargs) as response:
+            yield response
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and connection reuse counters"""
+        connections = []
+        if self._client is not None:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "open_connections": len(connections),
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "requests_sent": self.requests_sent,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests_sent - self.connections_opened, 0),
+        }
+
@@ -0,0 +1,63 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+AGENTS_DIR = BACKEND_DIR / "agents"
+RESULTS_DIR = BACKEND_DIR / "bench" / "results"
+
+
+def isolated_env(state_dir: str) -> Dict[str, str]:
+    """Environment that keeps an app's files, shared memory and quotas out of the way of a real deployment"""
+    return {
+        "JOBS_DB_PATH": os.path.join(state_dir, "jobs.sqlite3"),
+        "HISTORY_DB_PATH": os.path.join(state_dir, "history.sqlite3"),
+        "RESPONSE_CACHE_PATH": os.path.join(state_dir, "response_cache.sqlite3"),
+        "SEMANTIC_CACHE_PATH": os.path.join(state_dir, "semantic_cache"),
+        "TELEMETRY_DIR": os.path.join(state_dir, "telemetry"),
+        "TRACING_DIR": os.path.join(state_dir, "traces"),
+        "METRICS_DIR": os.path.join(state_dir, "metrics"),
+        "CIRCUIT_BREAKER_PATH": os.path.join(state_dir, "breakers"),
+        "TOKEN_QUOTA_PER_MINUTE": "0",
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def write_results(path: str, suite: str, settings: Dict[str, Any], results: List[Dict[str, Any]]):
+    """Write one run as JSON, tagged with the commit it measured so runs can be compared"""
+    document = {
+        "suite": suite,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "results": results,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
@@ -0,0 +1,68 @@
+"""Compare two benchmark result files and flag regressions
+
+Exits with status 1 when any metric got worse by more than --threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+# (metric, True when higher is better)
+LOAD_METRICS = [("throughput_rps", True), ("latency_ms.p50", False), ("latency_ms.p95", False), ("latency_ms.p99", False)]
+MICRO_METRICS = [("ns_per_op", False)]
+
+
+def _get(result: Dict[str, Any], path: str) -> Any:
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def _key(suite: str, result: Dict[str, Any]) -> str:
+    if suite == "load":
+        return f"{result['app']} c={result['concurrency']}{' stream' if result.get('stream') else ''}"
+    return result["name"]
+
+
+def rows(old: Dict[str, Any], new: Dict[str, Any]) -> Iterator[Tuple[str, str, float, float, float, bool]]:
+    """(benchmark, metric, old, new, relative change, worse) for results present in both runs"""
+    suite = new["suite"]
+    metrics = LOAD_METRICS if suite == "load" else MICRO_METRICS
+    baseline = {_key(suite, result): result for result in old["results"]}
+    for result in new["results"]:
+        previous = baseline.get(_key(suite, result))
+        if previous is None:
+            continue
+        for metric, higher_is_better in metrics:
+            before, after = _get(previous, metric), _get(result, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            yield _key(suite, result), metric, before, after, change, change < 0 if higher_is_better else change > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old", help="Baseline results JSON")
+    parser.add_argument("new", help="Candidate results JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old["suite"] != new["suite"]:
+        sys.exit(f"Cannot compare a {old['suite']} run with a {new['suite']} run")
+
+    print(f"{new['suite']}: {old['commit']} -> {new['commit']}")
+    regressions = 0
+    for name, metric, before, after, change, worse in rows(old, new):
+        regressed = worse and abs(change) > args.threshold
+        regressions += regressed
+        print(f"{name:32} {metric:16} {before:>12.2f} {after:>12.2f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Load driver: throughput and p50/p95/p99 latency of /generate on both apps
+
+By default it starts the mock LLM server and both apps on local ports, with
+the apps' provider URLs pointed at the mock, so only our own overhead and the
+mock's configured latency are measured. Pass --backend-url / --agent-url to
+drive servers that are already running instead.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from common import AGENTS_DIR, BACKEND_DIR, RESULTS_DIR, isolated_env, percentile, write_results
+
+APPS = {
+    "backend": (BACKEND_DIR, "main:app"),
+    "agent": (AGENTS_DIR, "main_agent:app"),
+}
+
+
+def spawn(args: List[str], cwd, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    # Logs go to a file: an unread pipe would fill up and stall the server
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen([sys.executable, *args], cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log_path = log_path
+    return process
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            with open(process.log_path, errors="replace") as log:
+                raise RuntimeError(f"{url} exited during startup:\n{log.read()[-4000:]}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def prompt_for(i: int, repeat: bool) -> str:
+    # Distinct prompts keep the response cache and request coalescing out of the measurement
+    n = 0 if repeat else i
+    return f"Write a Python function that parses CSV rows and validates field {n}"
+
+
+async def one_request(client: httpx.AsyncClient, url: str, i: int, stream: bool, repeat: bool) -> Dict[str, Any]:
+    body = {"prompt": prompt_for(i, repeat), "stream": stream}
+    started = time.perf_counter()
+    ttfb = None
+    tail = b""
+    try:
+        async with client.stream("POST", url, json=body) as response:
+            async for chunk in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                tail = (tail + chunk)[-512:]
+            status = response.status_code
+            # A stream reports failures in-band after its 200
+            if stream and status == 200 and b"event: error" in tail:
+                status = "stream_error"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "latency": time.perf_counter() - started, "ttfb": ttfb}
+
+
+async def run_level(url: str, concurrency: int, requests: int, stream: bool, repeat: bool, offset: int) -> Dict[str, Any]:
+    """``requests`` requests from ``concurrency`` closed-loop clients"""
+    samples: List[Dict[str, Any]] = []
+    counter = iter(range(offset, offset + requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0), limits=limits) as client:
+        async def worker():
+            for i in counter:
+                samples.append(await one_request(client, url, i, stream, repeat))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ok = sorted(s["latency"] * 1000 for s in samples if s["status"] == 200)
+    ttfb = sorted(s["ttfb"] * 1000 for s in samples if s["status"] == 200 and s["ttfb"] is not None)
+    statuses = Counter(str(s["status"]) for s in samples)
+    result = {
+        "concurrency": concurrency,
+        "stream": stream,
+        "requests": len(samples),
+        "ok": len(ok),
+        "statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ok, 50), 2),
+            "p95": round(percentile(ok, 95), 2),
+            "p99": round(percentile(ok, 99), 2),
+            "mean": round(sum(ok) / len(ok), 2) if ok else 0.0,
+            "max": round(ok[-1], 2) if ok else 0.0,
+        },
+    }
+    if stream:
+        result["ttfb_ms"] = {q: round(percentile(ttfb, v), 2) for q, v in (("p50", 50), ("p95", 95), ("p99", 99))}
+    return result
+
+
+def upstream_requests(mock_url: Optional[str]) -> Optional[int]:
+    if mock_url is None:
+        return None
+    return httpx.get(f"{mock_url}/stats").json()["requests"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", default="backend,agent", help="Comma-separated: backend, agent")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each app's first level")
+    parser.add_argument("--stream", action="store_true", help="Request Server-Sent Events and also report time to first byte")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Send one prompt throughout to measure the cached path")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per app")
+    parser.add_argument("--backend-url", help="Drive an already running backend instead of starting one")
+    parser.add_argument("--agent-url", help="Drive an already running agent service instead of starting one")
+    parser.add_argument("--base-port", type=int, default=9100)
+    parser.add_argument("--mock-latency", type=float, default=0.2)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=500)
+    parser.add_argument("--mock-completion-tokens", type=int, default=300)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-error-status", type=int, default=500)
+    parser.add_argument("--mock-drop-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=str(RESULTS_DIR / f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    apps = [app.strip() for app in args.apps.split(",") if app.strip()]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    external = {"backend": args.backend_url, "agent": args.agent_url}
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="jhadepilot-bench-") as state_dir, ExitStack() as stack:
+        mock_url = None
+        if not all(external[app] for app in apps):
+            mock_url = f"http://127.0.0.1:{args.base_port}"
+            mock = spawn([
+                "mock_llm.py", "--port", str(args.base_port),
+                "--latency", str(args.mock_latency),
+                "--tokens-per-second", str(args.mock_tokens_per_second),
+                "--completion-tokens", str(args.mock_completion_tokens),
+                "--error-rate", str(args.mock_error_rate),
+                "--error-status", str(args.mock_error_status),
+                "--drop-rate", str(args.mock_drop_rate),
+            ], BACKEND_DIR / "bench", dict(os.environ), os.path.join(state_dir, "mock_llm.log"))
+            stack.callback(stop, mock)
+            wait_ready(f"{mock_url}/stats", mock)
+
+        for offset, app in enumerate(apps, start=1):
+            base_url = external[app]
+            if base_url is None:
+                cwd, target = APPS[app]
+                port = args.base_port + offset
+                base_url = f"http://127.0.0.1:{port}"
+                # Isolation wins over the caller's environment, which may be a real deployment's
+                env = {
+                    **os.environ,
+                    **isolated_env(os.path.join(state_dir, app)),
+                    "GROQ_API_URL": f"{mock_url}/v1/chat/completions",
+                    "BLACKBOX_API_URL": f"{mock_url}/v1/chat/completions",
+                    "GROQ_API_KEY": "bench",
+                    "BLACKBOX_API_KEY": "bench",
+                    "LLM_PROVIDERS": "groq,blackbox",
+                }
+                process = spawn([
+                    "-m", "uvicorn", target, "--port", str(port), "--workers", str(args.workers),
+                    "--log-level", "warning", "--no-access-log",
+                ], cwd, env, os.path.join(state_dir, f"{app}.log"))
+                stack.callback(stop, process)
+                wait_ready(f"{base_url}/health", process)
+
+            url = f"{base_url}/generate"
+            if args.warmup:
+                asyncio.run(run_level(url, min(args.warmup, max(levels)), args.warmup, args.stream, args.repeat_prompts, 10**8))
+            for concurrency in levels:
+                before = upstream_requests(mock_url)
+                # Each level gets fresh prompts so it never reads what an earlier level cached
+                result = asyncio.run(run_level(
+                    url, concurrency, args.requests, args.stream, args.repeat_prompts, offset * 10**7 + concurrency * 10**5
+                ))
+                result["app"] = app
+                if before is not None:
+                    result["upstream_requests"] = upstream_requests(mock_url) - before
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{app:8} c={concurrency:<4} {result['throughput_rps']:>9.1f} req/s  "
+                    f"p50 {latency['p50']:>8.1f} ms  p95 {latency['p95']:>8.1f} ms  p99 {latency['p99']:>8.1f} ms  "
+                    f"ok {result['ok']}/{result['requests']}"
+                )
+
+    settings = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results(args.output, "load", settings, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Microbenchmarks for per-request hot paths of both apps
+
+Each benchmark is timed in batches sized to run for at least 0.2 s and the
+fastest of --repeat batches is reported, as with ``python -m timeit``.
+With --baseline, the serialize.response.* cases encode through the old
+path (jsonable_encoder into JSONResponse, re-validating the backend body
+as GenerateResponse) under the same names, so bench/compare.py shows the
+before and after of two runs.
+"""
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any, Callable, Dict, List
+
+from common import AGENTS_DIR, BACKEND_DIR, RESULTS_DIR, isolated_env
+
+# Importing the apps opens their job store, caches and metric files
+STATE_DIR = tempfile.mkdtemp(prefix="jhadepilot-micro-")
+atexit.register(shutil.rmtree, STATE_DIR, ignore_errors=True)
+os.environ.update(isolated_env(STATE_DIR))
+os.environ.setdefault("LLM_PROVIDERS", "mock")
+sys.path.insert(0, str(AGENTS_DIR))
+sys.path.insert(0, str(BACKEND_DIR))
+
+import main  # noqa: E402
+import main_agent  # noqa: E402
+from build_analysis import CodeBuffer, extract_code_blocks  # noqa: E402
+from common import write_results  # noqa: E402
+from fallback import fallback_templates  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from serialization import FastJSONResponse, dumps  # noqa: E402
+
+PROMPT = "Build a REST API for a todo app with FastAPI and SQLAlchemy"
+SAMPLE_CODE = '''import asyncio
+import json
+import os
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+
+app = FastAPI()
+engine = create_engine(os.getenv("DATABASE_URL", "sqlite://"))
+
+
+@app.get("/items")
+async def items() -> List[Dict[str, Any]]:
+    async with httpx.AsyncClient() as client:
+        response = await client.get("https://example.com/items")
+    frame = pd.DataFrame(response.json())
+    return json.loads(frame.assign(score=np.log1p(frame["value"])).to_json(orient="records"))
+'''
+
+
+def orchestration_result(code_bytes: int) -> Dict[str, Any]:
+    """A /generate body from the agent service with roughly ``code_bytes`` of code"""
+    code = (SAMPLE_CODE * (code_bytes // len(SAMPLE_CODE) + 1))[:code_bytes]
+    timestamp = "2025-01-04T10:30:00"
+    agent = {"status": "success", "message": "Completed successfully", "timestamp": timestamp, "execution_time": 0.0123}
+    return {
+        "code": code,
+        "agents": {name: dict(agent) for name in ("BuildAgent", "SecurityAgent", "TestAgent", "PerformanceAgent", "DeployAgent")},
+        "telemetry": {
+            "total_execution_time": 0.5,
+            "agents_executed": 5,
+            "tokens": {"prompt_class": "application", "prompt_tokens": 52, "completion_tokens": code_bytes // 4, "max_tokens": 2000},
+        },
+        "timestamp": timestamp,
+    }
+
+
+def generate_response(code_bytes: int) -> Dict[str, Any]:
+    """A /generate body from the backend with roughly ``code_bytes`` of code"""
+    code = (SAMPLE_CODE * (code_bytes // len(SAMPLE_CODE) + 1))[:code_bytes]
+    return {
+        "code": code,
+        "statuses": [
+            {"agent": name, "status": "success", "message": "Completed successfully"}
+            for name in ("BuildAgent", "TestAgent", "DeployAgent")
+        ],
+        "timestamp": "2025-01-04T10:30:00",
+        "tokens": {"prompt_class": "application", "prompt_tokens": 52, "completion_tokens": code_bytes // 4, "max_tokens": 2000},
+    }
+
+
+def baseline_agent_response(body: Dict[str, Any]) -> JSONResponse:
+    """How the agent service encoded /generate before FastJSONResponse"""
+    return JSONResponse(jsonable_encoder(body))
+
+
+def baseline_backend_response(body: Dict[str, Any]) -> JSONResponse:
+    """How the backend encoded /generate before: a validated GenerateResponse through jsonable_encoder"""
+    return JSONResponse(jsonable_encoder(main.GenerateResponse(**body)))
+
+
+def markdown_output(blocks: int) -> str:
+    """LLM-style output: ``blocks`` fenced Python blocks separated by prose"""
+    return "".join(f"Part {i}:\n\n```python\n# app/part_{i}.py\n{SAMPLE_CODE}```\n\n" for i in range(blocks))
+
+
+def stream_into_buffer(deltas: List[str]) -> CodeBuffer:
+    buffer = CodeBuffer()
+    for delta in deltas:
+        buffer.append(delta)
+    buffer.finish()
+    return buffer
+
+
+def benchmarks(baseline: bool = False) -> Dict[str, Callable[[], Any]]:
+    orchestrator = main_agent.orchestrator
+    generator = orchestrator.code_generator
+    generated_at = time.strftime("%Y-%m-%d %H:%M:%S IST")
+    small, large = orchestration_result(4096), orchestration_result(65536)
+    backend_small, backend_large = generate_response(4096), generate_response(65536)
+    agent_response = baseline_agent_response if baseline else FastJSONResponse
+    backend_response = baseline_backend_response if baseline else FastJSONResponse
+    output = markdown_output(32)
+    # Roughly one token per delta
+    deltas = [output[i:i + 4] for i in range(0, len(output), 4)]
+    return {
+        "extract_dependencies": lambda: orchestrator._extract_dependencies(SAMPLE_CODE),
+        "extract_code_blocks.32": lambda: extract_code_blocks(output),
+        "code_buffer.stream.32": lambda: stream_into_buffer(deltas),
+        "update_telemetry": lambda: generator._update_telemetry(0.25, success=True),
+        "fallback_render.agent": lambda: fallback_templates.render("agent", PROMPT, generated_at=generated_at),
+        "fallback_render.backend": lambda: main.build_fallback_code(PROMPT),
+        "serialize.dumps.4k": lambda: dumps(small),
+        "serialize.dumps.64k": lambda: dumps(large),
+        "serialize.response.4k": lambda: agent_response(small),
+        "serialize.response.64k": lambda: agent_response(large),
+        "serialize.response.backend.4k": lambda: backend_response(backend_small),
+        "serialize.response.backend.64k": lambda: backend_response(backend_large),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    best = min(runs)
+    runs.sort()
+    return {
+        "ns_per_op": round(best * 1e9, 1),
+        "median_ns_per_op": round(runs[len(runs) // 2] * 1e9, 1),
+        "ops_per_second": round(1 / best) if best else None,
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed batches per benchmark")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", action="store_true", help="Encode serialize.response.* through the pre-orjson path")
+    parser.add_argument("--output", default=str(RESULTS_DIR / f"micro-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for name, func in benchmarks(args.baseline).items():
+        if args.filter not in name:
+            continue
+        result = {"name": name, **measure(func, args.repeat)}
+        results.append(result)
+        print(f"{name:32} {result['ns_per_op'] / 1000:>10.2f} us/op  {result['ops_per_second']:>10} ops/s")
+
+    write_results(args.output, "micro", {"repeat": args.repeat, "filter": args.filter, "baseline": args.baseline}, results)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,139 @@
+"""Local OpenAI-compatible chat completion server for offline load tests
+
+Point the apps at it with GROQ_API_URL / BLACKBOX_API_URL set to
+http://127.0.0.1:<port>/v1/chat/completions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Time to the first token, then tokens at a fixed rate (0 sends them all at once)
+MOCK_LLM_LATENCY = float(os.getenv("MOCK_LLM_LATENCY", "0.2"))
+MOCK_LLM_TOKENS_PER_SECOND = float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "500"))
+MOCK_LLM_COMPLETION_TOKENS = int(os.getenv("MOCK_LLM_COMPLETION_TOKENS", "300"))
+# Fraction of requests answered with MOCK_LLM_ERROR_STATUS, and of streams cut off halfway
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+MOCK_LLM_ERROR_STATUS = int(os.getenv("MOCK_LLM_ERROR_STATUS", "500"))
+MOCK_LLM_DROP_RATE = float(os.getenv("MOCK_LLM_DROP_RATE", "0"))
+
+# Code-shaped pieces of roughly one token each
+TOKEN_PIECES = ["def", " handler", "(", "request", ")", ":", "\n", "    ", "return", " value", " +", " 1", "\n"]
+
+settings = {
+    "latency": MOCK_LLM_LATENCY,
+    "tokens_per_second": MOCK_LLM_TOKENS_PER_SECOND,
+    "completion_tokens": MOCK_LLM_COMPLETION_TOKENS,
+    "error_rate": MOCK_LLM_ERROR_RATE,
+    "error_status": MOCK_LLM_ERROR_STATUS,
+    "drop_rate": MOCK_LLM_DROP_RATE,
+}
+stats = {"requests": 0, "streams": 0, "errors": 0, "dropped": 0, "completion_tokens": 0}
+
+app = FastAPI(title="Mock LLM")
+
+
+def _tokens(payload: Dict[str, Any]):
+    count = min(settings["completion_tokens"], payload.get("max_tokens") or settings["completion_tokens"])
+    return [TOKEN_PIECES[i % len(TOKEN_PIECES)] for i in range(count)]
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, str], finish_reason=None) -> str:
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+
+async def _paced(tokens) -> AsyncIterator[str]:
+    """Yield tokens at the configured rate, sleeping at most every 10 ms"""
+    rate = settings["tokens_per_second"]
+    started = time.perf_counter()
+    for i, token in enumerate(tokens):
+        if rate > 0:
+            due = started + i / rate
+            if due - time.perf_counter() > 0.01:
+                await asyncio.sleep(due - time.perf_counter())
+        yield token
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    stats["requests"] += 1
+    model = payload.get("model", "mock")
+    await asyncio.sleep(settings["latency"])
+
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        status = settings["error_status"]
+        headers = {"Retry-After": "1"} if status in (429, 503) else None
+        return JSONResponse({"error": {"message": "injected failure", "type": "mock"}}, status_code=status, headers=headers)
+
+    tokens = _tokens(payload)
+    stats["completion_tokens"] += len(tokens)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if payload.get("stream"):
+        stats["streams"] += 1
+        drop_at = len(tokens) // 2 if random.random() < settings["drop_rate"] else None
+
+        async def stream() -> AsyncIterator[str]:
+            yield _chunk(completion_id, model, {"role": "assistant"})
+            sent = 0
+            async for token in _paced(tokens):
+                if sent == drop_at:
+                    stats["dropped"] += 1
+                    raise ConnectionResetError("injected stream drop")
+                yield _chunk(completion_id, model, {"content": token})
+                sent += 1
+            yield _chunk(completion_id, model, {}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async for _ in _paced(tokens):
+        pass
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+        "usage": {"completion_tokens": len(tokens)},
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return {"settings": settings, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=settings["tokens_per_second"])
+    parser.add_argument("--completion-tokens", type=int, default=settings["completion_tokens"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    parser.add_argument("--error-status", type=int, default=settings["error_status"])
+    parser.add_argument("--drop-rate", type=float, default=settings["drop_rate"], help="Fraction of streams cut off halfway")
+    args = parser.parse_args()
+    settings.update({key: getattr(args, key) for key in settings})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
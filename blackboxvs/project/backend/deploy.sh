@@ -58,12 +58,17 @@ print_status "Building Docker image..."
 cd agents
 docker build -t $DOCKER_IMAGE . --no-cache
 
-# Run the container with India-optimized settings
+# Run the container with India-optimized settings. The test sandbox needs
+# unshare and mount, which Docker's default seccomp and AppArmor profiles
+# block: sandbox-seccomp.json is the default profile plus those calls, and
+# docker-default AppArmor denies mount outright
 print_status "Starting JHADEPILOT Advanced Agent..."
 docker run -d \
     --name $CONTAINER_NAME \
     --restart unless-stopped \
     -p $PORT:$PORT \
+    --security-opt seccomp="$(pwd)/sandbox-seccomp.json" \
+    --security-opt apparmor=unconfined \
     -e GROQ_API_KEY="$GROQ_API_KEY" \
     -e TZ="Asia/Kolkata" \
     -e PYTHONUNBUFFERED=1 \
@@ -86,6 +91,23 @@ if docker ps | grep -q $CONTAINER_NAME; then
     # Test the health endpoint
     if curl -f http://localhost:$PORT/health &>/dev/null; then
         print_success "Health check passed!"
+        
+        # Without isolation, TestAgent and PerformanceAgent report "skipped"
+        SANDBOX_PROBE='import asyncio
+from sandbox import SandboxPool
+async def probe():
+    pool = SandboxPool(size=1)
+    result = await pool.run([])
+    await pool.close()
+    print(result.get("status"), result.get("error", ""))
+asyncio.run(probe())'
+        SANDBOX_STATUS=$(docker exec $CONTAINER_NAME python -c "$SANDBOX_PROBE" 2>/dev/null | tail -n 1)
+        if [ "${SANDBOX_STATUS%% *}" = "completed" ]; then
+            print_success "Test sandbox isolation works"
+        else
+            print_warning "Test sandbox unavailable: ${SANDBOX_STATUS:-probe failed}"
+            print_warning "TestAgent and PerformanceAgent will report skipped (see README, Test Sandbox)"
+        fi
         print_success "JHADEPILOT Advanced Agent is ready!"
         echo ""
         echo "🌟 Deployment Summary:"
@@ -1,24 +1,73 @@
-import asyncio
 import logging
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, status
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 import httpx
 import os
 from datetime import datetime
 
+# Runtime modules shared with the agent service live in agents/
+sys.path.insert(0, str(Path(__file__).resolve().parent / "agents"))
+
+from admission import AdaptiveLimiter, AdmissionRejected, Permit, observe_upstream
+from agent_engine import AgentContext, AgentEngine, AgentSpec, simulated_delay
+from fallback import fallback_templates
+from history import HISTORY_PAGE_SIZE, HistoryStore, HistoryUnavailable, history_caller
+import metrics
+from metrics import GENERATION_DURATION
+from providers import NoProviderAvailable, ProviderRouter, build_router
+from resilience import DeadlineExceeded, DeadlineMiddleware, limit_deadline, remaining, retry_after
+from response_cache import ResponseCache, make_cache_key
+from serialization import AgentStatusPayload, FastJSONResponse, GenerateResult
+from singleflight import SingleFlight
+import tracing
+from tracing import Tracer, TracingMiddleware
+from streaming import SSE_HEADERS, SSE_MEDIA_TYPE, sse_event
+from tokens import PromptTooLarge, QuotaExceeded, TokenAccountant, TokenGrant, client_id
+from upstream import UpstreamClientPool
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Before any metric is written, so this app's workers share one metrics directory
+metrics.configure("backend")
+
+# Shared upstream connection pool and response cache, opened and closed with the app
+upstream = UpstreamClientPool()
+response_cache = ResponseCache()
+history = HistoryStore()
+tracer = Tracer("backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the upstream pool on startup and drain it on shutdown"""
+    upstream.open()
+    await tracer.start()
+    await history.start()
+    await history.warm(response_cache)
+    yield
+    await history.close()
+    await tracer.close()
+    await upstream.aclose()
+    response_cache.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="JHADEPILOT Backend API",
     description="AI-powered code generation platform backend",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -29,118 +78,207 @@ app.add_middleware(
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware, tracer=tracer)
+app.add_middleware(DeadlineMiddleware)
 
-# Pydantic models
+# Pydantic models (responses only document the schema: handlers return GenerateResult dicts unvalidated)
 class PromptRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=1000, description="The code generation prompt")
+    stream: bool = Field(False, description="Stream tokens and agent statuses as Server-Sent Events")
+    priority: str = Field("default", description="Admission priority class (interactive, default, batch)")
+    timeout: Optional[float] = Field(None, gt=0, description="Seconds the client will wait; tightens any X-Request-Timeout header")
 
 class AgentStatus(BaseModel):
     agent: str = Field(..., description="Agent name (BuildAgent, TestAgent, DeployAgent)")
-    status: str = Field(..., description="Agent status (pending, running, success, failed)")
+    status: str = Field(..., description="Agent status (pending, running, success, failed, skipped, timeout)")
     message: Optional[str] = Field(None, description="Optional status message")
 
 class GenerateResponse(BaseModel):
     code: str = Field(..., description="Generated code")
     statuses: List[AgentStatus] = Field(..., description="Agent execution statuses")
     timestamp: datetime = Field(default_factory=datetime.now, description="Generation timestamp")
+    tokens: Optional[dict] = Field(None, description="Prompt class, prompt/completion token counts and the max_tokens budget")
 
 class ErrorResponse(BaseModel):
     error: str = Field(..., description="Error message")
     detail: Optional[str] = Field(None, description="Detailed error information")
 
 # Configuration
-BLACKBOX_API_URL = "https://api.blackbox.ai/v1/chat/completions"
 BLACKBOX_API_KEY = os.getenv("BLACKBOX_API_KEY", "your-blackbox-api-key-here")
 
 class BlackboxService:
-    """Service class for interacting with Blackbox.ai API"""
+    """Code generation through the provider router (Blackbox first by default)"""
     
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+    SYSTEM_PROMPT = "You are an expert software developer. Generate clean, production-ready code based on the user's requirements. Include comments and follow best practices."
     
-    async def generate_code(self, prompt: str) -> str:
-        """Generate code using Blackbox.ai API"""
-        payload = {
-            "model": "blackbox-code",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are an expert software developer. Generate clean, production-ready code based on the user's requirements. Include comments and follow best practices."
-                },
-                {
-                    "role": "user",
-                    "content": f"Generate code for: {prompt}"
-                }
-            ],
-            "max_tokens": 2000,
-            "temperature": 0.7
-        }
+    # Sampling parameters sent to whichever provider the router picks
+    GENERATION_PARAMS = {"max_tokens": 2000, "temperature": 0.7}
+    
+    def __init__(self, router: ProviderRouter, cache: ResponseCache):
+        self.router = router
+        self.cache = cache
+        self.inflight = SingleFlight()
+    
+    def _build_messages(self, prompt: str) -> List[dict]:
+        """Chat messages for a code generation prompt"""
+        return [
+            {
+                "role": "system",
+                "content": self.SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": f"Generate code for: {prompt}"
+            }
+        ]
+    
+    def _params(self, max_tokens: Optional[int]) -> Dict[str, Any]:
+        """Sampling parameters with this request's completion budget"""
+        return {**self.GENERATION_PARAMS, "max_tokens": max_tokens} if max_tokens else self.GENERATION_PARAMS
+    
+    def _cache_key(self, prompt: str, params: Dict[str, Any]) -> str:
+        return make_cache_key(
+            prompt, "auto", params["temperature"], params["max_tokens"], self.SYSTEM_PROMPT
+        )
+    
+    def _upstream_error(self, e: Exception) -> HTTPException:
+        """Map an upstream failure onto the HTTP error returned to the client"""
+        if isinstance(e, DeadlineExceeded):
+            logger.error("LLM provider did not answer before the request deadline")
+            return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=e.detail)
+        if isinstance(e, httpx.HTTPStatusError):
+            logger.error(f"LLM provider HTTP error: {e.response.status_code}")
+            after = retry_after(e)
+            return HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"External API error: {e.response.status_code}",
+                # Retries are spent; pass the provider's back-off on to the client
+                headers={"Retry-After": str(max(1, round(after)))} if after is not None else None
+            )
+        if isinstance(e, (httpx.RequestError, NoProviderAvailable)):
+            logger.error(f"LLM provider request error: {str(e)}")
+            return HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="External API service unavailable"
+            )
+        logger.error(f"Unexpected API response format: {str(e)}")
+        return HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Invalid response from external API"
+        )
+    
+    async def generate_code(self, prompt: str, max_tokens: Optional[int] = None, ceiling: Optional[int] = None) -> str:
+        """Generate code using the fastest healthy provider
+
+        The cache is keyed on ``ceiling``, the class budget before the quota
+        trimmed ``max_tokens``.
+        """
+        params = self._params(max_tokens)
+        cache_key = self._cache_key(prompt, self._params(ceiling or max_tokens))
+        
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Identical concurrent prompts share one upstream call
+        return await self.inflight.do(cache_key, lambda: self._call_blackbox(prompt, cache_key, params))
+    
+    async def _call_blackbox(self, prompt: str, cache_key: str, params: Dict[str, Any]) -> str:
+        """Single routed upstream call"""
+        started = time.perf_counter()
+        try:
+            generated_code = await self.router.complete(self._build_messages(prompt), params)
+            GENERATION_DURATION.labels("success").observe(time.perf_counter() - started)
+            observe_upstream(time.perf_counter() - started)
+            await self.cache.set(cache_key, generated_code)
+            return generated_code
+            
+        except (httpx.HTTPStatusError, httpx.RequestError, KeyError, NoProviderAvailable, DeadlineExceeded) as e:
+            GENERATION_DURATION.labels("error").observe(time.perf_counter() - started)
+            raise self._upstream_error(e)
+    
+    async def stream_code(
+        self, prompt: str, max_tokens: Optional[int] = None, ceiling: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream generated code deltas from the routed provider as they arrive"""
+        params = self._params(max_tokens)
+        cache_key = self._cache_key(prompt, self._params(ceiling or max_tokens))
+        
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Concurrent identical prompts subscribe to the same token stream
+        async for delta in self.inflight.stream(cache_key, lambda: self._stream_blackbox(prompt, cache_key, params)):
+            yield delta
+    
+    async def _stream_blackbox(self, prompt: str, cache_key: str, params: Dict[str, Any]) -> AsyncIterator[str]:
+        """Single routed upstream stream"""
+        started = time.perf_counter()
+        chunks = []
+        try:
+            async for delta in self.router.stream(self._build_messages(prompt), params):
+                chunks.append(delta)
+                yield delta
+                    
+        except (httpx.HTTPStatusError, httpx.RequestError, KeyError, ValueError, NoProviderAvailable, DeadlineExceeded) as e:
+            GENERATION_DURATION.labels("error").observe(time.perf_counter() - started)
+            raise self._upstream_error(e)
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(
-                    BLACKBOX_API_URL,
-                    json=payload,
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                generated_code = data["choices"][0]["message"]["content"]
-                return generated_code
-                
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Blackbox API HTTP error: {e.response.status_code} - {e.response.text}")
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"External API error: {e.response.status_code}"
-                )
-            except httpx.RequestError as e:
-                logger.error(f"Blackbox API request error: {str(e)}")
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="External API service unavailable"
-                )
-            except KeyError as e:
-                logger.error(f"Unexpected API response format: {str(e)}")
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail="Invalid response from external API"
-                )
+        GENERATION_DURATION.labels("success").observe(time.perf_counter() - started)
+        observe_upstream(time.perf_counter() - started)
+        await self.cache.set(cache_key, "".join(chunks))
 
 class AgentSimulator:
     """Simulates the build, test, and deploy agents"""
     
+    def __init__(self):
+        # Build -> Test -> Deploy, each starting as soon as its predecessor succeeds
+        self.engine = AgentEngine([
+            AgentSpec("BuildAgent", self.simulate_agent),
+            AgentSpec("TestAgent", self.simulate_agent, depends_on=["BuildAgent"]),
+            AgentSpec("DeployAgent", self.simulate_agent, depends_on=["TestAgent"])
+        ])
+    
     @staticmethod
-    async def simulate_agents() -> List[AgentStatus]:
-        """Simulate agent execution with realistic timing"""
-        agents = ["BuildAgent", "TestAgent", "DeployAgent"]
-        statuses = []
+    async def simulate_agent(ctx: AgentContext) -> dict:
+        """Simulate a single agent run with realistic timing"""
+        # Simulated processing time is opt-in (AGENT_SIMULATED_LATENCY)
+        await simulated_delay(0.5)
         
-        for agent in agents:
-            # Simulate processing time
-            await asyncio.sleep(0.5)
-            
-            # Simulate success/failure (90% success rate)
-            import random
-            success = random.random() > 0.1
-            
-            status = AgentStatus(
-                agent=agent,
-                status="success" if success else "failed",
-                message="Completed successfully" if success else "Process encountered an error"
-            )
-            statuses.append(status)
+        # Simulate success/failure (90% success rate)
+        import random
+        success = random.random() > 0.1
         
-        return statuses
+        return {
+            "status": "success" if success else "failed",
+            "message": "Completed successfully" if success else "Process encountered an error"
+        }
+    
+    async def iter_agents(self, prompt: str, code: str, timestamp: Optional[str] = None) -> AsyncIterator[AgentStatusPayload]:
+        """Yield each agent status as soon as that agent finishes"""
+        async for agent, result in self.engine.run(prompt, code, timestamp=timestamp):
+            yield {
+                "agent": agent,
+                "status": result["status"],
+                "message": result.get("message") or result.get("error")
+            }
+    
+    async def simulate_agents(self, prompt: str, code: str, timestamp: Optional[str] = None) -> List[AgentStatusPayload]:
+        """Simulate agent execution with realistic timing"""
+        return [status async for status in self.iter_agents(prompt, code, timestamp)]
+
+def build_fallback_code(prompt: str) -> str:
+    """Mock response used when the Blackbox API key is not configured"""
+    return fallback_templates.render("backend", prompt)
 
 # Initialize services
-blackbox_service = BlackboxService(BLACKBOX_API_KEY)
+provider_router = build_router(upstream, "blackbox,groq", blackbox_api_key=BLACKBOX_API_KEY)
+blackbox_service = BlackboxService(provider_router, response_cache)
+admission = AdaptiveLimiter()
 agent_simulator = AgentSimulator()
+token_accountant = TokenAccountant(BlackboxService.GENERATION_PARAMS["max_tokens"])
 
 @app.get("/", tags=["Health"])
 async def root():
@@ -161,112 +299,244 @@ async def health_check():
             "blackbox_api": "configured" if BLACKBOX_API_KEY != "your-blackbox-api-key-here" else "not_configured",
             "agents": "operational"
         },
+        "providers": provider_router.stats(),
+        "admission": admission.stats(),
+        "upstream_pool": upstream.stats(),
+        "cache": response_cache.stats(),
+        "inflight": blackbox_service.inflight.stats(),
+        "tracing": tracer.stats(),
+        "tokens": token_accountant.stats(),
+        "fallback": fallback_templates.stats(),
+        "history": history.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics", tags=["Health"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated over all workers"""
+    return PlainTextResponse(metrics.render_latest(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+def request_client(http_request: Request) -> str:
+    return client_id(http_request.headers, http_request.client.host if http_request.client else None)
+
+def admit_tokens(client: str, prompt: str) -> TokenGrant:
+    """Completion budget for the prompt, or shed the request with 429 and Retry-After when over quota
+
+    A prompt too large for any quota gets 413, since no retry would succeed.
+    """
+    try:
+        return token_accountant.reserve(client, prompt, blackbox_service._build_messages(prompt))
+    except PromptTooLarge as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def history_error(e: HistoryUnavailable) -> HTTPException:
+    headers = {"WWW-Authenticate": "Bearer"} if e.status_code == 401 else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+def record_history(prompt: str, client: str, response: GenerateResult, started: float, grant: TokenGrant, admission: Dict[str, Any]):
+    """Queue a finished generation for /history, keyed as the response cache would key it"""
+    history.record(
+        prompt,
+        response["code"],
+        client,
+        agents={status["agent"]: status for status in response["statuses"]},
+        telemetry={"tokens": response["tokens"], "admission": admission},
+        duration_ms=(time.perf_counter() - started) * 1000,
+        cache_key=blackbox_service._cache_key(prompt, blackbox_service._params(grant.ceiling))
+    )
+
+async def admit(priority: str, grant: TokenGrant) -> Permit:
+    """Take an admission slot or shed the request with 429/503 and Retry-After"""
+    try:
+        with tracing.span("admission.wait", priority=priority):
+            return await admission.acquire(priority, remaining(), grant.prompt_class)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
 @app.post("/generate", response_model=GenerateResponse, tags=["Code Generation"])
-async def generate_code(request: PromptRequest):
+async def generate_code(request: PromptRequest, http_request: Request):
     """
     Generate code based on the provided prompt using Blackbox.ai API
     
     - **prompt**: The description of what code to generate
+    - **stream**: Return a Server-Sent Events stream instead of a single JSON body
+    - **priority**: Admission priority class when the server is busy
     
     Returns generated code and agent execution statuses
     """
+    tracing.record_since_trace_start("request.parse")
+    started = time.perf_counter()
+    timestamp = datetime.now().isoformat()
+    limit_deadline(request.timeout)
+    client = request_client(http_request)
+    grant = admit_tokens(client, request.prompt)
+    try:
+        permit = await admit(request.priority, grant)
+    except HTTPException:
+        grant.settle("")
+        raise
+    
+    if request.stream:
+        return StreamingResponse(
+            stream_generation(request.prompt, permit, grant, client),
+            media_type=SSE_MEDIA_TYPE,
+            headers=SSE_HEADERS,
+            # Covers a client that disconnects before the stream starts
+            background=BackgroundTask(permit.release)
+        )
+    
     try:
         logger.info(f"Received code generation request: {request.prompt[:100]}...")
         
-        # Validate API key configuration
-        if BLACKBOX_API_KEY == "your-blackbox-api-key-here":
-            logger.warning("Blackbox API key not configured, using fallback")
+        # Validate provider configuration
+        if not provider_router.available():
+            logger.warning("No LLM provider configured, using fallback")
             # Fallback to mock response
-            generated_code = f"""# Generated code for: {request.prompt}
-
-import asyncio
-from typing import List, Dict, Any
-
-class GeneratedSolution:
-    \"\"\"
-    Auto-generated solution based on your requirements:
-    {request.prompt}
-    \"\"\"
-    
-    def __init__(self):
-        self.initialized = True
-        print("Solution initialized successfully")
-    
-    async def execute(self) -> Dict[str, Any]:
-        \"\"\"Execute the main functionality\"\"\"
-        try:
-            # Implementation based on your prompt
-            result = await self._process_request()
-            return {{
-                "status": "success",
-                "data": result,
-                "message": "Operation completed successfully"
-            }}
-        except Exception as e:
-            return {{
-                "status": "error",
-                "error": str(e),
-                "message": "Operation failed"
-            }}
-    
-    async def _process_request(self) -> Any:
-        \"\"\"Process the specific request\"\"\"
-        # TODO: Implement specific logic for: {request.prompt}
-        await asyncio.sleep(0.1)  # Simulate processing
-        return "Generated solution ready"
-
-# Usage example
-if __name__ == "__main__":
-    solution = GeneratedSolution()
-    result = asyncio.run(solution.execute())
-    print(f"Result: {{result}}")
-"""
+            generated_code = build_fallback_code(request.prompt)
         else:
             # Use Blackbox.ai API
-            generated_code = await blackbox_service.generate_code(request.prompt)
+            with tracing.span("llm.generate"):
+                generated_code = await blackbox_service.generate_code(request.prompt, grant.max_tokens, grant.ceiling)
         
         # Simulate agent execution
-        agent_statuses = await agent_simulator.simulate_agents()
+        agent_statuses = await agent_simulator.simulate_agents(request.prompt, generated_code, timestamp)
         
-        response = GenerateResponse(
-            code=generated_code,
-            statuses=agent_statuses
-        )
+        response: GenerateResult = {
+            "code": generated_code,
+            "statuses": agent_statuses,
+            "timestamp": timestamp,
+            "tokens": grant.settle(generated_code)
+        }
         
         logger.info("Code generation completed successfully")
-        return response
+        admission_snapshot = permit.snapshot()
+        permit.release()
+        record_history(request.prompt, client, response, started, grant, admission_snapshot)
+        with tracing.span("response.serialize"):
+            return FastJSONResponse(response)
         
     except HTTPException:
         # Re-raise HTTP exceptions
+        permit.release(overloaded=True)
+        grant.settle("")
         raise
     except Exception as e:
+        permit.release(overloaded=True)
+        grant.settle("")
         logger.error(f"Unexpected error during code generation: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error during code generation"
         )
 
+async def stream_generation(prompt: str, permit: Permit, grant: TokenGrant, client: str) -> AsyncIterator[str]:
+    """Server-Sent Events stream: token deltas, agent statuses, then done"""
+    logger.info(f"Received streaming code generation request: {prompt[:100]}...")
+    started = time.perf_counter()
+    timestamp = datetime.now().isoformat()
+    chunks = []
+    statuses = []
+    try:
+        if not provider_router.available():
+            logger.warning("No LLM provider configured, using fallback")
+            generated_code = build_fallback_code(prompt)
+            chunks.append(generated_code)
+            yield sse_event("token", {"delta": generated_code})
+        else:
+            async for delta in blackbox_service.stream_code(prompt, grant.max_tokens, grant.ceiling):
+                chunks.append(delta)
+                yield sse_event("token", {"delta": delta})
+            generated_code = "".join(chunks)
+        
+        async for agent_status in agent_simulator.iter_agents(prompt, generated_code, timestamp):
+            statuses.append(agent_status)
+            yield sse_event("agent", agent_status)
+        
+        admission_snapshot = permit.snapshot()
+        permit.release()
+        tokens = grant.settle(generated_code)
+        yield sse_event("done", {"admission": admission_snapshot, "tokens": tokens, "timestamp": timestamp})
+        response: GenerateResult = {"code": generated_code, "statuses": statuses, "timestamp": timestamp, "tokens": tokens}
+        record_history(prompt, client, response, started, grant, admission_snapshot)
+        
+    except HTTPException as e:
+        permit.release(overloaded=True)
+        yield sse_event("error", {"error": e.detail, "status_code": e.status_code})
+    except Exception as e:
+        permit.release(overloaded=True)
+        logger.error(f"Unexpected error during streaming generation: {str(e)}")
+        yield sse_event("error", {"error": "Internal server error during code generation", "status_code": 500})
+    finally:
+        permit.release()
+        # Charges only what was streamed before a failure or disconnect
+        grant.settle("".join(chunks))
+
+@app.get("/history", tags=["History"])
+async def list_history(
+    http_request: Request,
+    limit: int = HISTORY_PAGE_SIZE,
+    before: Optional[int] = None,
+    q: Optional[str] = None
+):
+    """
+    The caller's past generations, newest first
+    
+    - **limit**: Entries per page
+    - **before**: `next_before` from the previous page
+    - **q**: Only entries whose prompt or code contains every term
+    """
+    try:
+        return await history.page(history_caller(http_request.headers.get("Authorization")), limit, before, q)
+    except HistoryUnavailable as e:
+        raise history_error(e)
+
+@app.get("/history/{entry_id}", tags=["History"])
+async def get_history(entry_id: int, http_request: Request):
+    """One past generation with its code, agent statuses and token usage"""
+    try:
+        entry = await history.get(entry_id, history_caller(http_request.headers.get("Authorization")))
+    except HistoryUnavailable as e:
+        raise history_error(e)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return entry
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """Custom HTTP exception handler"""
-    return {
-        "error": exc.detail,
-        "status_code": exc.status_code,
-        "timestamp": datetime.now().isoformat()
-    }
+    return FastJSONResponse(
+        status_code=exc.status_code,
+        content={
+            "error": exc.detail,
+            "status_code": exc.status_code,
+            "timestamp": datetime.now().isoformat()
+        },
+        # Keeps Retry-After on shed requests
+        headers=getattr(exc, "headers", None)
+    )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """General exception handler"""
     logger.error(f"Unhandled exception: {str(exc)}")
-    return {
-        "error": "Internal server error",
-        "detail": "An unexpected error occurred",
-        "timestamp": datetime.now().isoformat()
-    }
+    return FastJSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={
+            "error": "Internal server error",
+            "detail": "An unexpected error occurred",
+            "timestamp": datetime.now().isoformat()
+        }
+    )
 
 if __name__ == "__main__":
     import uvicorn
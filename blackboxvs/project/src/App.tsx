@@ -21,6 +21,37 @@ interface HistoryItem {
   statuses: AgentStatus[];
 }
 
+// Reads a Server-Sent Events body, invoking onEvent for each complete frame
+async function readEventStream(
+  body: ReadableStream<Uint8Array>,
+  onEvent: (event: string, data: any) => void
+) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
 function App() {
   const [isLoading, setIsLoading] = useState(true);
   const [prompt, setPrompt] = useState('');
@@ -53,64 +84,57 @@ function App() {
     setAgentStatuses(initialStatuses);
 
     try {
-      // Call the backend
+      // Call the backend in streaming mode so code renders from the first token
       const response = await fetch('http://localhost:8000/generate', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify({
-          prompt: prompt
+          prompt: prompt,
+          stream: true
         })
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      // Update with real generated code
-      setGeneratedCode(data.code);
-
-      // Simulate progressive agent updates
-      const agents = ['BuildAgent', 'TestAgent', 'DeployAgent'];
-      
-      for (let i = 0; i < agents.length; i++) {
-        await new Promise(resolve => setTimeout(resolve, 800));
-        
-        setAgentStatuses(prev => prev.map(status => 
-          status.agent === agents[i] 
-            ? { ...status, status: 'running' }
-            : status
-        ));
+      let code = '';
+      let statuses = initialStatuses;
 
-        await new Promise(resolve => setTimeout(resolve, 1200));
-        
-        // Use real agent data if available
-        const agentResult = data.statuses?.find((s: any) => s.agent === agents[i]);
-        const finalStatus = agentResult?.status === 'success' ? 'success' : 
-                           (Math.random() > 0.1 ? 'success' : 'failed');
-        
-        setAgentStatuses(prev => prev.map(status => 
-          status.agent === agents[i] 
-            ? { 
-                ...status, 
-                status: finalStatus,
-                message: agentResult?.message || 
-                        (finalStatus === 'success' ? 'Completed successfully' : 'Process failed')
-              }
-            : status
-        ));
-      }
+      await readEventStream(response.body, (event, data) => {
+        if (event === 'token') {
+          code += data.delta;
+          setGeneratedCode(code);
+        } else if (event === 'agent') {
+          // Generation is finished once agent results start arriving
+          statuses = statuses.map(status =>
+            status.agent === data.agent
+              ? {
+                  ...status,
+                  status: data.status === 'success' ? 'success' : 'failed',
+                  message: data.message ||
+                          (data.status === 'success' ? 'Completed successfully' : 'Process failed')
+                }
+              : status.status === 'pending'
+                ? { ...status, status: 'running' }
+                : status
+          );
+          setAgentStatuses(statuses);
+        } else if (event === 'error') {
+          throw new Error(data.error);
+        }
+      });
 
       // Add to history
       const historyItem: HistoryItem = {
         id: Date.now().toString(),
         prompt,
         timestamp: new Date(),
-        code: data.code,
-        statuses: agentStatuses
+        code,
+        statuses
       };
       
       setHistory(prev => [historyItem, ...prev.slice(0, 9)]);